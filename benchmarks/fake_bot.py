@@ -0,0 +1,23 @@
+import asyncio
+
+class FakeBot:
+    # stands in for telegram.Bot in benchmarks; answers instantly or after a fixed latency
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.id = 1
+        self.sent = 0
+        self.done = None
+        self.expected = 0
+
+    def expect(self, count):
+        self.sent = 0
+        self.expected = count
+        self.done = asyncio.get_running_loop().create_future()
+        return self.done
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        if self.sent == self.expected and not self.done.done():
+            self.done.set_result(None)
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import itertools
+import time
+import urllib.parse
+import orjson
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+
+class FakeBotAPI:
+    # a local stand-in for api.telegram.org: answers every Bot API method the bot calls, optionally after a
+    # fixed latency, and counts the calls; point TELEGRAM_API_BASE_URL at http://host:port/bot to use it
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self.server = None
+        self.message_ids = itertools.count(1)
+        self.waiting = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def expect(self, method, count):
+        # a future resolved once `method` has been called `count` times in total
+        self.waiting = (method, count, asyncio.get_running_loop().create_future())
+        self._check()
+        return self.waiting[2]
+
+    def _check(self):
+        if self.waiting is not None:
+            method, count, future = self.waiting
+            if self.calls.get(method, 0) >= count and not future.done():
+                future.set_result(None)
+
+    def answer(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            message = {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            return message
+        if method == "getChat":
+            chat_id = int(params.get("chat_id", 0))
+            if chat_id > 0:
+                return {"id": chat_id, "type": "private", "first_name": "Benchmark"}
+            return {"id": chat_id, "type": "supergroup", "title": f"Benchmark group {-chat_id}", "accent_color_id": 0, "max_reaction_count": 11}
+        # setWebhook, deleteWebhook, answerCallbackQuery, ... only need a success
+        return True
+
+    async def _handle(self, reader, writer):
+        # HTTP/1.1 with keep-alive, which is how the bot's httpx client talks to the Bot API
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method = request_line.decode("latin-1").split()[1].rsplit("/", 1)[-1].split("?")[0]
+                content_type = headers.get("content-type", "")
+                if content_type.startswith("application/json") and body:
+                    params = orjson.loads(body)
+                elif content_type.startswith("application/x-www-form-urlencoded"):
+                    params = dict(urllib.parse.parse_qsl(body.decode("utf-8")))
+                else:
+                    params = {}
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                self.calls[method] = self.calls.get(method, 0) + 1
+                payload = orjson.dumps({"ok": True, "result": self.answer(method, params)})
+                writer.write(
+                    f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                self._check()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(host, port, latency):
+    api = FakeBotAPI(latency)
+    port = await api.start(host, port)
+    print(f"Fake Bot API on http://{host}:{port}/bot (latency {latency * 1000:.0f}ms)")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake Telegram Bot API for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each answer")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.latency))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,64 @@
+import datetime
+import random
+from persiantools.jdatetime import JalaliDate
+from utils.constants import DAYS_OF_WEEK
+from utils.models import Reminder, UserRecord, weekdays_to_mask
+
+DEFAULT_MIX = {"everyday": 40, "weekly": 15, "weekdays": 15, "monthly": 10, "once": 10, "multi_date": 10}
+
+MESSAGES = [
+    "جلسه تیم",
+    "قرص‌هاتو بخور",
+    "تولد مامان",
+    "ورزش صبحگاهی",
+    "پرداخت قبض برق",
+    "مرور درس‌ها قبل از امتحان",
+]
+
+def parse_mix(text):
+    # "everyday=40,once=10" -> {"everyday": 40, "once": 10}
+    mix = {}
+    for item in text.split(","):
+        frequency, _, weight = item.partition("=")
+        if frequency not in DEFAULT_MIX:
+            raise ValueError(f"Unknown frequency in mix: {frequency}")
+        mix[frequency] = float(weight)
+    return mix
+
+def random_jalali_ordinal(rng, today):
+    # a day of this or next Jalali year, the way users type dates
+    year = JalaliDate(today).year + rng.randrange(2)
+    month = rng.randrange(1, 13)
+    day = rng.randrange(1, JalaliDate.days_in_month(month, year) + 1)
+    return JalaliDate(year, month, day).to_gregorian().toordinal()
+
+def generate_reminder(rng, reminder_id, user_id, frequency, today):
+    chat_id = user_id if rng.random() < 0.8 else -1000000000000 - rng.randrange(10000)
+    reminder = Reminder(reminder_id, chat_id, rng.choice(MESSAGES), frequency, rng.randrange(24) * 60 + rng.choice((0, 15, 30, 45)))
+    if frequency == "weekly":
+        reminder.weekdays = weekdays_to_mask([rng.choice(DAYS_OF_WEEK)])
+    elif frequency == "weekdays":
+        reminder.weekdays = weekdays_to_mask(rng.sample(DAYS_OF_WEEK, rng.randrange(2, 6)))
+    elif frequency == "monthly":
+        reminder.monthly_day = rng.randrange(1, 32)
+    elif frequency == "once":
+        reminder.dates = (random_jalali_ordinal(rng, today),)
+    elif frequency == "multi_date":
+        reminder.dates = tuple(sorted({random_jalali_ordinal(rng, today) for _ in range(rng.randrange(2, 6))}))
+    return reminder
+
+def generate_users(users, reminders_per_user, mix=None, seed=0):
+    # {str(user_id): UserRecord} with user ids 1..users, so a larger data set contains every smaller one
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    frequencies = list(mix)
+    weights = [mix[f] for f in frequencies]
+    today = datetime.date.today()
+    data = {}
+    for user_id in range(1, users + 1):
+        reminders = [
+            generate_reminder(rng, reminder_id, user_id, frequency, today)
+            for reminder_id, frequency in enumerate(rng.choices(frequencies, weights, k=reminders_per_user), 1)
+        ]
+        data[str(user_id)] = UserRecord(reminders)
+    return data
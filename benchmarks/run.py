@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark storage, scheduling and dispatch on synthetic reminders")
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma separated numbers of users; storage is measured at each size")
+    parser.add_argument("--reminders-per-user", type=int, default=10)
+    parser.add_argument("--mix", default=None, help="frequency weights, e.g. everyday=40,weekly=15,weekdays=15,monthly=10,once=10,multi_date=10")
+    parser.add_argument("--backend", default="json", choices=["json", "sqlite", "journal"])
+    parser.add_argument("--samples", type=int, default=200, help="users sampled for load/save latency at each size")
+    parser.add_argument("--sends", type=int, default=5000, help="reminders pushed through send_reminder")
+    parser.add_argument("--renders", type=int, default=2000, help="reminder list pages and weekday keyboards rendered")
+    parser.add_argument("--updates", type=int, default=2000, help="updates posted to the webhook, answered through a local fake Bot API")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds the fake Bot API waits before each answer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="result file, default benchmarks/results/<commit>-<backend>.json")
+    return parser.parse_args()
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def summarize(seconds):
+    ms = sorted(s * 1000 for s in seconds)
+    return {
+        "mean": statistics.fmean(ms),
+        "p50": ms[len(ms) // 2],
+        "p95": ms[min(len(ms) - 1, int(len(ms) * 0.95))],
+        "max": ms[-1],
+    }
+
+def storage_bytes(backend):
+    from utils.constants import DATA_FILE, DB_FILE, JOURNAL_FILE
+    paths = {"json": [DATA_FILE], "sqlite": [DB_FILE, f"{DB_FILE}-wal"], "journal": [DATA_FILE, JOURNAL_FILE]}[backend]
+    return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+async def bench_storage(args, sizes, mix):
+    from benchmarks.generate import generate_users
+    from utils import data as user_data
+    from utils.storage import get_storage
+    rng = random.Random(args.seed)
+    results = []
+    for users in sizes:
+        records = generate_users(users, args.reminders_per_user, mix, args.seed)
+        get_storage().put_users(records)
+        user_data._cache.clear()
+        sample = [rng.randrange(1, users + 1) for _ in range(min(args.samples, users))]
+
+        cold, warm, save = [], [], []
+        for user_id in sample:
+            started = time.perf_counter()
+            await user_data.load_user_data(user_id)
+            cold.append(time.perf_counter() - started)
+        for user_id in sample:
+            started = time.perf_counter()
+            reminder = (await user_data.load_user_data(user_id))["reminders"][0]
+            warm.append(time.perf_counter() - started)
+            reminder.message += "!"
+            started = time.perf_counter()
+            await user_data.put_reminder(user_id, reminder)
+            save.append(time.perf_counter() - started)
+
+        pending = len(user_data._dirty)
+        started = time.perf_counter()
+        user_data.flush_user_data()
+        if user_data._write_queue is not None:
+            await user_data._write_queue.join()
+        flush = time.perf_counter() - started
+
+        results.append({
+            "users": users,
+            "reminders": users * args.reminders_per_user,
+            "storage_bytes": storage_bytes(args.backend),
+            "load_cold_ms": summarize(cold),
+            "load_warm_ms": summarize(warm),
+            "save_ms": summarize(save),
+            "flush_ms": flush * 1000,
+            # dirty users left for the final flush; earlier ones were flushed in the background
+            "flush_pending_users": pending,
+        })
+        print(f"storage {users} users: cold load p50 {results[-1]['load_cold_ms']['p50']:.3f}ms, flush {flush * 1000:.1f}ms", file=sys.stderr)
+    return results
+
+async def bench_scheduling(records):
+    import scheduler
+    results = {}
+    frequency_of = {(int(user_id), r.id): r.frequency for user_id, record in records.items() for r in record.reminders}
+    for engine in ("apscheduler", "tick"):
+        scheduler.use_dispatch_engine(engine)
+        started = time.perf_counter()
+        count = await scheduler.schedule_all_reminders(records)
+        wall = time.perf_counter() - started
+
+        # a second pass under tracemalloc, which slows it down too much to time the first one
+        tracemalloc.start()
+        await scheduler.schedule_all_reminders(records)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        if engine == "tick":
+            jobs = collections.Counter(frequency_of[key] for key in scheduler.tick_dispatcher.entries)
+            index_keys = sum(len(keys) for keys in scheduler.tick_dispatcher.entries.values())
+        else:
+            jobs = collections.Counter(job.name for job in scheduler.scheduler.get_jobs() if job.func is scheduler.send_reminder)
+            index_keys = None
+        reminders = collections.Counter(frequency_of.values())
+        results[engine] = {
+            "reminders": count,
+            "wall_s": wall,
+            "reminders_per_s": count / wall if wall else None,
+            "retained_bytes": retained,
+            "peak_bytes": peak,
+            "jobs_by_frequency": dict(jobs),
+            "reminders_by_frequency": dict(reminders),
+            "index_keys": index_keys,
+        }
+        print(f"scheduling ({engine}): {count} reminders in {wall:.2f}s, {retained / count:.0f} bytes retained per reminder", file=sys.stderr)
+    scheduler.scheduler.remove_all_jobs()
+    scheduler.use_dispatch_engine("apscheduler")
+    return results
+
+async def bench_dispatch(sends):
+    import scheduler
+    from benchmarks.fake_bot import FakeBot
+    from delivery import DeliveryQueue, TokenBucket
+    bot = FakeBot()
+    queue = DeliveryQueue(bot, outbox_path="bench_outbox.log", dead_letter_path="bench_dead_letters.jsonl")
+    # measure the pipeline itself, not Telegram's limits; every send goes to its own chat
+    queue.global_bucket = TokenBucket(1e9, 1e9)
+    scheduler.delivery_queue = queue
+    queue.start()
+    done = bot.expect(sends)
+
+    started = time.perf_counter()
+    for i in range(sends):
+        await scheduler.send_reminder(1000000 + i, i, "یادآوری بنچمارک")
+    enqueued = time.perf_counter() - started
+    await done
+    delivered = time.perf_counter() - started
+    await queue.stop()
+    print(f"dispatch: {sends / delivered:.0f} reminders/s delivered", file=sys.stderr)
+    return {
+        "sends": sends,
+        "enqueue_per_s": sends / enqueued,
+        "delivered_per_s": sends / delivered,
+        "stats": queue.stats,
+    }
+
+async def bench_rendering(records, renders):
+    # the reply markup and text work of the busiest handlers: a page of /listReminders and a weekday toggle
+    from handlers.commands import render_reminders_page
+    from utils.chat_cache import set_chat_title
+    from utils.constants import DAYS_OF_WEEK
+    from utils.keyboards import build_weekdays_keyboard
+    users = [(int(user_id), record.reminders) for user_id, record in records.items()]
+    for _, reminders in users:
+        for r in reminders:
+            set_chat_title(r.chat_id, "گروه بنچمارک")
+    rng = random.Random(0)
+    selections = [set(rng.sample(DAYS_OF_WEEK, rng.randrange(8))) for _ in range(renders)]
+
+    async def render_pages():
+        for i in range(renders):
+            user_id, reminders = users[i % len(users)]
+            await render_reminders_page(None, user_id, reminders, 0)
+
+    def render_keyboards():
+        for selected in selections:
+            build_weekdays_keyboard(selected)
+
+    results = {}
+    for name, run in (("list_page", render_pages), ("weekdays_keyboard", render_keyboards)):
+        started = time.perf_counter()
+        result = run()
+        if result is not None:
+            await result
+        wall = time.perf_counter() - started
+        # a second pass under tracemalloc; the bytes allocated by each render are the peak above the start
+        tracemalloc.start()
+        result = run()
+        if result is not None:
+            await result
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {
+            "renders": renders,
+            "us_per_render": wall / renders * 1e6,
+            "peak_bytes": peak,
+        }
+        print(f"rendering ({name}): {wall / renders * 1e6:.1f}us per render", file=sys.stderr)
+    return results
+
+def webhook_update(update_id, user_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": "Benchmark"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Benchmark"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+async def bench_webhook(args, users):
+    # the webhook path end to end: POST to the webhook server, dispatch through the registered handlers and
+    # their replies to the fake Bot API; reminder scheduling at startup (post_init) is not part of it
+    import httpx
+    import main
+    from benchmarks.fake_bot_api import FakeBotAPI
+    from utils.constants import WEBHOOK_MAX_CONNECTIONS
+    api = FakeBotAPI(args.api_latency)
+    await api.start(port=args.api_port)
+    app = main.build_application()
+    port = free_port()
+    await app.initialize()
+    await app.updater.start_webhook(listen="127.0.0.1", port=port, url_path="telegram")
+    await app.start()
+
+    # half /start, which only replies, and half the reminder list, which reads the user's reminders first
+    rng = random.Random(args.seed)
+    updates = [
+        webhook_update(i, rng.randrange(1, users + 1), "/start" if i % 2 else "نمایش همه یادآورها")
+        for i in range(1, args.updates + 1)
+    ]
+    replies = api.expect("sendMessage", api.calls.get("sendMessage", 0) + len(updates))
+    # Telegram opens at most max_connections connections to a webhook
+    slots = asyncio.Semaphore(WEBHOOK_MAX_CONNECTIONS)
+    acked = []
+
+    async def post(client, update):
+        async with slots:
+            started = time.perf_counter()
+            response = await client.post(f"http://127.0.0.1:{port}/telegram", content=json.dumps(update), headers={"Content-Type": "application/json"})
+            response.raise_for_status()
+            acked.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=WEBHOOK_MAX_CONNECTIONS)) as client:
+        await asyncio.gather(*(post(client, update) for update in updates))
+        posted = time.perf_counter() - started
+        await replies
+    answered = time.perf_counter() - started
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    await api.stop()
+    print(f"webhook: {len(updates) / answered:.0f} updates/s answered, ack p95 {summarize(acked)['p95']:.2f}ms", file=sys.stderr)
+    return {
+        "updates": len(updates),
+        "api_latency_s": args.api_latency,
+        "posted_per_s": len(updates) / posted,
+        "answered_per_s": len(updates) / answered,
+        "ack_ms": summarize(acked),
+        "api_calls": dict(api.calls),
+    }
+
+async def run_all(args):
+    from benchmarks.generate import DEFAULT_MIX, generate_users, parse_mix
+    import scheduler
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    scheduler.scheduler.start(paused=True)
+    storage = await bench_storage(args, sizes, mix)
+    scheduling = await bench_scheduling(generate_users(sizes[-1], args.reminders_per_user, mix, args.seed))
+    dispatch = await bench_dispatch(args.sends)
+    rendering = await bench_rendering(generate_users(min(sizes[-1], 1000), args.reminders_per_user, mix, args.seed), args.renders)
+    webhook = await bench_webhook(args, sizes[-1])
+    scheduler.scheduler.shutdown(wait=False)
+    return {
+        "params": {
+            "sizes": sizes,
+            "reminders_per_user": args.reminders_per_user,
+            "mix": mix,
+            "backend": args.backend,
+            "samples": args.samples,
+            "sends": args.sends,
+            "renders": args.renders,
+            "updates": args.updates,
+            "api_latency": args.api_latency,
+            "seed": args.seed,
+        },
+        "storage": storage,
+        "scheduling": scheduling,
+        "dispatch": dispatch,
+        "rendering": rendering,
+        "webhook": webhook,
+    }
+
+def main():
+    args = parse_args()
+    commit = git_commit()
+    output = args.output or os.path.join(REPO_DIR, "benchmarks", "results", f"{commit or 'local'}-{args.backend}.json")
+    output = os.path.abspath(output)
+
+    # the bot keeps its files in the working directory, so run in a scratch one
+    os.chdir(tempfile.mkdtemp(prefix="reminder-bench-"))
+    sys.path.insert(0, REPO_DIR)
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ.setdefault("TELEGRAM_TOKEN", "0:benchmark")
+    # every Bot API call, of the webhook scenario and of the scheduler's bot, goes to the local fake
+    args.api_port = free_port()
+    os.environ["TELEGRAM_API_BASE_URL"] = f"http://127.0.0.1:{args.api_port}/bot"
+
+    report = {
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    report.update(asyncio.run(run_all(args)))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import asyncio
+import datetime
+import itertools
+import logging
+import os
+import sys
+import time
+import uuid
+import orjson
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from utils.constants import (
+    GLOBAL_SEND_RATE, PRIVATE_CHAT_SEND_RATE, GROUP_SEND_RATE_PER_MINUTE, CATCH_UP_SEND_RATE, SEND_CONCURRENCY,
+    OUTBOX_FILE, DEAD_LETTER_FILE, MAX_SEND_ATTEMPTS, MAX_THROTTLED_SENDS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+)
+from utils.log import log_event
+from utils.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+send_lag = Histogram(
+    "reminder_bot_send_lag_seconds", "Seconds between a reminder's scheduled time and its delivery", ["lane"],
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600, 21600, 86400)
+)
+send_errors = Counter("reminder_bot_send_errors", "Failed send_message calls by exception type", ["error"])
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds):
+        # no tokens are handed out for the next seconds, e.g. while Telegram asks the bot to back off
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def take(self):
+        # consumes a token and returns 0, or returns how many seconds until one is available
+        paused = self.paused_until - time.monotonic()
+        if paused > 0:
+            return paused
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+class Outbox:
+    COMPACT_AFTER = 10000
+
+    def __init__(self, path=OUTBOX_FILE, dead_letter_path=DEAD_LETTER_FILE):
+        self.path = path
+        self.dead_letter_path = dead_letter_path
+        self.pending = {}
+        self.closed = False
+        # every write goes through one writer task, so appends and compactions reach the disk in order
+        self.writes = None
+        self.writer = None
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        break
+                    if record["op"] == "add":
+                        self.pending[record["id"]] = record["entry"]
+                    elif record["op"] == "retry":
+                        if record["id"] in self.pending:
+                            self.pending[record["id"]].update(attempts=record["attempts"], throttled=record["throttled"])
+                    else:
+                        self.pending.pop(record["id"], None)
+        self.log = None
+        self.lines = len(self.pending)
+        self._rewrite(self._snapshot())
+
+    def _submit(self, op, payload):
+        if self.writer is None:
+            self.writes = asyncio.Queue()
+            self.writer = asyncio.create_task(self._run_writer())
+        self.writes.put_nowait((op, payload))
+
+    async def _run_writer(self):
+        while True:
+            # everything queued meanwhile, e.g. all reminders of one minute, is written with one fsync
+            batch = [await self.writes.get()]
+            while not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                logger.error("Error writing %s: %s", self.path, e)
+            finally:
+                for _ in batch:
+                    self.writes.task_done()
+
+    def _write_batch(self, batch):
+        # runs in a worker thread
+        dead_letters = []
+        for op, payload in batch:
+            if op == "append":
+                self.log.write(payload)
+            elif op == "dead":
+                dead_letters.append(payload)
+            else:
+                self._rewrite(payload)
+        if dead_letters:
+            with open(self.dead_letter_path, "ab") as f:
+                f.write(b"".join(dead_letters))
+                f.flush()
+                os.fsync(f.fileno())
+        self.log.flush()
+        os.fsync(self.log.fileno())
+
+    def _append(self, record):
+        if self.closed:
+            # sends that finish after shutdown stay pending and are retried on the next start
+            return
+        self.lines += 1
+        self._submit("append", orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE))
+
+    def _snapshot(self):
+        return b"".join(
+            orjson.dumps({"op": "add", "id": delivery_id, "entry": entry}, option=orjson.OPT_APPEND_NEWLINE)
+            for delivery_id, entry in self.pending.items()
+        )
+
+    def _rewrite(self, data):
+        if self.log is not None:
+            self.log.close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.log = open(self.path, "ab")
+
+    def _compact(self):
+        self.lines = len(self.pending)
+        self._submit("compact", self._snapshot())
+
+    def add(self, entry):
+        self.pending[entry["id"]] = entry
+        self._append({"op": "add", "id": entry["id"], "entry": entry})
+
+    def retry(self, entry):
+        # entries are kept up to date in memory, so compaction writes the counts along with them
+        self._append({"op": "retry", "id": entry["id"], "attempts": entry["attempts"], "throttled": entry.get("throttled", 0)})
+
+    def done(self, delivery_id):
+        self.pending.pop(delivery_id, None)
+        self._append({"op": "done", "id": delivery_id})
+        if self.lines >= self.COMPACT_AFTER and len(self.pending) * 2 < self.lines:
+            self._compact()
+
+    def dead(self, entry, error):
+        if not self.closed:
+            self._submit("dead", orjson.dumps(dict(entry, error=error, failed_at=time.time()), option=orjson.OPT_APPEND_NEWLINE))
+        self.done(entry["id"])
+
+    async def close(self):
+        self.closed = True
+        if self.writer is not None:
+            await self.writes.join()
+            self.writer.cancel()
+            self.writer = None
+        await asyncio.to_thread(self.log.close)
+
+def load_dead_letters(path=DEAD_LETTER_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        return [orjson.loads(line) for line in f if line.strip()]
+
+class DeliveryQueue:
+    MAX_IDLE_CHAT_BUCKETS = 10000
+
+    def __init__(self, bot, outbox_path=OUTBOX_FILE, dead_letter_path=DEAD_LETTER_FILE):
+        self.bot = bot
+        self.outbox_path = outbox_path
+        self.dead_letter_path = dead_letter_path
+        self.outbox = None
+        self.queue = None
+        self.catch_up_queue = None
+        self.worker = None
+        self.catch_up_worker = None
+        # sends in flight; the event loop only keeps weak references to tasks, so they are held here
+        self.sending = set()
+        self.send_slots = None
+        self.counter = itertools.count()
+        self.global_bucket = TokenBucket(GLOBAL_SEND_RATE, GLOBAL_SEND_RATE)
+        self.catch_up_bucket = TokenBucket(CATCH_UP_SEND_RATE, 1)
+        self.chat_buckets = {}
+        self.stats = {"sent": 0, "caught_up": 0, "retried": 0, "throttled": 0, "dead": 0, "total_lag": 0.0, "max_lag": 0.0}
+
+    def start(self):
+        if self.worker is None:
+            self.queue = asyncio.PriorityQueue()
+            self.catch_up_queue = asyncio.Queue()
+            self.send_slots = asyncio.Semaphore(SEND_CONCURRENCY)
+            self.outbox = Outbox(self.outbox_path, self.dead_letter_path)
+            for entry in self.outbox.pending.values():
+                self._admit(entry)
+            if self.outbox.pending:
+                logger.info("Requeued %s undelivered reminders from %s", len(self.outbox.pending), self.outbox_path)
+            self.worker = asyncio.create_task(self._run())
+            self.catch_up_worker = asyncio.create_task(self._run_catch_up())
+
+    async def stop(self):
+        if self.worker is not None:
+            for task in (self.worker, self.catch_up_worker):
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            self.worker = None
+            self.catch_up_worker = None
+            # let sends already handed to Telegram finish so their outcome is recorded
+            await asyncio.gather(*self.sending, return_exceptions=True)
+            # anything still pending stays in the outbox and is requeued on the next start
+            await self.outbox.close()
+
+    def enqueue(self, chat_id, reminder_id, text, scheduled_at, catch_up=False):
+        self.start()
+        entry = {
+            "id": uuid.uuid4().hex,
+            "chat_id": chat_id,
+            "reminder_id": reminder_id,
+            "text": text,
+            "scheduled_at": scheduled_at,
+            "attempts": 0,
+            "throttled": 0,
+            "catch_up": catch_up,
+        }
+        self.outbox.add(entry)
+        self._admit(entry)
+
+    def _admit(self, entry):
+        if entry.get("catch_up"):
+            self.catch_up_queue.put_nowait(entry)
+        else:
+            self._put(entry)
+
+    def _put(self, entry):
+        # earliest scheduled time goes first; the counter keeps FIFO order within the same minute
+        self.queue.put_nowait((entry["scheduled_at"], next(self.counter), entry))
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_IDLE_CHAT_BUCKETS:
+                self.chat_buckets = {c: b for c, b in self.chat_buckets.items() if not b.is_full()}
+            if chat_id < 0:
+                bucket = TokenBucket(GROUP_SEND_RATE_PER_MINUTE / 60, 1)
+            else:
+                bucket = TokenBucket(PRIVATE_CHAT_SEND_RATE, 1)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            entry = item[2]
+            wait = self._chat_bucket(entry["chat_id"]).take()
+            if wait > 0:
+                # this chat is over its limit; park the item instead of blocking other chats
+                loop.call_later(wait, self.queue.put_nowait, item)
+                continue
+            wait = self.global_bucket.take()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.global_bucket.take()
+            await self.send_slots.acquire()
+            task = asyncio.create_task(self._send(entry))
+            self.sending.add(task)
+            task.add_done_callback(self._sent)
+
+    def _sent(self, task):
+        self.sending.discard(task)
+        self.send_slots.release()
+
+    async def _run_catch_up(self):
+        # runs missed during downtime trickle into the main queue, so live reminders keep most of the budget
+        while True:
+            entry = await self.catch_up_queue.get()
+            wait = self.catch_up_bucket.take()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.catch_up_bucket.take()
+            self._put(entry)
+
+    def _retry_later(self, entry, delay, error):
+        entry["attempts"] += 1
+        if entry["attempts"] >= MAX_SEND_ATTEMPTS:
+            self._dead(entry, error)
+            return
+        self.stats["retried"] += 1
+        self.outbox.retry(entry)
+        log_event(logger, "reminder.retry", logging.WARNING, reminder_id=entry["reminder_id"], chat_id=entry["chat_id"],
+                  delay=round(delay, 1), attempt=entry["attempts"], error=error)
+        asyncio.get_running_loop().call_later(delay, self._put, entry)
+
+    def _throttled(self, entry, retry_after, error):
+        # flood control is not a failed send: every send the bucket lets through would hit it too, so the
+        # bucket pauses and the entry waits without using up an attempt. Groups are limited per chat, other
+        # floods apply to the whole bot
+        chat_id = entry["chat_id"]
+        if chat_id < 0:
+            self._chat_bucket(chat_id).pause(retry_after)
+        else:
+            self.global_bucket.pause(retry_after)
+        entry["throttled"] = entry.get("throttled", 0) + 1
+        if entry["throttled"] >= MAX_THROTTLED_SENDS:
+            self._dead(entry, error)
+            return
+        self.stats["throttled"] += 1
+        self.outbox.retry(entry)
+        log_event(logger, "reminder.throttled", logging.WARNING, reminder_id=entry["reminder_id"], chat_id=chat_id,
+                  delay=round(retry_after, 1), throttled=entry["throttled"])
+        asyncio.get_running_loop().call_later(retry_after, self._put, entry)
+
+    def _dead(self, entry, error):
+        self.stats["dead"] += 1
+        self.outbox.dead(entry, error)
+        log_event(logger, "reminder.dead", logging.ERROR, reminder_id=entry["reminder_id"], chat_id=entry["chat_id"],
+                  attempts=entry["attempts"], error=error)
+
+    async def _send(self, entry):
+        chat_id = entry["chat_id"]
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=entry["text"])
+        except RetryAfter as e:
+            send_errors.labels(type(e).__name__).inc()
+            retry_after = e.retry_after
+            if isinstance(retry_after, datetime.timedelta):
+                retry_after = retry_after.total_seconds()
+            self._throttled(entry, retry_after, str(e))
+            return
+        except (BadRequest, Forbidden) as e:
+            # the chat is gone or the bot was removed; retrying will not help
+            send_errors.labels(type(e).__name__).inc()
+            entry["attempts"] += 1
+            self._dead(entry, str(e))
+            return
+        except NetworkError as e:
+            send_errors.labels(type(e).__name__).inc()
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** entry["attempts"])
+            self._retry_later(entry, delay, str(e))
+            return
+        except Exception as e:
+            send_errors.labels(type(e).__name__).inc()
+            entry["attempts"] += 1
+            self._dead(entry, str(e))
+            return
+        self.outbox.done(entry["id"])
+        lag = time.time() - entry["scheduled_at"]
+        if entry.get("catch_up"):
+            self.stats["caught_up"] += 1
+            send_lag.labels("catch_up").observe(lag)
+            log_event(logger, "reminder.sent_late", reminder_id=entry["reminder_id"], chat_id=chat_id, lag=round(lag))
+            return
+        self.stats["sent"] += 1
+        self.stats["total_lag"] += lag
+        self.stats["max_lag"] = max(self.stats["max_lag"], lag)
+        send_lag.labels("live").observe(lag)
+        log_event(logger, "reminder.sent", reminder_id=entry["reminder_id"], chat_id=chat_id, lag=round(lag, 2))
+
+if __name__ == "__main__":
+    for record in load_dead_letters(*sys.argv[1:2]):
+        print(orjson.dumps(record).decode())
@@ -0,0 +1,98 @@
+import datetime
+import logging
+from persiantools.jdatetime import JalaliDate
+from utils.constants import MISFIRE_GRACE_TIME
+
+logger = logging.getLogger(__name__)
+
+_MINUTE = datetime.timedelta(minutes=1)
+
+class TickDispatcher:
+    # Index keys, all ending in the minute of the day the reminder fires at:
+    #   ("daily", minute)                  everyday
+    #   ("weekday", weekday, minute)       weekdays / weekly, weekday as in datetime.weekday()
+    #   ("jalali_day", day, minute)        monthly, day of the Jalali month
+    #   ("date", ordinal, minute)          once / multi_date, Gregorian date ordinal
+
+    def __init__(self, send, timezone):
+        self.send = send
+        self.timezone = timezone
+        # key -> {(user_id, reminder_id): (chat_id, message)}
+        self.buckets = {}
+        # (user_id, reminder_id) -> keys the reminder is filed under
+        self.entries = {}
+        self.last_tick = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, user_id, reminder_id, chat_id, message, keys):
+        self.remove(user_id, reminder_id)
+        entry_key = (user_id, reminder_id)
+        for key in keys:
+            self.buckets.setdefault(key, {})[entry_key] = (chat_id, message)
+        self.entries[entry_key] = keys
+
+    def remove(self, user_id, reminder_id):
+        entry_key = (user_id, reminder_id)
+        for key in self.entries.pop(entry_key, []):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.pop(entry_key, None)
+                if not bucket:
+                    del self.buckets[key]
+
+    def clear(self):
+        self.buckets.clear()
+        self.entries.clear()
+
+    def keys_for(self, now):
+        minute = now.hour * 60 + now.minute
+        return [
+            ("daily", minute),
+            ("weekday", now.weekday(), minute),
+            ("jalali_day", JalaliDate(now.date()).day, minute),
+            ("date", now.toordinal(), minute),
+        ]
+
+    async def tick(self):
+        now = datetime.datetime.now(self.timezone).replace(second=0, microsecond=0)
+        if self.last_tick is not None and now <= self.last_tick:
+            return
+        minutes = [now]
+        if self.last_tick is not None:
+            # minutes skipped since the last tick, by a stalled loop or a run APScheduler coalesced or dropped,
+            # are dispatched late instead of lost; ones older than MISFIRE_GRACE_TIME are dropped like missed runs
+            utc = now.astimezone(datetime.timezone.utc)
+            gap = int((utc - self.last_tick.astimezone(datetime.timezone.utc)) / _MINUTE) - 1
+            if gap > 0:
+                skipped = min(gap, int(MISFIRE_GRACE_TIME // 60))
+                logger.warning("Tick %s: %d minutes since the last tick were skipped, dispatching %d of them late", now, gap, skipped)
+                minutes = [(utc - _MINUTE * i).astimezone(self.timezone) for i in range(skipped, 0, -1)] + minutes
+        self.last_tick = now
+        due = 0
+        for minute in minutes:
+            due += await self._dispatch(minute, late=minute is not now)
+        if due:
+            logger.info("Tick %s: dispatched %d reminders", now, due)
+
+    async def _dispatch(self, now, late):
+        due = 0
+        for key in self.keys_for(now):
+            bucket = self.buckets.get(key)
+            if not bucket:
+                continue
+            for (user_id, reminder_id), (chat_id, message) in list(bucket.items()):
+                due += 1
+                if late:
+                    await self.send(chat_id, reminder_id, message, now.timestamp())
+                else:
+                    await self.send(chat_id, reminder_id, message)
+            if key[0] == "date":
+                # dated keys can never match again, so drop them once they have fired
+                for entry_key in list(bucket):
+                    self.entries[entry_key] = [k for k in self.entries[entry_key] if k != key]
+                    if not self.entries[entry_key]:
+                        del self.entries[entry_key]
+                del self.buckets[key]
+        return due
@@ -1,249 +1,210 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
-from utils.data import load_user_data, save_user_data, load_chat_data, save_chat_data
-from utils.keyboards import get_destination_keyboard, get_edit_choice_keyboard, build_weekdays_keyboard, get_main_keyboard, get_cancel_keyboard, get_try_again_keyboard
-from utils.constants import DAYS_OF_WEEK, WAITING_FOR_EDIT_FREQUENCY, BOT_USERNAME
+from utils.data import load_user_data, load_reminder, remove_reminder, load_chat_data, update_user_chats
+from utils.keyboards import (
+    get_destination_keyboard, get_edit_choice_keyboard, build_weekdays_keyboard, get_main_keyboard, get_cancel_keyboard, get_try_again_keyboard,
+    get_frequency_keyboard, get_weekly_day_keyboard, get_month_day_keyboard
+)
+from utils.constants import (
+    BOT_USERNAME, WAITING_FOR_ONCE_DATE, WAITING_FOR_MULTI_DATE, WAITING_FOR_WEEKLY_DAY_BUTTONS,
+    WAITING_FOR_MONTH_DAY_BUTTONS, WAITING_FOR_WEEKDAYS_BUTTONS, WAITING_FOR_EDIT_CHOICE, WAITING_FOR_EDIT_MESSAGE,
+    WAITING_FOR_EDIT_TIME, WAITING_FOR_EDIT_FREQUENCY, WAITING_FOR_EDIT_DESTINATION
+)
+from handlers.commands import render_reminders_page
+from utils.models import mask_to_weekdays, weekdays_to_mask
+from utils.sessions import start_session, get_session, end_session, commit
+from utils.chat_cache import set_chat_title, get_chat_title, get_chat_titles, is_chat_admin, invalidate_admin
+import asyncio
 import logging
 import datetime
 
 logger = logging.getLogger(__name__)
 
+_ADD_CHAT_STEPS = (
+    "⚠️ اگر گروه یا کانال مورد نظرتان در لیست نیست:\n"
+    "1️⃣ بات را به گروه/کانال اضافه کنید.\n"
+    "2️⃣ بات را ادمین کنید.\n"
+    "3️⃣ در گروه/کانال، روی دکمه «ثبت گروه/کانال» در پیام ارسال شده توسط بات کلیک کنید.\n"
+    "4️⃣ به اینجا برگردید و «به‌روزرسانی لیست» را بزنید تا گروه/کانال جدید نمایش داده شود.\n"
+)
+DESTINATION_PROMPT = "📢 یادآوری کجا ارسال شود؟\n" + _ADD_CHAT_STEPS
+EDIT_DESTINATION_PROMPT = "📢 مقصد جدید را انتخاب کنید:\n" + _ADD_CHAT_STEPS
+
 async def get_admin_chats(context, user_id):
-    chat_data = load_chat_data()
+    chat_data = await load_chat_data()
     user_chat_data = chat_data.get(str(user_id), {})
+    chat_ids = list(user_chat_data)
+    admin_checks, titles = await asyncio.gather(
+        asyncio.gather(*(is_chat_admin(context.bot, user_id, chat_id) for chat_id in chat_ids), return_exceptions=True),
+        get_chat_titles(context.bot, chat_ids)
+    )
     admin_chats = []
-    updated_user_chat_data = {}
-    
-    for chat_id in user_chat_data:
-        try:
-            admins = await context.bot.get_chat_administrators(chat_id)
-            admin_ids = [admin.user.id for admin in admins]
-            if user_id in admin_ids and context.bot.id in admin_ids:
-                chat = await context.bot.get_chat(chat_id)
-                title = chat.title if chat.title else "بدون نام"
-                admin_chats.append((chat_id, title))
-                updated_user_chat_data[chat_id] = {"title": title}
-        except Exception as e:
-            logger.error(f"Error checking admins for chat {chat_id}: {e}")
+    changes = {}
+
+    for chat_id, is_admin in zip(chat_ids, admin_checks):
+        if isinstance(is_admin, Exception):
+            # a failed check (rate limit, timeout, ...) says nothing about admin rights, so the chat is kept
+            # for the next check but not offered until one succeeds
+            logger.error("Error checking admins for chat %s: %s", chat_id, is_admin)
+            continue
+        if is_admin:
+            title = titles.get(int(chat_id)) or user_chat_data[chat_id].get("title") or "بدون نام"
+            admin_chats.append((chat_id, title))
+            if user_chat_data[chat_id] != {"title": title}:
+                changes[chat_id] = {"title": title}
+        else:
+            changes[chat_id] = None
 
-    chat_data[str(user_id)] = updated_user_chat_data
-    save_chat_data(chat_data)
+    # only the chats checked here are changed; one registered during the checks is kept
+    if changes:
+        await update_user_chats(user_id, changes)
     return admin_chats
 
+async def commit_step(user_id, session, reply):
+    # stores the reminder after an edit step; the conversation ends if the reminder was deleted meanwhile
+    if await commit(user_id, session):
+        return True
+    end_session(user_id)
+    await reply("یادآور فعلی پیدا نشد.")
+    logger.error("Reminder %s not found for user %s", session.reminder.id, user_id)
+    return False
+
+async def finish_schedule(message, context, user_id, session):
+    # the repeat pattern is complete: an edit is stored and goes back to the edit menu,
+    # a new reminder goes on to choosing its destination
+    if session.editing:
+        if not await commit_step(user_id, session, message.reply_text):
+            return
+        session.state = WAITING_FOR_EDIT_CHOICE
+        await message.reply_text("✅ الگوی تکرار جدید ذخیره شد. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
+    else:
+        session.state = None
+        await message.reply_text(DESTINATION_PROMPT, reply_markup=get_destination_keyboard(await get_admin_chats(context, user_id)))
+
 async def frequency_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     freq = query.data.split(":")[1]
     user_id = query.from_user.id
-    context.user_data.update(load_user_data(user_id))
-    current_id = context.user_data.get("current_reminder_id")
-    reminders = context.user_data.get("reminders", [])
-    reminder = next((r for r in reminders if r["id"] == current_id), None)
+    session = get_session(user_id)
 
-    if not reminder:
+    if session is None:
         await query.edit_message_text("یادآور فعلی پیدا نشد.")
-        logger.error(f"Reminder {current_id} not found for user {user_id}")
+        logger.error("No reminder in progress for user %s", user_id)
         return
+    reminder = session.reminder
+    current_id = reminder.id
 
-    if context.user_data.get(WAITING_FOR_EDIT_FREQUENCY):
-        for key in ["weekly_day", "monthly_day", "once_date", "multi_dates", "weekdays"]:
-            reminder.pop(key, None)
-        logger.info(f"User {user_id} cleared previous frequency keys for reminder {current_id}")
-
-    reminder["frequency"] = freq
-    save_user_data(user_id, context.user_data)
+    # days and dates of the previous pattern mean nothing under the new one
+    reminder.clear_schedule()
+    reminder.frequency = freq
 
     if freq == "everyday":
         await query.edit_message_text("✅ تنظیم شد: هر روز")
-        if context.user_data.get(WAITING_FOR_EDIT_FREQUENCY):
-            context.user_data[WAITING_FOR_EDIT_FREQUENCY] = False
-            await query.message.reply_text("✅ الگوی تکرار جدید ذخیره شد. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
-        else:
-            text = (
-                "📢 یادآوری کجا ارسال شود؟\n"
-                "⚠️ اگر گروه یا کانال مورد نظرتان در لیست نیست:\n"
-                "1️⃣ بات را به گروه/کانال اضافه کنید.\n"
-                "2️⃣ بات را ادمین کنید.\n"
-                "3️⃣ در گروه/کانال، روی دکمه «ثبت گروه/کانال» در پیام ارسال شده توسط بات کلیک کنید.\n"
-                "4️⃣ به اینجا برگردید و «به‌روزرسانی لیست» را بزنید تا گروه/کانال جدید نمایش داده شود.\n"
-            )
-            await query.message.reply_text(text, reply_markup=get_destination_keyboard(await get_admin_chats(context, user_id)))
-        logger.info(f"User {user_id} set frequency to everyday for reminder {current_id}")
+        await finish_schedule(query.message, context, user_id, session)
+        logger.info("User %s set frequency to everyday for reminder %s", user_id, current_id)
     elif freq == "weekdays":
-        await send_weekdays_buttons(update, context)
-        logger.info(f"User {user_id} selected weekdays frequency for reminder {current_id}")
+        await send_weekdays_buttons(update, session)
+        logger.info("User %s selected weekdays frequency for reminder %s", user_id, current_id)
     elif freq == "weekly":
-        await send_weekly_day_buttons(update, context)
-        logger.info(f"User {user_id} selected weekly frequency for reminder {current_id}")
+        await send_weekly_day_buttons(update, session)
+        logger.info("User %s selected weekly frequency for reminder %s", user_id, current_id)
     elif freq == "monthly":
-        await send_month_day_buttons(update, context)
-        logger.info(f"User {user_id} selected monthly frequency for reminder {current_id}")
+        await send_month_day_buttons(update, session)
+        logger.info("User %s selected monthly frequency for reminder %s", user_id, current_id)
     elif freq == "once":
-        context.user_data["waiting_for_once_date"] = True
+        session.state = WAITING_FOR_ONCE_DATE
         await query.message.reply_text("📌 تاریخ مشخص رو وارد کن (مثلاً 1404/04/10):", reply_markup=get_cancel_keyboard())
         await query.edit_message_text("✅ الگوی تکرار: یک تاریخ مشخص")
-        logger.info(f"User {user_id} selected once frequency for reminder {current_id}")
+        logger.info("User %s selected once frequency for reminder %s", user_id, current_id)
     elif freq == "multi_date":
-        context.user_data["waiting_for_multi_date"] = True
+        session.state = WAITING_FOR_MULTI_DATE
         await query.message.reply_text("📌 تاریخ‌ها رو با کاما جدا کن (مثلاً 1404/04/10, 1404/05/01):", reply_markup=get_cancel_keyboard())
         await query.edit_message_text("✅ الگوی تکرار: چند تاریخ مشخص")
-        logger.info(f"User {user_id} selected multi_date frequency for reminder {current_id}")
+        logger.info("User %s selected multi_date frequency for reminder %s", user_id, current_id)
 
-async def send_weekly_day_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [[InlineKeyboardButton(day, callback_data=f"weekly_day:{day}")] for day in DAYS_OF_WEEK]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.callback_query.edit_message_text("✅ روز هفته مورد نظر رو انتخاب کن:", reply_markup=reply_markup)
-    context.user_data["waiting_for_weekly_day_buttons"] = True
-    logger.info(f"User {update.effective_user.id} is selecting weekly day")
+async def send_weekly_day_buttons(update: Update, session):
+    await update.callback_query.edit_message_text("✅ روز هفته مورد نظر رو انتخاب کن:", reply_markup=get_weekly_day_keyboard())
+    session.state = WAITING_FOR_WEEKLY_DAY_BUTTONS
+    logger.info("User %s is selecting weekly day", update.effective_user.id)
 
-async def send_month_day_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = []
-    row = []
-    for i in range(1, 32):
-        row.append(InlineKeyboardButton(str(i), callback_data=f"month_day:{i}"))
-        if len(row) == 7:
-            keyboard.append(row)
-            row = []
-    if row:
-        keyboard.append(row)
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.callback_query.edit_message_text("✅ روز مورد نظر از ماه رو انتخاب کن:", reply_markup=reply_markup)
-    context.user_data["waiting_for_month_day_buttons"] = True
-    logger.info(f"User {update.effective_user.id} is selecting monthly day")
+async def send_month_day_buttons(update: Update, session):
+    await update.callback_query.edit_message_text("✅ روز مورد نظر از ماه رو انتخاب کن:", reply_markup=get_month_day_keyboard())
+    session.state = WAITING_FOR_MONTH_DAY_BUTTONS
+    logger.info("User %s is selecting monthly day", update.effective_user.id)
 
-async def send_weekdays_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    current_id = context.user_data.get("current_reminder_id")
-    reminders = context.user_data.get("reminders", [])
-    if not reminders or not any(r["id"] == current_id for r in reminders):
-        await update.callback_query.edit_message_text("یادآور فعلی پیدا نشد.")
-        logger.error(f"Reminder {current_id} not found for user {update.effective_user.id}")
-        return
-    reminder = next((r for r in reminders if r["id"] == current_id), None)
-    if reminder:
-        context.user_data["selected_weekdays"] = set(reminder.get("weekdays", []))
-    else:
-        context.user_data["selected_weekdays"] = set()
-    markup = build_weekdays_keyboard(context.user_data["selected_weekdays"])
+async def send_weekdays_buttons(update: Update, session):
+    session.selected_weekdays = set(mask_to_weekdays(session.reminder.weekdays))
+    markup = build_weekdays_keyboard(session.selected_weekdays)
     await update.callback_query.edit_message_text("✅ روزهای مورد نظر رو انتخاب کن (با زدن روی هر دکمه اضافه/حذف می‌شن):", reply_markup=markup)
-    context.user_data["waiting_for_weekdays_buttons"] = True
-    logger.info(f"User {update.effective_user.id} is selecting weekdays for reminder {current_id}")
+    session.state = WAITING_FOR_WEEKDAYS_BUTTONS
+    logger.info("User %s is selecting weekdays for reminder %s", update.effective_user.id, session.reminder.id)
 
 async def day_selection_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     data = query.data
     user_id = query.from_user.id
-    context.user_data.update(load_user_data(user_id))
-    current_id = context.user_data.get("current_reminder_id")
-    reminders = context.user_data.get("reminders", [])
-    reminder = next((r for r in reminders if r["id"] == current_id), None)
+    session = get_session(user_id)
 
-    if not reminder:
+    if session is None:
         await query.edit_message_text("یادآور فعلی پیدا نشد.")
-        logger.error(f"Reminder {current_id} not found for user {user_id}")
+        logger.error("No reminder in progress for user %s", user_id)
         return
+    reminder = session.reminder
+    current_id = reminder.id
 
     if data.startswith("weekly_day:"):
         day = data.split(":")[1]
-        reminder["weekly_day"] = day
-        context.user_data["waiting_for_weekly_day_buttons"] = False
+        reminder.weekdays = weekdays_to_mask([day])
         await query.edit_message_text(f"✅ روز هفته تنظیم شد: {day}")
-        save_user_data(user_id, context.user_data)
-        if context.user_data.get(WAITING_FOR_EDIT_FREQUENCY):
-            context.user_data[WAITING_FOR_EDIT_FREQUENCY] = False
-            await query.message.reply_text("✅ الگوی تکرار جدید ذخیره شد. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
-        else:
-            text = (
-                "📢 یادآوری کجا ارسال شود؟\n"
-                "⚠️ اگر گروه یا کانال مورد نظرتان در لیست نیست:\n"
-                "1️⃣ بات را به گروه/کانال اضافه کنید.\n"
-                "2️⃣ بات را ادمین کنید.\n"
-                "3️⃣ در گروه/کانال، روی دکمه «ثبت گروه/کانال» در پیام ارسال شده توسط بات کلیک کنید.\n"
-                "4️⃣ به اینجا برگردید و «به‌روزرسانی لیست» را بزنید تا گروه/کانال جدید نمایش داده شود.\n"
-            )
-            await query.message.reply_text(text, reply_markup=get_destination_keyboard(await get_admin_chats(context, user_id)))
-        logger.info(f"User {user_id} set weekly day {day} for reminder {current_id}")
+        await finish_schedule(query.message, context, user_id, session)
+        logger.info("User %s set weekly day %s for reminder %s", user_id, day, current_id)
     elif data.startswith("month_day:"):
         day = int(data.split(":")[1])
-        reminder["monthly_day"] = day
-        context.user_data["waiting_for_month_day_buttons"] = False
+        reminder.monthly_day = day
         await query.edit_message_text(f"✅ روز ماه تنظیم شد: {day}")
-        save_user_data(user_id, context.user_data)
-        if context.user_data.get(WAITING_FOR_EDIT_FREQUENCY):
-            context.user_data[WAITING_FOR_EDIT_FREQUENCY] = False
-            await query.message.reply_text("✅ الگوی تکرار جدید ذخیره شد. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
-        else:
-            text = (
-                "📢 یادآوری کجا ارسال شود؟\n"
-                "⚠️ اگر گروه یا کانال مورد نظرتان در لیست نیست:\n"
-                "1️⃣ بات را به گروه/کانال اضافه کنید.\n"
-                "2️⃣ بات را ادمین کنید.\n"
-                "3️⃣ در گروه/کانال، روی دکمه «ثبت گروه/کانال» در پیام ارسال شده توسط بات کلیک کنید.\n"
-                "4️⃣ به اینجا برگردید و «به‌روزرسانی لیست» را بزنید تا گروه/کانال جدید نمایش داده شود.\n"
-            )
-            await query.message.reply_text(text, reply_markup=get_destination_keyboard(await get_admin_chats(context, user_id)))
-        logger.info(f"User {user_id} set monthly day {day} for reminder {current_id}")
+        await finish_schedule(query.message, context, user_id, session)
+        logger.info("User %s set monthly day %s for reminder %s", user_id, day, current_id)
     elif data.startswith("toggle_weekday:"):
         day = data.split(":")[1]
-        selected = context.user_data.get("selected_weekdays", set())
-        if isinstance(selected, list):
-            selected = set(selected)
+        selected = session.selected_weekdays
         if day in selected:
             selected.remove(day)
         else:
             selected.add(day)
-        context.user_data["selected_weekdays"] = selected
         markup = build_weekdays_keyboard(selected)
         await query.edit_message_reply_markup(reply_markup=markup)
-        save_user_data(user_id, context.user_data)
-        logger.info(f"User {user_id} toggled weekday {day} for reminder {current_id}")
+        logger.info("User %s toggled weekday %s for reminder %s", user_id, day, current_id)
     elif data == "confirm_weekdays":
-        selected = context.user_data.get("selected_weekdays", set())
+        selected = session.selected_weekdays
         if selected:
-            reminder["weekdays"] = list(selected)
-            context.user_data["waiting_for_weekdays_buttons"] = False
-            context.user_data.pop("selected_weekdays", None)
-            await query.edit_message_text(f"✅ روزهای انتخاب‌شده ذخیره شدند: {', '.join(selected)}")
-            save_user_data(user_id, context.user_data)
-            if context.user_data.get(WAITING_FOR_EDIT_FREQUENCY):
-                context.user_data[WAITING_FOR_EDIT_FREQUENCY] = False
-                await query.message.reply_text("✅ الگوی تکرار جدید ذخیره شد. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
-            else:
-                text = (
-                    "📢 یادآوری کجا ارسال شود؟\n"
-                    "⚠️ اگر گروه یا کانال مورد نظرتان در لیست نیست:\n"
-                    "1️⃣ بات را به گروه/کانال اضافه کنید.\n"
-                    "2️⃣ بات را ادمین کنید.\n"
-                    "3️⃣ در گروه/کانال، روی دکمه «ثبت گروه/کانال» در پیام ارسال شده توسط بات کلیک کنید.\n"
-                    "4️⃣ به اینجا برگردید و «به‌روزرسانی لیست» را بزنید تا گروه/کانال جدید نمایش داده شود.\n"
-                )
-                await query.message.reply_text(text, reply_markup=get_destination_keyboard(await get_admin_chats(context, user_id)))
-            logger.info(f"User {user_id} confirmed weekdays {selected} for reminder {current_id}")
+            reminder.weekdays = weekdays_to_mask(selected)
+            session.selected_weekdays = set()
+            await query.edit_message_text(f"✅ روزهای انتخاب‌شده ذخیره شدند: {', '.join(mask_to_weekdays(reminder.weekdays))}")
+            await finish_schedule(query.message, context, user_id, session)
+            logger.info("User %s confirmed weekdays %s for reminder %s", user_id, selected, current_id)
         else:
             await query.answer("حداقل یک روز انتخاب کن.", show_alert=True)
-            logger.warning(f"User {user_id} tried to confirm empty weekdays for reminder {current_id}")
+            logger.warning("User %s tried to confirm empty weekdays for reminder %s", user_id, current_id)
 
 async def destination_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     data = query.data
     user_id = query.from_user.id
-    context.user_data.update(load_user_data(user_id))
 
     if data.startswith("register_chat:"):
         chat_id = int(data.split(":")[1])
         try:
-            admins = await context.bot.get_chat_administrators(chat_id)
-            admin_ids = [admin.user.id for admin in admins]
-            if query.from_user.id in admin_ids and context.bot.id in admin_ids:
+            # the user is explicitly (re)trying, so don't trust a cached answer
+            invalidate_admin(chat_id, user_id)
+            if await is_chat_admin(context.bot, user_id, chat_id):
                 chat = await context.bot.get_chat(chat_id)
-                chat_data = load_chat_data()
-                if str(user_id) not in chat_data:
-                    chat_data[str(user_id)] = {}
-                chat_data[str(user_id)][str(chat_id)] = {"title": chat.title}
-                save_chat_data(chat_data)
+                await update_user_chats(user_id, {str(chat_id): {"title": chat.title}})
+                set_chat_title(chat_id, chat.title)
                 await query.edit_message_text(f"✅ گروه/کانال '{chat.title}' با موفقیت ثبت شد.")
-                logger.info(f"User {query.from_user.id} registered chat {chat_id} ({chat.title})")
+                logger.info("User %s registered chat %s (%s)", query.from_user.id, chat_id, chat.title)
             else:
                 new_text = f"⛔ شما و بات {BOT_USERNAME} باید ادمین این گروه/کانال باشید."
                 keyboard = get_try_again_keyboard(chat_id)
@@ -252,7 +213,7 @@ async def destination_callback(update: Update, context: ContextTypes.DEFAULT_TYP
                         new_text,
                         reply_markup=keyboard
                     )
-                logger.warning(f"User {query.from_user.id} or bot not admin in chat {chat_id}")
+                logger.warning("User %s or bot not admin in chat %s", query.from_user.id, chat_id)
         except Exception as e:
             new_text = f"⛔ خطا در ثبت گروه/کانال: {str(e)}"
             keyboard = get_try_again_keyboard(chat_id)
@@ -261,173 +222,146 @@ async def destination_callback(update: Update, context: ContextTypes.DEFAULT_TYP
                     new_text,
                     reply_markup=keyboard
                 )
-            logger.error(f"Error registering chat {chat_id} for user {query.from_user.id}: {str(e)}")
+            logger.error("Error registering chat %s for user %s: %s", chat_id, query.from_user.id, e)
         return
 
-    current_id = context.user_data.get("current_reminder_id")
-    reminders = context.user_data.get("reminders", [])
-    reminder = next((r for r in reminders if r["id"] == current_id), None)
-
-    if not reminder:
+    session = get_session(user_id)
+    if session is None:
         await query.edit_message_text("یادآور فعلی پیدا نشد.")
-        logger.error(f"Reminder {current_id} not found for user {user_id}")
+        logger.error("No reminder in progress for user %s", user_id)
         return
-
-    is_editing = context.user_data.get("waiting_for_edit_destination", False)
+    reminder = session.reminder
+    current_id = reminder.id
+    is_editing = session.editing
 
     if data == "dest:private":
-        reminder["chat_id"] = user_id
-        context.user_data["waiting_for_edit_destination"] = False
+        reminder.chat_id = user_id
+        if not await commit_step(user_id, session, query.edit_message_text):
+            return
         if is_editing:
-            context.user_data["waiting_for_edit_choice"] = True
+            session.state = WAITING_FOR_EDIT_CHOICE
             await query.edit_message_text("✅ مقصد تنظیم شد: چت خصوصی. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
-            logger.info(f"User {user_id} set destination to private chat for reminder {current_id} (edit mode)")
+            logger.info("User %s set destination to private chat for reminder %s (edit mode)", user_id, current_id)
         else:
+            end_session(user_id)
             await query.edit_message_text("✅ مقصد تنظیم شد: چت خصوصی")
             await query.message.reply_text("تنظیمات یادآور کامل شد.", reply_markup=get_main_keyboard())
-            logger.info(f"User {user_id} set destination to private chat for reminder {current_id} (new reminder)")
-        save_user_data(user_id, context.user_data)
+            logger.info("User %s set destination to private chat for reminder %s (new reminder)", user_id, current_id)
     elif data == "dest:reload":
         admin_chats = await get_admin_chats(context, user_id)
         keyboard = get_destination_keyboard(admin_chats)
         if is_editing:
-            await query.edit_message_text(
-                "📢 مقصد جدید را انتخاب کنید:\n"
-                "⚠️ اگر گروه یا کانال مورد نظرتان در لیست نیست:\n"
-                "1️⃣ بات را به گروه/کانال اضافه کنید.\n"
-                "2️⃣ بات را ادمین کنید.\n"
-                "3️⃣ در گروه/کانال، روی دکمه «ثبت گروه/کانال» در پیام ارسال شده توسط بات کلیک کنید.\n"
-                "4️⃣ به اینجا برگردید و «به‌روزرسانی لیست» را بزنید تا گروه/کانال جدید نمایش داده شود.\n",
-                reply_markup=keyboard
-            )
+            await query.edit_message_text(EDIT_DESTINATION_PROMPT, reply_markup=keyboard)
         else:
-            await query.edit_message_text(
-                "📢 یادآوری کجا ارسال شود؟\n"
-                "⚠️ اگر گروه یا کانال مورد نظرتان در لیست نیست:\n"
-                "1️⃣ بات را به گروه/کانال اضافه کنید.\n"
-                "2️⃣ بات را ادمین کنید.\n"
-                "3️⃣ در گروه/کانال، روی دکمه «ثبت گروه/کانال» در پیام ارسال شده توسط بات کلیک کنید.\n"
-                "4️⃣ به اینجا برگردید و «به‌روزرسانی لیست» را بزنید تا گروه/کانال جدید نمایش داده شود.\n",
-                reply_markup=keyboard
-            )
-        logger.info(f"User {user_id} reloaded destination list for reminder {current_id}")
+            await query.edit_message_text(DESTINATION_PROMPT, reply_markup=keyboard)
+        logger.info("User %s reloaded destination list for reminder %s", user_id, current_id)
     elif data.startswith("dest:"):
         chat_id = int(data.split(":")[1])
         try:
-            admins = await context.bot.get_chat_administrators(chat_id)
-            admin_ids = [admin.user.id for admin in admins]
-            if user_id in admin_ids and context.bot.id in admin_ids:
-                reminder["chat_id"] = chat_id
-                context.user_data["waiting_for_edit_destination"] = False
-                chat = await context.bot.get_chat(chat_id)
+            if await is_chat_admin(context.bot, user_id, chat_id):
+                reminder.chat_id = chat_id
+                if not await commit_step(user_id, session, query.edit_message_text):
+                    return
+                title = await get_chat_title(context.bot, chat_id) or "بدون نام"
                 if is_editing:
-                    context.user_data["waiting_for_edit_choice"] = True
-                    await query.edit_message_text(f"✅ مقصد تنظیم شد: {chat.title}. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
-                    logger.info(f"User {user_id} set destination to chat {chat_id} ({chat.title}) for reminder {current_id} (edit mode)")
+                    session.state = WAITING_FOR_EDIT_CHOICE
+                    await query.edit_message_text(f"✅ مقصد تنظیم شد: {title}. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
+                    logger.info("User %s set destination to chat %s (%s) for reminder %s (edit mode)", user_id, chat_id, title, current_id)
                 else:
-                    await query.edit_message_text(f"✅ مقصد تنظیم شد: {chat.title}")
+                    end_session(user_id)
+                    await query.edit_message_text(f"✅ مقصد تنظیم شد: {title}")
                     await query.message.reply_text("تنظیمات یادآور کامل شد.", reply_markup=get_main_keyboard())
-                    logger.info(f"User {user_id} set destination to chat {chat_id} ({chat.title}) for reminder {current_id} (new reminder)")
-                save_user_data(user_id, context.user_data)
+                    logger.info("User %s set destination to chat %s (%s) for reminder %s (new reminder)", user_id, chat_id, title, current_id)
             else:
                 await query.edit_message_text(f"⛔ شما یا بات {BOT_USERNAME} در این گروه/کانال ادمین نیستید.")
-                logger.warning(f"User {user_id} or bot not admin in chat {chat_id} for reminder {current_id}")
+                logger.warning("User %s or bot not admin in chat %s for reminder %s", user_id, chat_id, current_id)
         except Exception as e:
             await query.edit_message_text(f"⛔ خطا: {str(e)}")
-            logger.error(f"Error setting destination chat {chat_id} for user {user_id}: {str(e)}")
+            logger.error("Error setting destination chat %s for user %s: %s", chat_id, user_id, e)
 
 async def action_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     data = query.data
     user_id = query.from_user.id
-    context.user_data.update(load_user_data(user_id))
 
     if data.startswith("delete:"):
         reminder_id = int(data.split(":")[1])
         await delete_reminder(update, context, reminder_id)
     elif data.startswith("edit:"):
+        session = get_session(user_id)
+        if data in ("edit:message", "edit:time", "edit:frequency", "edit:destination", "edit:confirm") and (session is None or not session.editing):
+            await query.edit_message_text("یادآور فعلی پیدا نشد.")
+            logger.error("No reminder being edited by user %s", user_id)
+            return
         if data == "edit:message":
-            context.user_data["waiting_for_edit_message"] = True
+            session.state = WAITING_FOR_EDIT_MESSAGE
             await query.edit_message_text("لطفاً پیام جدید را بنویسید:")
-            logger.info(f"User {user_id} is editing message for reminder")
+            logger.info("User %s is editing message for reminder", user_id)
         elif data == "edit:time":
-            context.user_data["waiting_for_edit_time"] = True
+            session.state = WAITING_FOR_EDIT_TIME
             await query.edit_message_text("⏰ زمان جدید را با فرمت 24 ساعته وارد کنید (HH:MM):")
-            logger.info(f"User {user_id} is editing time for reminder")
+            logger.info("User %s is editing time for reminder", user_id)
         elif data == "edit:frequency":
-            context.user_data["waiting_for_edit_frequency"] = True
-            keyboard = [
-                [InlineKeyboardButton("روزانه", callback_data="freq:everyday")],
-                [InlineKeyboardButton("هفتگی - یک روز", callback_data="freq:weekly")],
-                [InlineKeyboardButton("هفتگی - چند روز", callback_data="freq:weekdays")],
-                [InlineKeyboardButton("ماهانه", callback_data="freq:monthly")],
-                [InlineKeyboardButton("یک تاریخ مشخص", callback_data="freq:once")],
-                [InlineKeyboardButton("چند تاریخ مشخص", callback_data="freq:multi_date")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text("🔁 نوع تکرار جدید را انتخاب کنید:", reply_markup=reply_markup)
-            logger.info(f"User {user_id} is editing frequency for reminder")
+            session.state = WAITING_FOR_EDIT_FREQUENCY
+            await query.edit_message_text("🔁 نوع تکرار جدید را انتخاب کنید:", reply_markup=get_frequency_keyboard())
+            logger.info("User %s is editing frequency for reminder", user_id)
         elif data == "edit:destination":
-            context.user_data["waiting_for_edit_destination"] = True
+            session.state = WAITING_FOR_EDIT_DESTINATION
             admin_chats = await get_admin_chats(context, user_id)
             keyboard = get_destination_keyboard(admin_chats)
-            await query.edit_message_text(
-                "📢 مقصد جدید را انتخاب کنید:\n"
-                "⚠️ اگر گروه یا کانال مورد نظرتان در لیست نیست:\n"
-                "1️⃣ بات را به گروه/کانال اضافه کنید.\n"
-                "2️⃣ بات را ادمین کنید.\n"
-                "3️⃣ در گروه/کانال، روی دکمه «ثبت گروه/کانال» در پیام ارسال شده توسط بات کلیک کنید.\n"
-                "4️⃣ به اینجا برگردید و «به‌روزرسانی لیست» را بزنید تا گروه/کانال جدید نمایش داده شود.\n",
-                reply_markup=keyboard
-            )
-            logger.info(f"User {user_id} is editing destination for reminder")
+            await query.edit_message_text(EDIT_DESTINATION_PROMPT, reply_markup=keyboard)
+            logger.info("User %s is editing destination for reminder", user_id)
         elif data == "edit:confirm":
-            context.user_data["waiting_for_edit_choice"] = False
-            context.user_data.pop("waiting_for_edit_message", None)
-            context.user_data.pop("waiting_for_edit_time", None)
-            context.user_data.pop("waiting_for_edit_frequency", None)
-            context.user_data.pop("waiting_for_edit_destination", None)
+            # every edit step was stored as it was made, so there is nothing left to save
+            end_session(user_id)
             await query.edit_message_text("✅ ویرایش یادآور ذخیره شد.")
             await query.message.reply_text("برای دیدن لیست جدید، /listReminders را بزنید.", reply_markup=get_main_keyboard())
-            save_user_data(user_id, context.user_data)
-            logger.info(f"User {user_id} confirmed edit for reminder")
+            logger.info("User %s confirmed edit for reminder", user_id)
         else:
             reminder_id = int(data.split(":")[1])
             await edit_reminder(update, context, reminder_id)
 
+async def list_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    page = int(query.data.split(":")[1])
+    user_id = query.from_user.id
+    reminders = (await load_user_data(user_id))["reminders"]
+    if not reminders:
+        await query.edit_message_text("شما هنوز یادآوری تنظیم نکرده‌اید.")
+        logger.info("User %s has no reminders to page through", user_id)
+        return
+    text, reply_markup = await render_reminders_page(context.bot, user_id, reminders, page)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+    logger.info("User %s opened reminders page %s", user_id, page)
+
 async def delete_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE, reminder_id: int):
     user_id = update.effective_user.id
-    context.user_data.update(load_user_data(user_id))
-    reminders = context.user_data.get("reminders", [])
-    
-    reminders = [r for r in reminders if r["id"] != reminder_id]
-    
-    for i, reminder in enumerate(reminders, 1):
-        reminder["id"] = i
-    
-    context.user_data["reminders"] = reminders
-
-    save_user_data(user_id, context.user_data)
-    await update.callback_query.edit_message_text(f"✅ یادآور شماره {reminder_id} حذف شد.")
+    number = await remove_reminder(user_id, reminder_id)
+    if number is None:
+        await update.callback_query.edit_message_text("یادآور مورد نظر پیدا نشد.")
+        logger.error("Reminder %s not found for user %s", reminder_id, user_id)
+        return
+    session = get_session(user_id)
+    if session is not None and session.editing and session.reminder.id == reminder_id:
+        end_session(user_id)
+    await update.callback_query.edit_message_text(f"✅ یادآور شماره {number} حذف شد.")
     await update.callback_query.message.reply_text("برای دیدن لیست جدید، /listReminders را بزنید.", reply_markup=get_main_keyboard())
-    logger.info(f"User {user_id} deleted reminder {reminder_id}")
+    logger.info("User %s deleted reminder %s", user_id, reminder_id)
 
 async def edit_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE, reminder_id: int):
     user_id = update.effective_user.id
-    context.user_data.update(load_user_data(user_id))
-    reminders = context.user_data.get("reminders", [])
-    reminder = next((r for r in reminders if r["id"] == reminder_id), None)
+    reminder = await load_reminder(user_id, reminder_id)
     
     if not reminder:
         await update.callback_query.edit_message_text("یادآور مورد نظر پیدا نشد.")
-        logger.error(f"Reminder {reminder_id} not found for user {user_id}")
+        logger.error("Reminder %s not found for user %s", reminder_id, user_id)
         return
     
-    context.user_data["current_reminder_id"] = reminder_id
-    context.user_data["waiting_for_edit_choice"] = True
+    start_session(user_id, reminder, editing=True, state=WAITING_FOR_EDIT_CHOICE)
     await update.callback_query.edit_message_text(
         "کدام بخش از یادآور را می‌خواهید ویرایش کنید؟",
         reply_markup=get_edit_choice_keyboard()
     )
-    logger.info(f"User {user_id} started editing reminder {reminder_id}")
\ No newline at end of file
+    logger.info("User %s started editing reminder %s", user_id, reminder_id)
\ No newline at end of file
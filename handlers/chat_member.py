@@ -1,6 +1,7 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from utils.constants import BOT_USERNAME
+from utils.chat_cache import set_chat_title, invalidate_chat, invalidate_admin
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,6 +11,13 @@ async def chat_member_added(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_members = update.my_chat_member.new_chat_member
     old_members = update.my_chat_member.old_chat_member
 
+    # the bot's own rights changed, so every cached admin check for this chat is stale
+    invalidate_admin(chat_id)
+    if new_members.status in ["left", "kicked"]:
+        invalidate_chat(chat_id)
+    elif update.effective_chat.title:
+        set_chat_title(chat_id, update.effective_chat.title)
+
     if new_members.status in ["member", "administrator"] and old_members.status in ["left", "kicked"]:
         if new_members.user.id == context.bot.id:
             keyboard = [
@@ -21,4 +29,10 @@ async def chat_member_added(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 text=f"سلام! من {BOT_USERNAME} هستم.\nآیا می‌خواهید این گروه/کانال را ثبت کنم؟",
                 reply_markup=reply_markup
             )
-            logger.info(f"Bot added to chat {chat_id}, sent registration message")
\ No newline at end of file
+            logger.info("Bot added to chat %s, sent registration message", chat_id)
+
+async def chat_member_updated(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    member = update.chat_member.new_chat_member
+    invalidate_admin(chat_id, member.user.id)
+    logger.info("Member %s in chat %s is now %s, admin cache invalidated", member.user.id, chat_id, member.status)
@@ -1,18 +1,27 @@
+import codecs
+import io
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from utils.data import load_user_data, save_user_data
-from utils.keyboards import get_main_keyboard, get_cancel_keyboard
-from utils.data import load_chat_data
-from utils.constants import SUPPORT_USERNAME
+from utils.data import load_user_data
+from utils.keyboards import get_main_keyboard, get_cancel_keyboard, get_reminder_buttons, get_reminder_keyboard
+from utils.chat_cache import get_chat_title, get_chat_titles
+from utils.constants import (
+    SUPPORT_USERNAME, REMINDERS_PER_PAGE, LIST_MESSAGE_PREVIEW_LENGTH, ADMIN_USER_IDS, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS,
+    WAITING_FOR_MESSAGE
+)
+from utils.models import Reminder
+from utils.render import render_card
+from utils.bulk import CSV_COLUMNS, export_csv, export_ics
+from utils.sessions import start_session
+from utils.tracing import profile
 import logging
-import datetime
 
 logger = logging.getLogger(__name__)
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     first_name = update.effective_user.first_name or "دوست عزیز"
-    context.user_data.update(load_user_data(user_id))
     await update.message.reply_text(
         f"سلام {first_name} 👋\n"
         "من «یادت نره» هستم، یه دستیار یادآور! 🤖\n"
@@ -20,18 +29,18 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "برای شروع، فقط کافیه یکی از دکمه‌های زیر رو بزنی 👇",
         reply_markup=get_main_keyboard()
     )
-    save_user_data(user_id, context.user_data)
-    logger.info(f"User {user_id} started the bot")
+    logger.info("User %s started the bot", user_id)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    context.user_data.update(load_user_data(user_id))
     help_text = (
         "🤖 راهنمای استفاده از بات یادآور «یادت نره»\n\n"
         "🟢 برای شروع، از منوی پایین یا دستورات زیر استفاده کنید:\n\n"
         "📌 /newReminder - ایجاد یادآور جدید\n"
         "📋 /showReminder - نمایش آخرین یادآور\n"
         "📋 /listReminders - نمایش همه یادآورها\n"
+        "📥 /importReminders - وارد کردن گروهی یادآورها از فایل CSV یا iCalendar\n"
+        "📤 /exportReminders - دریافت همه یادآورها در یک فایل (csv یا ics)\n"
         "🚀 /start - بازنشانی منو و شروع دوباره\n\n"
         "📝 در لیست یادآورها، می‌توانید با دکمه‌های «ویرایش» و «حذف»، یادآورها را تغییر دهید یا حذف کنید.\n\n"
         "📢 برای افزودن گروه/کانال به لیست مقصدها:\n"
@@ -42,153 +51,119 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "⚠️ نکته: اگر گروه/کانال در لیست ظاهر نشد، مطمئن شوید که هم شما و هم بات همچنان ادمین هستید."
     )
     await update.message.reply_text(help_text, reply_markup=get_main_keyboard(), parse_mode="HTML")
-    save_user_data(user_id, context.user_data)
-    logger.info(f"User {user_id} accessed help")
+    logger.info("User %s accessed help", user_id)
 
 async def new_reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    context.user_data.update(load_user_data(user_id))
-
-    context.user_data["waiting_for_edit_choice"] = False
-    context.user_data["waiting_for_edit_message"] = False
-    context.user_data["waiting_for_edit_time"] = False
-    context.user_data["waiting_for_edit_frequency"] = False
-    context.user_data["waiting_for_edit_destination"] = False
-    
-    reminders = context.user_data.get("reminders", [])
-    new_id = max([r["id"] for r in reminders], default=0) + 1
-    new_reminder = {"id": new_id}
-    reminders.append(new_reminder)
-    context.user_data["reminders"] = reminders
-    context.user_data["current_reminder_id"] = new_id
-    context.user_data["waiting_for_message"] = True
+    # users see reminders numbered by their place in the list; the id is assigned when the reminder is stored
+    number = len((await load_user_data(user_id))["reminders"]) + 1
+    # the new reminder is only stored once its destination is chosen; any conversation in progress is dropped
+    start_session(user_id, Reminder(None), editing=False, state=WAITING_FOR_MESSAGE)
     await update.message.reply_text(
-        f"یادآور جدید با شماره {new_id} ایجاد شد. لطفاً متن پیام یادآوری را وارد کنید:",
+        f"یادآور جدید با شماره {number} ایجاد شد. لطفاً متن پیام یادآوری را وارد کنید:",
         reply_markup=get_cancel_keyboard()
     )
-    save_user_data(user_id, context.user_data)
-    logger.info(f"User {user_id} created new reminder with ID {new_id}")
+    logger.info("User %s started new reminder number %s", user_id, number)
 
 async def show_reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    context.user_data.update(load_user_data(user_id))
-    reminders = context.user_data.get("reminders", [])
+    reminders = (await load_user_data(user_id))["reminders"]
     if not reminders:
         await update.message.reply_text("شما هنوز یادآوری تنظیم نکرده‌اید.", reply_markup=get_main_keyboard())
-        logger.info(f"User {user_id} has no reminders to show")
+        logger.info("User %s has no reminders to show", user_id)
         return
     reminder = reminders[-1]
-    msg = reminder.get("message", "⛔ تنظیم نشده")
-    time = reminder.get("time", "⛔ تنظیم نشده")
-    freq = reminder.get("frequency", "⛔ تنظیم نشده")
-    chat_id = reminder.get("chat_id", user_id)
-    try:
-        destination = "چت خصوصی" if chat_id == user_id else (await context.bot.get_chat(chat_id)).title or "بدون نام"
-    except Exception as e:
-        destination = "گروه/کانال ناشناس"
-        logger.error(f"Error getting chat title for chat_id {chat_id}: {e}")
-    formatted_time = time.strftime("%H:%M") if isinstance(time, datetime.time) else time
-    freq_translated = {"everyday": "روزانه", "weekdays": "هفتگی - چند روز", "weekly": "هفتگی - یک روز", "monthly": "ماهانه", "once": "یک تاریخ مشخص", "multi_date": "چند تاریخ مشخص"}.get(freq, "⛔ تنظیم نشده")
-
-    details = ""
-    if freq == "weekdays":
-        details = f"روزها: {', '.join(reminder.get('weekdays', []))}"
-    elif freq == "weekly":
-        details = f"روز هفته: {reminder.get('weekly_day', '⛔')}"
-    elif freq == "monthly":
-        details = f"روز ماه: {reminder.get('monthly_day', '⛔')}"
-    elif freq == "once":
-        details = f"تاریخ: {reminder.get('once_date', '⛔')}"
-    elif freq == "multi_date":
-        details = f"تاریخ‌ها: {', '.join(reminder.get('multi_dates', []))}"
-
-    keyboard = [
-        [InlineKeyboardButton("حذف", callback_data=f"delete:{reminder['id']}"),
-         InlineKeyboardButton("ویرایش", callback_data=f"edit:{reminder['id']}")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    if freq == "everyday":
-        message_text = (
-            f"📋 اطلاعات آخرین یادآوری شما (شماره {reminder['id']}):\n\n"
-            f"📝 پیام: {msg}\n"
-            f"⏰ زمان: {formatted_time}\n"
-            f"🔁 الگوی تکرار: {freq_translated}\n"
-            f"📢 مقصد: {destination}"
-        )
+    chat_id = reminder.chat_id or user_id
+    if chat_id == user_id:
+        destination = "چت خصوصی"
     else:
-        message_text = (
-            f"📋 اطلاعات آخرین یادآوری شما (شماره {reminder['id']}):\n\n"
-            f"📝 پیام: {msg}\n"
-            f"⏰ زمان: {formatted_time}\n"
-            f"🔁 الگوی تکرار: {freq_translated}\n"
-            f"📅 {details}\n"
-            f"📢 مقصد: {destination}"
-        )
+        destination = await get_chat_title(context.bot, chat_id) or "گروه/کانال ناشناس"
+    message_text = render_card(reminder, f"📋 اطلاعات آخرین یادآوری شما (شماره {len(reminders)}):\n\n", destination)
+    await update.message.reply_text(message_text, reply_markup=get_reminder_keyboard(reminder.id))
+    logger.info("User %s showed last reminder %s", user_id, reminder.id)
+
+async def render_reminders_page(bot, user_id, reminders, page):
+    page_count = (len(reminders) + REMINDERS_PER_PAGE - 1) // REMINDERS_PER_PAGE
+    page = max(0, min(page, page_count - 1))
+    page_reminders = reminders[page * REMINDERS_PER_PAGE:(page + 1) * REMINDERS_PER_PAGE]
+    titles = await get_chat_titles(bot, [r.chat_id for r in page_reminders if r.chat_id and r.chat_id != user_id])
+
+    cards = []
+    keyboard = []
+    for number, reminder in enumerate(page_reminders, page * REMINDERS_PER_PAGE + 1):
+        chat_id = reminder.chat_id or user_id
+        if chat_id == user_id:
+            destination = "چت خصوصی"
+        else:
+            destination = titles.get(chat_id) or "گروه/کانال ناشناس"
+        cards.append(render_card(reminder, f"📋 یادآوری شماره {number}\n", destination, LIST_MESSAGE_PREVIEW_LENGTH))
+        keyboard.append(get_reminder_buttons(number, reminder.id))
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️ قبلی", callback_data=f"list_page:{page - 1}"))
+    if page < page_count - 1:
+        navigation.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"list_page:{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
 
-    await update.message.reply_text(message_text, reply_markup=reply_markup)
-    logger.info(f"User {user_id} showed last reminder {reminder['id']}")
+    text = f"📋 یادآورهای شما (صفحه {page + 1} از {page_count}):\n\n" + "\n\n".join(cards)
+    return text, InlineKeyboardMarkup(keyboard)
 
 async def list_reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    context.user_data.update(load_user_data(user_id))
-    reminders = context.user_data.get("reminders", [])
+    reminders = (await load_user_data(user_id))["reminders"]
     if not reminders:
         await update.message.reply_text("شما هنوز یادآوری تنظیم نکرده‌اید.", reply_markup=get_main_keyboard())
-        logger.info(f"User {user_id} has no reminders")
+        logger.info("User %s has no reminders", user_id)
         return
 
-    for reminder in reminders:
-        msg = reminder.get("message", "⛔ تنظیم نشده")
-        time = reminder.get("time", "⛔ تنظیم نشده")
-        freq = reminder.get("frequency", "⛔ تنظیم نشده")
-        chat_id = reminder.get("chat_id", user_id)
-        try:
-            destination = "چت خصوصی" if chat_id == user_id else (await context.bot.get_chat(chat_id)).title or "بدون نام"
-        except Exception as e:
-            destination = "گروه/کانال ناشناس"
-            logger.error(f"Error getting chat title for chat_id {chat_id}: {e}")
-        formatted_time = time.strftime("%H:%M") if isinstance(time, datetime.time) else time
-        freq_translated = {"everyday": "روزانه", "weekdays": "هفتگی - چند روز", "weekly": "هفتگی - یک روز", "monthly": "ماهانه", "once": "یک تاریخ مشخص", "multi_date": "چند تاریخ مشخص"}.get(freq, "⛔ تنظیم نشده")
+    text, reply_markup = await render_reminders_page(context.bot, user_id, reminders, 0)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+    logger.info("User %s listed reminders", user_id)
 
-        details = ""
-        if freq == "weekdays":
-            details = f"روزها: {', '.join(reminder.get('weekdays', []))}"
-        elif freq == "weekly":
-            details = f"روز هفته: {reminder.get('weekly_day', '⛔')}"
-        elif freq == "monthly":
-            details = f"روز ماه: {reminder.get('monthly_day', '⛔')}"
-        elif freq == "once":
-            details = f"تاریخ: {reminder.get('once_date', '⛔')}"
-        elif freq == "multi_date":
-            details = f"تاریخ‌ها: {', '.join(reminder.get('multi_dates', []))}"
-
-        keyboard = [
-            [InlineKeyboardButton("حذف", callback_data=f"delete:{reminder['id']}"),
-             InlineKeyboardButton("ویرایش", callback_data=f"edit:{reminder['id']}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        if freq == "everyday":
-            message_text = (
-                f"📋 یادآوری شماره {reminder['id']}\n\n"
-                f"📝 پیام: {msg}\n"
-                f"⏰ زمان: {formatted_time}\n"
-                f"🔁 الگوی تکرار: {freq_translated}\n"
-                f"📢 مقصد: {destination}"
-            )
-        else:
-            message_text = (
-                f"📋 یادآوری شماره {reminder['id']}\n\n"
-                f"📝 پیام: {msg}\n"
-                f"⏰ زمان: {formatted_time}\n"
-                f"🔁 الگوی تکرار: {freq_translated}\n"
-                f"📅 {details}\n"
-                f"📢 مقصد: {destination}"
-            )
+async def import_reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    await update.message.reply_text(
+        "📥 برای وارد کردن گروهی یادآورها، یک فایل CSV یا iCalendar (.ics) را در همین چت بفرستید.\n\n"
+        f"سطر اول فایل CSV نام ستون‌هاست: {','.join(CSV_COLUMNS)}\n"
+        "• time: ساعت 24 ساعته، مثل 14:30\n"
+        "• frequency: everyday، weekdays، weekly، monthly، once یا multi_date\n"
+        "• days: روزهای هفته با ; جدا شوند (مثل شنبه;دوشنبه)، یا روز ماه برای monthly\n"
+        "• dates: تاریخ‌ها با ; جدا شوند، شمسی (1404/04/10) یا میلادی (2025-07-01)\n"
+        "• chat_id: اختیاری؛ شناسه یک گروه/کانال ثبت‌شده، خالی یعنی چت خصوصی\n\n"
+        "اگر حتی یک سطر ایراد داشته باشد، هیچ یادآوری وارد نمی‌شود و ایرادها برایتان فرستاده می‌شود.\n"
+        "برای دیدن یک نمونه، خروجی /exportReminders را ببینید.",
+        reply_markup=get_main_keyboard()
+    )
+    logger.info("User %s asked how to import reminders", user_id)
 
-        await update.message.reply_text(message_text, reply_markup=reply_markup)
-    logger.info(f"User {user_id} listed reminders")
+async def export_reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    kind = context.args[0].lower() if context.args else "csv"
+    if kind not in ("csv", "ics"):
+        await update.message.reply_text("⛔ فرمت خروجی باید csv یا ics باشد، مثلاً /exportReminders ics", reply_markup=get_main_keyboard())
+        return
+    reminders = (await load_user_data(user_id))["reminders"]
+    if not reminders:
+        await update.message.reply_text("شما هنوز یادآوری تنظیم نکرده‌اید.", reply_markup=get_main_keyboard())
+        logger.info("User %s has no reminders to export", user_id)
+        return
+    out = io.BytesIO()
+    if kind == "csv":
+        # the BOM lets spreadsheet programs recognise UTF-8 and show the Persian text
+        out.write(codecs.BOM_UTF8)
+        chunks = export_csv(reminders)
+    else:
+        chunks = export_ics(user_id, reminders)
+    for chunk in chunks:
+        out.write(chunk.encode("utf-8"))
+    await update.message.reply_document(
+        document=out.getvalue(),
+        filename=f"reminders-{time.strftime('%Y%m%d')}.{kind}",
+        caption=f"📤 {len(reminders)} یادآور"
+    )
+    logger.info("User %s exported %d reminders as %s", user_id, len(reminders), kind)
 
 async def support_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -197,4 +172,27 @@ async def support_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"{SUPPORT_USERNAME}",
         reply_markup=get_main_keyboard()
     )
-    logger.info(f"User {user_id} accessed support")
\ No newline at end of file
+    logger.info("User %s accessed support", user_id)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_USER_IDS:
+        logger.warning("User %s tried to run /profile without being an admin", user_id)
+        return
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await update.message.reply_text("⛔ مدت پروفایل‌گیری باید یک عدد (ثانیه) باشد.")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    await update.message.reply_text(f"⏱ پروفایل‌گیری به مدت {seconds} ثانیه شروع شد...")
+    logger.info("User %s started a %ss profile", user_id, seconds)
+    report = await profile(seconds)
+    if report is None:
+        await update.message.reply_text("⛔ یک پروفایل‌گیری دیگر در حال اجراست. لطفاً بعداً دوباره تلاش کنید.")
+        return
+    await update.message.reply_document(
+        document=report.encode("utf-8"),
+        filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt",
+        caption=f"📊 پرمصرف‌ترین توابع در {seconds} ثانیه گذشته"
+    )
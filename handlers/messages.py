@@ -1,36 +1,118 @@
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+import asyncio
+import csv
+import os
+import tempfile
+from telegram import Update
 from telegram.ext import ContextTypes
-from utils.data import load_user_data, save_user_data
-from utils.keyboards import get_main_keyboard, get_cancel_keyboard, get_destination_keyboard, get_edit_choice_keyboard
+from utils.models import parse_jalali_date, parse_time, format_time
+from utils.data import add_reminders
+from utils.bulk import parse_csv, parse_ics
+from utils.keyboards import get_main_keyboard, get_cancel_keyboard, get_edit_choice_keyboard, get_frequency_keyboard
+from utils.constants import (
+    WAITING_FOR_MESSAGE, WAITING_FOR_TIME, WAITING_FOR_ONCE_DATE, WAITING_FOR_MULTI_DATE,
+    WAITING_FOR_EDIT_CHOICE, WAITING_FOR_EDIT_MESSAGE, WAITING_FOR_EDIT_TIME, IMPORT_MAX_BYTES
+)
+from utils.sessions import get_session, end_session
 from handlers.commands import new_reminder_command, show_reminder_command, list_reminders_command, help_command, support_command
+from handlers.callbacks import commit_step, finish_schedule, get_admin_chats
 import logging
-import datetime
 
 logger = logging.getLogger(__name__)
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def message_step(update, context, session, txt):
+    reminder = session.reminder
+    reminder.message = txt
+    session.state = WAITING_FOR_TIME
+    await update.message.reply_text("✅ پیام ذخیره شد. حالا زمان را با فرمت 24 ساعته با اعداد انگلیسی وارد کنید (HH:MM):", reply_markup=get_cancel_keyboard())
+    logger.info("User %s set message for reminder %s", update.effective_user.id, reminder.id)
+
+async def time_step(update, context, session, txt):
     user_id = update.effective_user.id
-    chat_type = update.effective_chat.type
-    context.user_data.update(load_user_data(user_id))
-    txt = update.message.text.strip() if update.message.text else None
+    reminder = session.reminder
+    minute = parse_time(txt)
+    if minute is None:
+        await update.message.reply_text("⛔ فرمت اشتباه است. ساعت رو مثل 14:30 وارد کن.", reply_markup=get_cancel_keyboard())
+        logger.warning("User %s provided invalid time format for reminder %s", user_id, reminder.id)
+        return
+    reminder.minute = minute
+    # the frequency keyboard answers through callbacks, so no typed input is expected until it is used
+    session.state = None
+    await update.message.reply_text(f"✅ زمان ذخیره شد: {format_time(minute)}.\n"
+                                   "الگوی تکرار را انتخاب کنید:", reply_markup=get_frequency_keyboard())
+    logger.info("User %s set time %s for reminder %s", user_id, format_time(minute), reminder.id)
 
-    if chat_type in ["group", "supergroup", "channel"]:
+async def once_date_step(update, context, session, txt):
+    user_id = update.effective_user.id
+    reminder = session.reminder
+    ordinal = parse_jalali_date(txt)
+    if ordinal is None:
+        await update.message.reply_text("⛔ فرمت تاریخ اشتباه است. تاریخ رو مثل 1404/04/10 وارد کن.", reply_markup=get_cancel_keyboard())
+        logger.warning("User %s provided invalid once date %s for reminder %s", user_id, txt, reminder.id)
         return
-    
+    reminder.dates = (ordinal,)
+    await update.message.reply_text(f"✅ تاریخ ذخیره شد: {txt}")
+    await finish_schedule(update.message, context, user_id, session)
+    logger.info("User %s set once date %s for reminder %s", user_id, txt, reminder.id)
+
+async def multi_date_step(update, context, session, txt):
+    user_id = update.effective_user.id
+    reminder = session.reminder
+    dates = [d.strip() for d in txt.split(",")]
+    ordinals = [parse_jalali_date(d) for d in dates]
+    if None in ordinals:
+        await update.message.reply_text("⛔ فرمت تاریخ‌ها اشتباه است. تاریخ‌ها رو مثل 1404/04/10, 1404/05/01 وارد کن.", reply_markup=get_cancel_keyboard())
+        logger.warning("User %s provided invalid multi dates %s for reminder %s", user_id, dates, reminder.id)
+        return
+    reminder.dates = tuple(ordinals)
+    await update.message.reply_text(f"✅ تاریخ‌ها ذخیره شدند.")
+    await finish_schedule(update.message, context, user_id, session)
+    logger.info("User %s set multi dates %s for reminder %s", user_id, dates, reminder.id)
+
+async def edit_message_step(update, context, session, txt):
+    user_id = update.effective_user.id
+    session.reminder.message = txt
+    if not await commit_step(user_id, session, update.message.reply_text):
+        return
+    session.state = WAITING_FOR_EDIT_CHOICE
+    await update.message.reply_text("✅ پیام جدید ذخیره شد. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
+    logger.info("User %s edited message for reminder %s", user_id, session.reminder.id)
+
+async def edit_time_step(update, context, session, txt):
+    user_id = update.effective_user.id
+    minute = parse_time(txt)
+    if minute is None:
+        await update.message.reply_text("⛔ فرمت اشتباه. ساعت رو مثل 14:30 وارد کن.", reply_markup=get_cancel_keyboard())
+        logger.warning("User %s provided invalid time format during edit for reminder %s", user_id, session.reminder.id)
+        return
+    session.reminder.minute = minute
+    if not await commit_step(user_id, session, update.message.reply_text):
+        return
+    session.state = WAITING_FOR_EDIT_CHOICE
+    await update.message.reply_text(f"✅ زمان جدید ذخیره شد: {format_time(minute)}. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
+    logger.info("User %s edited time to %s for reminder %s", user_id, format_time(minute), session.reminder.id)
+
+# session state -> step taking the user's text in that state
+TEXT_STEPS = {
+    WAITING_FOR_MESSAGE: message_step,
+    WAITING_FOR_TIME: time_step,
+    WAITING_FOR_ONCE_DATE: once_date_step,
+    WAITING_FOR_MULTI_DATE: multi_date_step,
+    WAITING_FOR_EDIT_MESSAGE: edit_message_step,
+    WAITING_FOR_EDIT_TIME: edit_time_step,
+}
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # only registered for private chats, see main.py
+    user_id = update.effective_user.id
+    txt = update.message.text.strip()
+    session = get_session(user_id)
+
     if txt == "لغو ایجاد یادآور جدید":
-        if context.user_data.get("current_reminder_id"):
-            current_id = context.user_data["current_reminder_id"]
-            reminders = context.user_data.get("reminders", [])
-            reminders = [r for r in reminders if r["id"] != current_id]
-            context.user_data["reminders"] = reminders
-            context.user_data.pop("current_reminder_id", None)
-            context.user_data.pop("waiting_for_message", None)
-            context.user_data.pop("waiting_for_time", None)
-            context.user_data.pop("waiting_for_once_date", None)
-            context.user_data.pop("waiting_for_multi_date", None)
+        if session is not None:
+            # nothing of a new reminder is stored before its destination is chosen, so dropping the session discards it
+            end_session(user_id)
             await update.message.reply_text("ایجاد یادآور لغو شد.", reply_markup=get_main_keyboard())
-            save_user_data(user_id, context.user_data)
-            logger.info(f"User {user_id} cancelled creating reminder {current_id}")
+            logger.info("User %s cancelled reminder %s", user_id, session.reminder.id)
         else:
             await update.message.reply_text("شما در حال ایجاد یادآور نیستید.", reply_markup=get_main_keyboard())
         return
@@ -38,105 +120,71 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if txt in LABEL_TO_HANDLER:
         return
 
-    current_id = context.user_data.get("current_reminder_id")
-    if not current_id:
+    if session is None:
         await update.message.reply_text("لطفاً ابتدا یک یادآور جدید ایجاد کنید با /newReminder", reply_markup=get_main_keyboard())
-        logger.warning(f"User {user_id} sent message without current reminder")
+        logger.warning("User %s sent message without current reminder", user_id)
         return
-    reminders = context.user_data.get("reminders", [])
-    reminder = next((r for r in reminders if r["id"] == current_id), None)
-    if not reminder:
-        await update.message.reply_text("یادآور فعلی پیدا نشد.", reply_markup=get_main_keyboard())
-        logger.error(f"Reminder {current_id} not found for user {user_id}")
+
+    step = TEXT_STEPS.get(session.state)
+    if step is None:
+        await update.message.reply_text("⛔ من متوجه نشدم. لطفاً از دستورات استفاده کن.", reply_markup=get_main_keyboard())
+        logger.warning("User %s sent unhandled message", user_id)
         return
+    await step(update, context, session, txt)
 
-    if context.user_data.get("waiting_for_message"):
-        reminder["message"] = txt
-        context.user_data["waiting_for_message"] = False
-        context.user_data["waiting_for_time"] = True
-        await update.message.reply_text("✅ پیام ذخیره شد. حالا زمان را با فرمت 24 ساعته با اعداد انگلیسی وارد کنید (HH:MM):", reply_markup=get_cancel_keyboard())
-        save_user_data(user_id, context.user_data)
-        logger.info(f"User {user_id} set message for reminder {current_id}")
-    elif context.user_data.get("waiting_for_time"):
-        try:
-            t = datetime.datetime.strptime(txt, "%H:%M").time()
-            reminder["time"] = t
-            context.user_data["waiting_for_time"] = False
-            await update.message.reply_text(f"✅ زمان ذخیره شد: {t.strftime('%H:%M')}.\n"
-                                           "الگوی تکرار را انتخاب کنید:", reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("روزانه", callback_data="freq:everyday")],
-                [InlineKeyboardButton("هفتگی - یک روز", callback_data="freq:weekly")],
-                [InlineKeyboardButton("هفتگی - چند روز", callback_data="freq:weekdays")],
-                [InlineKeyboardButton("ماهانه", callback_data="freq:monthly")],
-                [InlineKeyboardButton("یک تاریخ مشخص", callback_data="freq:once")],
-                [InlineKeyboardButton("چند تاریخ مشخص", callback_data="freq:multi_date")],
-            ]))
-            save_user_data(user_id, context.user_data)
-            logger.info(f"User {user_id} set time {t.strftime('%H:%M')} for reminder {current_id}")
-        except:
-            await update.message.reply_text("⛔ فرمت اشتباه است. ساعت رو مثل 14:30 وارد کن.", reply_markup=get_cancel_keyboard())
-            logger.warning(f"User {user_id} provided invalid time format for reminder {current_id}")
-    elif context.user_data.get("waiting_for_once_date"):
-        reminder["once_date"] = txt
-        context.user_data["waiting_for_once_date"] = False
-        await update.message.reply_text(f"✅ تاریخ ذخیره شد: {txt}")
-        save_user_data(user_id, context.user_data)
-        if context.user_data.get("waiting_for_edit_frequency"):
-            context.user_data["waiting_for_edit_frequency"] = False
-            await update.message.reply_text("✅ الگوی تکرار جدید ذخیره شد. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
-        else:
-            from handlers.callbacks import get_admin_chats
-            text = (
-                "📢 یادآوری کجا ارسال شود؟\n"
-                "⚠️ اگر گروه یا کانال مورد نظرتان در لیست نیست:\n"
-                "1️⃣ بات را به گروه/کانال اضافه کنید.\n"
-                "2️⃣ بات را ادمین کنید.\n"
-                "3️⃣ در گروه/کانال، روی دکمه «ثبت گروه/کانال» در پیام ارسال شده توسط بات کلیک کنید.\n"
-                "4️⃣ به اینجا برگردید و «به‌روزرسانی لیست» را بزنید تا گروه/کانال جدید نمایش داده شود.\n"
-            )
-            await update.message.reply_text(text, reply_markup=get_destination_keyboard(await get_admin_chats(context, user_id)))
-        logger.info(f"User {user_id} set once date {txt} for reminder {current_id}")
-    elif context.user_data.get("waiting_for_multi_date"):
-        dates = [d.strip() for d in txt.split(",")]
-        reminder["multi_dates"] = dates
-        context.user_data["waiting_for_multi_date"] = False
-        await update.message.reply_text(f"✅ تاریخ‌ها ذخیره شدند.")
-        save_user_data(user_id, context.user_data)
-        if context.user_data.get("waiting_for_edit_frequency"):
-            context.user_data["waiting_for_edit_frequency"] = False
-            await update.message.reply_text("✅ الگوی تکرار جدید ذخیره شد. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
-        else:
-            from handlers.callbacks import get_admin_chats
-            text = (
-                "📢 یادآوری کجا ارسال شود؟\n"
-                "⚠️ اگر گروه یا کانال مورد نظرتان در لیست نیست:\n"
-                "1️⃣ بات را به گروه/کانال اضافه کنید.\n"
-                "2️⃣ بات را ادمین کنید.\n"
-                "3️⃣ در گروه/کانال، روی دکمه «ثبت گروه/کانال» در پیام ارسال شده توسط بات کلیک کنید.\n"
-                "4️⃣ به اینجا برگردید و «به‌روزرسانی لیست» را بزنید تا گروه/کانال جدید نمایش داده شود.\n"
-            )
-            await update.message.reply_text(text, reply_markup=get_destination_keyboard(await get_admin_chats(context, user_id)))
-        logger.info(f"User {user_id} set multi dates {dates} for reminder {current_id}")
-    elif context.user_data.get("waiting_for_edit_message"):
-        reminder["message"] = txt
-        context.user_data["waiting_for_edit_message"] = False
-        await update.message.reply_text("✅ پیام جدید ذخیره شد. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
-        save_user_data(user_id, context.user_data)
-        logger.info(f"User {user_id} edited message for reminder {current_id}")
-    elif context.user_data.get("waiting_for_edit_time"):
+def _parse_file(path, parse):
+    # runs in a worker thread; the parser reads the file line by line
+    with open(path, encoding="utf-8-sig", newline="") as lines:
+        return parse(lines)
+
+async def _reject_size(update, user_id, size):
+    await update.message.reply_text(f"⛔ حجم فایل بیشتر از {IMPORT_MAX_BYTES // 1024} کیلوبایت است.", reply_markup=get_main_keyboard())
+    logger.warning("User %s sent a %s byte import file", user_id, size)
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # CSV and iCalendar files sent in a private chat are imported, see main.py
+    user_id = update.effective_user.id
+    document = update.message.document
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await _reject_size(update, user_id, document.file_size)
+        return
+    file = await document.get_file()
+    if file.file_size and file.file_size > IMPORT_MAX_BYTES:
+        await _reject_size(update, user_id, file.file_size)
+        return
+    parse = parse_ics if document.file_name.lower().endswith(".ics") else parse_csv
+    with tempfile.TemporaryDirectory() as tmp:
+        path = await file.download_to_drive(os.path.join(tmp, "import"))
+        # Telegram may leave the size out of the update, so it is checked again once the file is on disk
+        size = os.path.getsize(path)
+        if size > IMPORT_MAX_BYTES:
+            await _reject_size(update, user_id, size)
+            return
         try:
-            t = datetime.datetime.strptime(txt, "%H:%M").time()
-            reminder["time"] = t
-            context.user_data["waiting_for_edit_time"] = False
-            await update.message.reply_text(f"✅ زمان جدید ذخیره شد: {t.strftime('%H:%M')}. بخش دیگری را ویرایش یا تایید کنید:", reply_markup=get_edit_choice_keyboard())
-            save_user_data(user_id, context.user_data)
-            logger.info(f"User {user_id} edited time to {t.strftime('%H:%M')} for reminder {current_id}")
-        except:
-            await update.message.reply_text("⛔ فرمت اشتباه. ساعت رو مثل 14:30 وارد کن.", reply_markup=get_cancel_keyboard())
-            logger.warning(f"User {user_id} provided invalid time format during edit for reminder {current_id}")
-    else:
-        await update.message.reply_text("⛔ من متوجه نشدم. لطفاً از دستورات استفاده کن.", reply_markup=get_main_keyboard())
-        logger.warning(f"User {user_id} sent unhandled message")
+            reminders, errors = await asyncio.to_thread(_parse_file, path, parse)
+        except (UnicodeDecodeError, csv.Error) as e:
+            await update.message.reply_text("⛔ فایل خوانده نشد. فایل باید با کدگذاری UTF-8 ذخیره شده باشد.", reply_markup=get_main_keyboard())
+            logger.warning("User %s sent an unreadable import file %s: %s", user_id, document.file_name, e)
+            return
+
+    destinations = {r.chat_id for r in reminders if r.chat_id and r.chat_id != user_id}
+    if destinations:
+        allowed = {int(chat_id) for chat_id, _ in await get_admin_chats(context, user_id)}
+        errors += [f"مقصد {chat_id} جزو گروه/کانال‌های ثبت‌شده شما نیست" for chat_id in sorted(destinations - allowed)]
+    if not reminders and not errors:
+        errors.append("فایل هیچ یادآوری ندارد")
+    if errors:
+        shown = "\n".join(errors[:10])
+        if len(errors) > 10:
+            shown += f"\n… و {len(errors) - 10} ایراد دیگر"
+        await update.message.reply_text(f"⛔ هیچ یادآوری وارد نشد. این موارد را اصلاح کنید و فایل را دوباره بفرستید:\n{shown}", reply_markup=get_main_keyboard())
+        logger.warning("User %s sent an import file %s with %d errors", user_id, document.file_name, len(errors))
+        return
+
+    # all of them are stored and scheduled as one change
+    count = await add_reminders(user_id, reminders)
+    await update.message.reply_text(f"✅ {count} یادآور وارد شد. برای دیدن آن‌ها /listReminders را بزنید.", reply_markup=get_main_keyboard())
+    logger.info("User %s imported %d reminders from %s", user_id, count, document.file_name)
 
 LABEL_TO_HANDLER = {
     "یادآور جدید": new_reminder_command,
@@ -154,5 +202,5 @@ async def label_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await handler(update, context)
         else:
             await update.message.reply_text("این بخش هنوز پیاده‌سازی نشده است.", reply_markup=get_main_keyboard())
-            logger.warning(f"User {update.effective_user.id} triggered unimplemented label {text}")
+            logger.warning("User %s triggered unimplemented label %s", update.effective_user.id, text)
         return
\ No newline at end of file
@@ -1,42 +1,170 @@
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ChatMemberHandler, filters
+from telegram import Update
 from telegram.request import HTTPXRequest
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ChatMemberHandler, TypeHandler, filters
+import asyncio
 import logging
+import time
 import scheduler
-from utils.constants import TELEGRAM_TOKEN
-from handlers.commands import start_command, help_command, new_reminder_command, show_reminder_command, list_reminders_command, support_command
-from handlers.callbacks import frequency_callback, day_selection_callback, action_callback, destination_callback
-from handlers.messages import handle_message, label_router
-from handlers.chat_member import chat_member_added
+from utils.constants import (
+    TELEGRAM_TOKEN, TELEGRAM_API_BASE_URL, CONCURRENT_UPDATES, DISPATCH_ENGINE, DISPATCH_WORKERS, JOB_STORE, UPDATE_MODE,
+    WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_CONNECTIONS,
+    METRICS_HOST, METRICS_PORT, BOT_API_POOL_TIMEOUT
+)
+from utils.data import close_user_data, cache_stats
+from utils.concurrency import per_user
+from utils.log import setup_logging
+from utils.metrics import Histogram, start_server, timed
+from utils.storage import opened_storage
+from utils.tracing import TracingRequest, end_trace, record_error, start_trace, traced
+from handlers.commands import (
+    start_command, help_command, new_reminder_command, show_reminder_command, list_reminders_command, support_command, profile_command,
+    import_reminders_command, export_reminders_command
+)
+from handlers.callbacks import frequency_callback, day_selection_callback, action_callback, destination_callback, list_page_callback
+from handlers.messages import handle_message, handle_document, label_router
+from handlers.chat_member import chat_member_added, chat_member_updated
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+boot_time = time.monotonic()
+schedule_task = None
+metrics_server = None
+
+# labelled with the command, callback pattern or update type each handler is registered for
+handler_seconds = Histogram("reminder_bot_handler_seconds", "Time to handle an update, including waiting behind the same user's earlier updates", ["handler"])
+
+def instrumented(callback, label):
+    return timed(handler_seconds.labels(label))(traced(label)(per_user(callback)))
+
+def command(name, callback):
+    return CommandHandler(name, instrumented(callback, f"/{name}"), filters=filters.ChatType.PRIVATE)
+
+def callback_query(pattern, callback):
+    return CallbackQueryHandler(instrumented(callback, pattern), pattern=pattern)
+
+async def log_first_response(update: Update, context):
+    # runs after every other handler of the update, so its replies have been sent
+    if first_response_handler in context.application.handlers.get(99, []):
+        context.application.remove_handler(first_response_handler, group=99)
+        logger.info("Time to first response: %.2fs after boot", time.monotonic() - boot_time)
+
+first_response_handler = TypeHandler(Update, log_first_response)
+
+async def schedule_in_background():
+    await scheduler.catch_up_missed_reminders()
+    scheduler.scheduler.resume()
+    count = await scheduler.schedule_all_reminders()
+    logger.info("Time to fully scheduled: %.2fs after boot (%s reminders)", time.monotonic() - boot_time, count)
+
+async def start_workers_in_background():
+    await scheduler.start_worker_pool(DISPATCH_WORKERS)
+    logger.info("Reminders are dispatched by %s worker processes (%s engine)", DISPATCH_WORKERS, DISPATCH_ENGINE)
+
 async def on_startup(app: Application):
-    await scheduler.schedule_all_reminders()
-    scheduler.scheduler.start()
+    global schedule_task, metrics_server
+    # nothing here may wait for the stored data: the storage is opened by its first user, in a worker thread,
+    # so replaying a journal or migrating reminders.json does not hold back the first updates
+    if METRICS_PORT:
+        metrics_server = await start_server(METRICS_HOST, METRICS_PORT)
+    if DISPATCH_WORKERS > 0:
+        schedule_task = asyncio.create_task(start_workers_in_background())
+        return
+    scheduler.use_dispatch_engine(DISPATCH_ENGINE)
+    logger.info("Using %s dispatch engine", DISPATCH_ENGINE)
+    if DISPATCH_ENGINE == "apscheduler":
+        scheduler.use_job_store(JOB_STORE)
+        logger.info("Using %s job store", JOB_STORE)
+    scheduler.delivery_queue.start()
+    # the scheduler stays paused until missed runs are caught up; that and scheduling every reminder
+    # happen in the background while the bot already answers updates
+    scheduler.scheduler.start(paused=True)
+    schedule_task = asyncio.create_task(schedule_in_background())
     logger.info("Scheduler started")
 
-if __name__ == '__main__':
-    logger.info("Bot started...")
-    request = HTTPXRequest(connect_timeout=10.0, read_timeout=20.0)
-    app = Application.builder().token(TELEGRAM_TOKEN).request(request).build()
-
-    app.add_handler(MessageHandler(filters.TEXT & filters.ChatType.PRIVATE & filters.Regex("^(یادآور جدید|نمایش آخرین یادآور|نمایش همه یادآورها|راهنما|پشتیبانی)$"), label_router))
-    app.add_handler(CommandHandler("start", start_command, filters=filters.ChatType.PRIVATE))
-    app.add_handler(CommandHandler("help", help_command, filters=filters.ChatType.PRIVATE))
-    app.add_handler(CommandHandler("newreminder", new_reminder_command, filters=filters.ChatType.PRIVATE))
-    app.add_handler(CommandHandler("showreminder", show_reminder_command, filters=filters.ChatType.PRIVATE))
-    app.add_handler(CommandHandler("listreminders", list_reminders_command, filters=filters.ChatType.PRIVATE))
-    app.add_handler(CommandHandler("support", support_command, filters=filters.ChatType.PRIVATE))
-    app.add_handler(CallbackQueryHandler(frequency_callback, pattern="^freq:"))
-    app.add_handler(CallbackQueryHandler(day_selection_callback, pattern="^(weekly_day|month_day|toggle_weekday|confirm_weekdays):?"))
-    app.add_handler(CallbackQueryHandler(action_callback, pattern="^(edit|delete):"))
-    app.add_handler(CallbackQueryHandler(destination_callback, pattern="^(dest|register_chat):"))
-    app.add_handler(ChatMemberHandler(chat_member_added, ChatMemberHandler.MY_CHAT_MEMBER))
-    app.add_handler(MessageHandler(filters.TEXT, handle_message))
+async def on_shutdown(app: Application):
+    if scheduler.worker_pool is not None:
+        scheduler.worker_pool.stop()
+    if schedule_task is not None and not schedule_task.done():
+        schedule_task.cancel()
+    scheduler.write_next_fire_snapshot()
+    if scheduler.scheduler.running:
+        scheduler.scheduler.shutdown(wait=False)
+    await scheduler.delivery_queue.stop()
+    logger.info("Delivery stats: %s", scheduler.delivery_queue.stats)
+    await close_user_data()
+    if opened_storage() is not None:
+        opened_storage().close()
+    logger.info("User data flushed, cache stats: %s", cache_stats)
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+
+def build_application():
+    # Bot API calls made while handling an update are recorded as spans of its trace
+    # one connection per update handled at once, so replies do not queue for a single pooled connection
+    request = TracingRequest(
+        connection_pool_size=CONCURRENT_UPDATES, connect_timeout=10.0, read_timeout=20.0, pool_timeout=BOT_API_POOL_TIMEOUT
+    )
+    # long polling holds its connection for the whole poll, so it gets its own
+    get_updates_request = HTTPXRequest(connection_pool_size=1, connect_timeout=10.0, read_timeout=20.0)
+    app = (
+        Application.builder().token(TELEGRAM_TOKEN).base_url(TELEGRAM_API_BASE_URL)
+        .request(request).get_updates_request(get_updates_request)
+        .concurrent_updates(CONCURRENT_UPDATES).build()
+    )
+
+    # every update is traced from a handler ahead of all others to one after all others
+    app.add_handler(TypeHandler(Update, start_trace), group=-2)
+    app.add_handler(TypeHandler(Update, end_trace), group=100)
+    app.add_error_handler(record_error)
+    app.add_handler(first_response_handler, group=99)
+    app.add_handler(MessageHandler(filters.TEXT & filters.ChatType.PRIVATE & filters.Regex("^(یادآور جدید|نمایش آخرین یادآور|نمایش همه یادآورها|راهنما|پشتیبانی)$"), instrumented(label_router, "label")))
+    app.add_handler(command("start", start_command))
+    app.add_handler(command("help", help_command))
+    app.add_handler(command("newreminder", new_reminder_command))
+    app.add_handler(command("showreminder", show_reminder_command))
+    app.add_handler(command("listreminders", list_reminders_command))
+    app.add_handler(command("support", support_command))
+    app.add_handler(command("importreminders", import_reminders_command))
+    app.add_handler(command("exportreminders", export_reminders_command))
+    app.add_handler(command("profile", profile_command))
+    app.add_handler(callback_query("^freq:", frequency_callback))
+    app.add_handler(callback_query("^(weekly_day|month_day|toggle_weekday|confirm_weekdays):?", day_selection_callback))
+    app.add_handler(callback_query("^(edit|delete):", action_callback))
+    app.add_handler(callback_query("^(dest|register_chat):", destination_callback))
+    app.add_handler(callback_query("^list_page:", list_page_callback))
+    app.add_handler(ChatMemberHandler(instrumented(chat_member_added, "my_chat_member"), ChatMemberHandler.MY_CHAT_MEMBER))
+    app.add_handler(ChatMemberHandler(instrumented(chat_member_updated, "chat_member"), ChatMemberHandler.CHAT_MEMBER))
+    app.add_handler(MessageHandler(filters.TEXT & filters.ChatType.PRIVATE, instrumented(handle_message, "text")))
+    app.add_handler(MessageHandler(
+        (filters.Document.FileExtension("csv") | filters.Document.FileExtension("ics")) & filters.ChatType.PRIVATE,
+        instrumented(handle_document, "document")
+    ))
 
     app.post_init = on_startup
+    app.post_shutdown = on_shutdown
+    return app
+
+if __name__ == '__main__':
+    setup_logging()
+    logger.info("Bot started...")
+    app = build_application()
 
-    logger.info("Bot is polling...")
-    app.run_polling()
+    # chat_member updates are only delivered when requested explicitly
+    if UPDATE_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL must be set when UPDATE_MODE is webhook")
+        logger.info("Bot is listening for webhooks on %s:%s/%s...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        logger.info("Bot is polling...")
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
     logger.info("Bot stopped.")
\ No newline at end of file
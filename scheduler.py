@@ -1,163 +1,464 @@
-import json
-import os
+import asyncio
 import datetime
+import functools
+import logging
+import os
+import time
+import orjson
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.date import DateTrigger
-from persiantools.jdatetime import JalaliDate
 from telegram import Bot
-from utils.constants import TELEGRAM_TOKEN
-from utils.constants import DATA_FILE
+from telegram.request import HTTPXRequest
+from delivery import DeliveryQueue
+from dispatcher import TickDispatcher
+from triggers import JalaliMonthlyTrigger, JalaliMultiDateTrigger
+from workers import WorkerPool
+from utils.constants import (
+    TELEGRAM_TOKEN, TELEGRAM_API_BASE_URL, SEND_CONCURRENCY, BOT_API_POOL_TIMEOUT, NEXT_FIRE_FILE, WARM_START_WINDOW,
+    SCHEDULE_SLICE, JOB_STORE_FILE, MISFIRE_POLICY, MISFIRE_GRACE_TIME
+)
+from utils.log import log_event
+from utils.metrics import Gauge
+from utils.models import mask_to_numbers
+from utils.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# the default request keeps a single connection, which every concurrent send would queue for; each dispatch
+# worker builds its own Bot here when it imports this module
+bot = Bot(
+    token=TELEGRAM_TOKEN,
+    base_url=TELEGRAM_API_BASE_URL,
+    request=HTTPXRequest(connection_pool_size=SEND_CONCURRENCY, pool_timeout=BOT_API_POOL_TIMEOUT)
+)
+# runs missed while the bot was down are handled by catch_up_missed_reminders and catch_up_from_snapshot;
+# this only covers short stalls
+scheduler = AsyncIOScheduler(timezone="Asia/Tehran", jobstores={"memory": MemoryJobStore()}, job_defaults={"misfire_grace_time": 60})
+delivery_queue = DeliveryQueue(bot)
+tick_dispatcher = None
+# the SQLAlchemy job store when reminder jobs are kept across restarts
+job_store = None
+# set in the bot process when reminders are dispatched by worker processes
+worker_pool = None
+# users whose reminders changed while schedule_all_reminders is still working through the stored data
+_startup_touched = None
+fully_scheduled = False
+
+async def load_all_data():
+    return await asyncio.to_thread(lambda: dict(get_storage().iter_users()))
+
+async def send_reminder(chat_id, reminder_id, message, scheduled_at=None):
+    log_event(logger, "reminder.queued", reminder_id=reminder_id, chat_id=chat_id)
+    if scheduled_at is not None:
+        # a minute the tick dispatcher skipped; it is delivered late, like runs missed during downtime
+        delivery_queue.enqueue(chat_id, reminder_id, f"🔔 یادآوری (با تأخیر):\n{message}", scheduled_at, catch_up=True)
+        return
+    # reminders fire on whole minutes, so the start of the current minute is the scheduled time
+    now = time.time()
+    delivery_queue.enqueue(chat_id, reminder_id, f"🔔 یادآوری:\n{message}", now - now % 60)
+
+@functools.lru_cache(maxsize=4096)
+def cron_trigger(day_of_week, hour, minute):
+    # cron triggers are immutable, so reminders with the same schedule share one
+    return CronTrigger(day_of_week=day_of_week, hour=hour, minute=minute, timezone=scheduler.timezone)
+
+def make_trigger(reminder):
+    frequency = reminder.frequency
+    hour, minute = divmod(reminder.minute, 60)
+    tz = scheduler.timezone
+
+    if frequency == "everyday":
+        return cron_trigger(None, hour, minute)
+
+    elif frequency in ("weekdays", "weekly"):
+        if reminder.weekdays:
+            return cron_trigger(",".join(str(d) for d in mask_to_numbers(reminder.weekdays)), hour, minute)
+
+    elif frequency == "monthly":
+        day = reminder.monthly_day
+        if isinstance(day, int) and 1 <= day <= 31:
+            return JalaliMonthlyTrigger(day, hour, minute, tz)
+
+    elif frequency == "once":
+        if reminder.dates:
+            run_dt = datetime.datetime.combine(datetime.date.fromordinal(reminder.dates[0]), datetime.time(hour, minute), tzinfo=tz)
+            if run_dt > datetime.datetime.now(tz):
+                return DateTrigger(run_date=run_dt)
+
+    elif frequency == "multi_date":
+        if reminder.dates:
+            return JalaliMultiDateTrigger([datetime.date.fromordinal(o) for o in reminder.dates], hour, minute, tz)
+
+    return None
 
-bot = Bot(token=TELEGRAM_TOKEN)
-scheduler = AsyncIOScheduler(timezone="Asia/Tehran")
+def index_keys(reminder):
+    frequency = reminder.frequency
+    minute = reminder.minute
 
-def load_all_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    if frequency == "everyday":
+        return [("daily", minute)]
 
-async def send_reminder(chat_id, reminder_id, message):
-    print(f"Attempting to send reminder {reminder_id} to chat {chat_id} with message: {message}")
+    elif frequency in ("weekdays", "weekly"):
+        return [("weekday", day, minute) for day in mask_to_numbers(reminder.weekdays)]
+
+    elif frequency == "monthly":
+        day = reminder.monthly_day
+        if isinstance(day, int) and 1 <= day <= 31:
+            return [("jalali_day", day, minute)]
+
+    elif frequency in ("once", "multi_date"):
+        dates = reminder.dates[:1] if frequency == "once" else reminder.dates
+        now = datetime.datetime.now(scheduler.timezone)
+        # minutes since the start of today; dates before today or earlier today have already passed
+        today, now_minute = now.toordinal(), now.hour * 60 + now.minute
+        return sorted(set(
+            ("date", o, minute)
+            for o in dates
+            if o > today or (o == today and minute > now_minute)
+        ))
+
+    return []
+
+def job_id_for(user_id, reminder_id):
+    return f"{user_id}_{reminder_id}"
+
+def schedule_reminder(user_id, reminder):
+    reminder_id = reminder.id
+    message = reminder.message
+    frequency = reminder.frequency
+    chat_id = reminder.chat_id or user_id
+
+    if not (reminder_id and message and reminder.minute is not None and frequency):
+        log_event(logger, "reminder.incomplete", reminder_id=reminder_id, user_id=user_id, chat_id=chat_id)
+        return None
+
+    if tick_dispatcher is not None:
+        keys = index_keys(reminder)
+        if not keys:
+            return None
+        tick_dispatcher.add(user_id, reminder_id, chat_id, message, keys)
+        log_event(logger, "reminder.indexed", reminder_id=reminder_id, chat_id=chat_id, frequency=frequency,
+                  minute=reminder.minute, keys=len(keys))
+        return job_id_for(user_id, reminder_id)
+
+    trigger = make_trigger(reminder)
+    if trigger is None:
+        return None
+    # date based triggers may have nothing left to fire; such a job would just sit paused in the store
+    if trigger.get_next_fire_time(None, datetime.datetime.now(scheduler.timezone)) is None:
+        return None
+
+    job_id = job_id_for(user_id, reminder_id)
+    scheduler.add_job(
+        send_reminder,
+        trigger,
+        args=[chat_id, reminder_id, message],
+        id=job_id,
+        name=frequency,
+        replace_existing=True
+    )
+    log_event(logger, "reminder.scheduled", reminder_id=reminder_id, chat_id=chat_id, frequency=frequency,
+              minute=reminder.minute, trigger=trigger)
+    return job_id
+
+def unschedule_reminder(user_id, reminder_id):
+    if tick_dispatcher is not None:
+        tick_dispatcher.remove(user_id, reminder_id)
+        return
     try:
-        await bot.send_message(chat_id=chat_id, text=f"🔔 یادآوری:\n{message}")
-        print(f"Successfully sent reminder {reminder_id} to chat {chat_id}")
-    except Exception as e:
-        print(f"Error sending reminder {reminder_id} to chat {chat_id}: {e}")
-
-def schedule_monthly_jalali(chat_id, reminder_id, message, jalali_day, t):
-    today = JalaliDate.today()
-    year, month = today.year, today.month
-    for i in range(12):
-        m = month + i
-        y = year + (m - 1) // 12
-        m = (m - 1) % 12 + 1
+        scheduler.remove_job(job_id_for(user_id, reminder_id))
+    except JobLookupError:
+        # one-off jobs are dropped by APScheduler once they have fired
+        pass
+
+def reschedule_user(user_id, old_reminders, new_reminders):
+    user_id = int(user_id)
+    if worker_pool is not None:
+        worker_pool.forward(user_id, old_reminders, new_reminders)
+        return
+    old_by_id = {r.id: r for r in old_reminders}
+    new_by_id = {r.id: r for r in new_reminders}
+    # schedule_all_reminders skips users changed mid-pass, so the first change schedules all of their reminders
+    force = _startup_touched is not None and user_id not in _startup_touched
+    if force:
+        _startup_touched.add(user_id)
+
+    for reminder_id in old_by_id.keys() - new_by_id.keys():
+        unschedule_reminder(user_id, reminder_id)
+        log_event(logger, "reminder.unscheduled", reminder_id=reminder_id, user_id=user_id)
+
+    for reminder_id, reminder in new_by_id.items():
+        old = old_by_id.get(reminder_id)
+        # reminder ids are never reused and unchanged reminders are shared between records, so most are the same object
+        if not force and (old is reminder or old == reminder):
+            continue
+        try:
+            if schedule_reminder(user_id, reminder) is None:
+                unschedule_reminder(user_id, reminder_id)
+        except Exception as e:
+            logger.error("Error scheduling reminder %s for user %s: %s", reminder_id, user_id, e)
+
+def use_dispatch_engine(engine):
+    global tick_dispatcher
+    if engine == "tick":
+        tick_dispatcher = TickDispatcher(send_reminder, scheduler.timezone)
+    elif engine == "apscheduler":
+        tick_dispatcher = None
+    else:
+        raise ValueError(f"Unknown dispatch engine: {engine}")
+
+async def start_worker_pool(count):
+    global worker_pool
+    # set before the data is loaded, so changes made meanwhile are held by the pool and sent after it
+    worker_pool = WorkerPool(count)
+    worker_pool.start(await load_all_data())
+
+def use_job_store(kind):
+    global job_store
+    if kind == "sqlite":
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+        job_store = SQLAlchemyJobStore(url=f"sqlite:///{JOB_STORE_FILE}")
+        scheduler.add_jobstore(job_store, "default")
+    elif kind != "memory":
+        raise ValueError(f"Unknown job store: {kind}")
+
+def persisted_reminder_keys():
+    from sqlalchemy import select
+    keys = set()
+    with job_store.engine.connect() as conn:
+        for job_id in conn.execute(select(job_store.jobs_t.c.id)).scalars():
+            user_id, _, reminder_id = job_id.partition("_")
+            if user_id.isdigit() and reminder_id.isdigit():
+                keys.add((int(user_id), int(reminder_id)))
+    return keys
+
+def job_count():
+    if tick_dispatcher is not None:
+        return len(tick_dispatcher)
+    if job_store is None:
+        return len(scheduler.get_jobs())
+    # counted in SQL; loading the persisted jobs would unpickle every one of them
+    from sqlalchemy import func, select
+    with job_store.engine.connect() as conn:
+        persisted = conn.execute(select(func.count()).select_from(job_store.jobs_t)).scalar()
+    return persisted + len(scheduler.get_jobs(jobstore="memory"))
+
+def delivery_queue_depth(lane):
+    queue = delivery_queue.queue if lane == "live" else delivery_queue.catch_up_queue
+    return queue.qsize() if queue is not None else 0
+
+# reminders dispatched by worker processes are not counted here
+Gauge("reminder_bot_scheduled_jobs", "Reminder jobs in the job store, or reminders in the tick index").set_function(job_count)
+queue_depth = Gauge("reminder_bot_delivery_queue_depth", "Reminders waiting to be sent", ["lane"])
+queue_depth.labels("live").set_function(lambda: delivery_queue_depth("live"))
+queue_depth.labels("catch_up").set_function(lambda: delivery_queue_depth("catch_up"))
+
+def missed_run_times(trigger, next_run_time, now):
+    # runs missed by more than MISFIRE_GRACE_TIME are dropped, so the search starts at the edge of the grace
+    # window instead of stepping through every run of a long outage
+    earliest = now - datetime.timedelta(seconds=MISFIRE_GRACE_TIME)
+    run_time = next_run_time
+    if run_time is not None and run_time < earliest:
+        run_time = trigger.get_next_fire_time(None, earliest)
+    run_times = []
+    while run_time is not None and run_time <= now:
+        if run_time >= earliest:
+            run_times.append(run_time)
+        run_time = trigger.get_next_fire_time(run_time, now)
+    return run_times, run_time
+
+def apply_misfire_policy(frequency, run_times):
+    policy = MISFIRE_POLICY.get(frequency, "coalesce")
+    if policy == "coalesce":
+        return run_times[-1:]
+    if policy == "drop":
+        return []
+    return run_times
+
+def queue_missed_runs(missed):
+    # missed is a list of ((chat_id, reminder_id, message), run_times); returns how many deliveries were queued
+    queued = 0
+    for (chat_id, reminder_id, message), run_times in missed:
+        for run_time in run_times:
+            delivery_queue.enqueue(chat_id, reminder_id, f"🔔 یادآوری (با تأخیر):\n{message}", run_time.timestamp(), catch_up=True)
+        queued += len(run_times)
+    return queued
+
+def _collect_missed_runs(now):
+    # runs in a worker thread: loading the due jobs unpickles them and rescheduling them writes the job store
+    missed = []
+    for job in job_store.get_due_jobs(now):
+        if job.func is not send_reminder:
+            continue
+        run_times, next_run_time = missed_run_times(job.trigger, job.next_run_time, now)
+        missed.append((job.args, apply_misfire_policy(job.name, run_times)))
         try:
-            j_date = JalaliDate(y, m, jalali_day)
-        except ValueError:
+            if next_run_time is None:
+                scheduler.remove_job(job.id)
+            else:
+                scheduler.modify_job(job.id, next_run_time=next_run_time)
+        except JobLookupError:
+            # the reminder was deleted or edited by its user meanwhile
+            pass
+    return missed
+
+async def catch_up_missed_reminders():
+    # must finish while the scheduler is still paused, before APScheduler sees the overdue jobs. Without a
+    # persistent job store, missed runs are found in the next-fire snapshot by catch_up_from_snapshot instead
+    if job_store is None:
+        return
+    started = time.monotonic()
+    missed = await asyncio.to_thread(_collect_missed_runs, datetime.datetime.now(scheduler.timezone))
+    queued = queue_missed_runs(missed)
+    if missed:
+        logger.info("Caught up on %d reminders missed during downtime, queued %d late deliveries in %.2fs",
+                    len(missed), queued, time.monotonic() - started)
+
+def write_next_fire_snapshot(path=NEXT_FIRE_FILE):
+    # only the apscheduler engine tracks next fire times; the tick index is cheap to rebuild anyway,
+    # and a persistent job store keeps the jobs themselves
+    if tick_dispatcher is not None or job_store is not None or not fully_scheduled:
+        return
+    entries = []
+    for job in scheduler.get_jobs():
+        if job.func is not send_reminder or job.next_run_time is None:
             continue
-        g_date = j_date.to_gregorian()
-        run_dt = datetime.datetime.combine(g_date, t)
-        if run_dt > datetime.datetime.now():
-            scheduler.add_job(
-                send_reminder,
-                DateTrigger(run_date=run_dt),
-                args=[chat_id, reminder_id, message],
-                id=f"{chat_id}_{reminder_id}_monthly_{y}_{m}"
-            )
-            print(f"Scheduled monthly (Jalali) reminder {reminder_id} for chat {chat_id}: {j_date} at {t}")
-
-async def schedule_all_reminders():
-    scheduler.remove_all_jobs()
-    data = load_all_data()
-    weekday_map = {
-        "دوشنبه": 0,
-        "سه‌شنبه": 1,
-        "چهارشنبه": 2,
-        "پنج‌شنبه": 3,
-        "جمعه": 4,
-        "شنبه": 5,
-        "یک‌شنبه": 6
-    }
+        chat_id, reminder_id, message = job.args
+        entries.append((job.next_run_time.timestamp(), int(job.id.split("_")[0]), reminder_id, chat_id, message))
+    entries.sort()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        for entry in entries:
+            f.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.info("Saved next fire times of %d reminders to %s", len(entries), path)
 
+def read_next_fire_snapshot(until, path=NEXT_FIRE_FILE):
+    # returns the entries whose fire time passed while the bot was down, and the ones due by until
+    if not os.path.exists(path):
+        return [], []
+    now = time.time()
+    missed = []
+    entries = []
+    with open(path, "rb") as f:
+        # entries are sorted by fire time, so only the head of the file is read
+        for line in f:
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                break
+            if entry[0] > until:
+                break
+            if entry[0] > now:
+                entries.append(entry)
+            else:
+                missed.append(entry)
+    # the snapshot describes the data at the last clean shutdown; after a crash it would be stale
+    os.remove(path)
+    return missed, entries
+
+def catch_up_from_snapshot(entries, data, path=NEXT_FIRE_FILE):
+    # each entry holds the first run its reminder missed; the later ones follow from the reminder's trigger,
+    # and MISFIRE_POLICY applies like it does to persisted jobs
+    now = datetime.datetime.now(scheduler.timezone)
+    missed = []
+    for fire_time, user_id, reminder_id, chat_id, message in entries:
+        record = data.get(str(user_id))
+        reminder = record.get(reminder_id) if record is not None else None
+        if reminder is None:
+            continue
+        first = datetime.datetime.fromtimestamp(fire_time, scheduler.timezone)
+        # a once reminder in the past has no trigger left; its one run is the missed one
+        trigger = DateTrigger(run_date=first) if reminder.frequency == "once" else make_trigger(reminder)
+        if trigger is None:
+            continue
+        run_times, _ = missed_run_times(trigger, first, now)
+        missed.append(((chat_id, reminder_id, message), apply_misfire_policy(reminder.frequency, run_times)))
+    queued = queue_missed_runs(missed)
+    if missed:
+        logger.info("Caught up on %d reminders missed during downtime from %s, queued %d late deliveries",
+                    len(missed), path, queued)
+
+def schedule_warm_start(entries):
+    warm = set()
+    for fire_time, user_id, reminder_id, chat_id, message in entries:
+        scheduler.add_job(
+            send_reminder,
+            DateTrigger(run_date=datetime.datetime.fromtimestamp(fire_time, scheduler.timezone)),
+            args=[chat_id, reminder_id, message],
+            id=job_id_for(user_id, reminder_id),
+            replace_existing=True
+        )
+        warm.add((user_id, reminder_id))
+    return warm
+
+async def schedule_all_reminders(data=None):
+    global _startup_touched, fully_scheduled
+    started = time.monotonic()
+    fully_scheduled = False
+    # (user_id, reminder_id) of jobs in place before the pass: persisted jobs are kept as they are, one-off
+    # jobs from the next-fire snapshot are replaced, and whatever is left over at the end is an orphan
+    keep_existing = job_store is not None and tick_dispatcher is None
+    if keep_existing:
+        existing = await asyncio.to_thread(persisted_reminder_keys)
+        logger.info("Found %d persisted reminder jobs in %s", len(existing), JOB_STORE_FILE)
+    else:
+        existing = set()
+        scheduler.remove_all_jobs()
+    if tick_dispatcher is not None:
+        tick_dispatcher.clear()
+        scheduler.add_job(
+            tick_dispatcher.tick,
+            CronTrigger(second=0, timezone=scheduler.timezone),
+            id="dispatch_tick",
+            jobstore="memory",
+            # a tick that runs too late is skipped; the next one dispatches the minutes it missed
+            misfire_grace_time=30
+        )
+    _startup_touched = set()
+    if data is None:
+        missed = []
+        if tick_dispatcher is None and not keep_existing:
+            missed, upcoming = await asyncio.to_thread(read_next_fire_snapshot, time.time() + WARM_START_WINDOW)
+            existing = schedule_warm_start(upcoming)
+            logger.info("Scheduled %d reminders due in the next %g hours from %s in %.2fs",
+                        len(existing), WARM_START_WINDOW / 3600, NEXT_FIRE_FILE, time.monotonic() - started)
+        data = await load_all_data()
+        if missed:
+            catch_up_from_snapshot(missed, data)
+
+    count = 0
+    slice_started = time.monotonic()
     for user_id, info in data.items():
         user_id = int(user_id)
-        reminders = info.get("reminders", [])
-        
-        for reminder in reminders:
-            reminder_id = reminder.get("id")
-            message = reminder.get("message")
-            time = reminder.get("time")
-            frequency = reminder.get("frequency")
-            chat_id = reminder.get("chat_id", user_id)
-
-            if not (reminder_id and message and time and frequency and chat_id):
-                print(f"Skipping incomplete reminder {reminder_id} for user {user_id} in chat {chat_id}")
+        if user_id in _startup_touched:
+            continue
+        for reminder in info.reminders:
+            key = (user_id, reminder.id)
+            if keep_existing and key in existing:
+                existing.discard(key)
+                count += 1
                 continue
-
             try:
-                if isinstance(time, str):
-                    t = datetime.datetime.strptime(time, "%H:%M").time()
-                else:
-                    t = time
-            except:
-                print(f"Invalid time format for reminder {reminder_id} for user {user_id} in chat {chat_id}: {time}")
-                continue
+                if schedule_reminder(user_id, reminder) is not None:
+                    existing.discard(key)
+            except Exception as e:
+                logger.error("Error scheduling reminder %s for user %s: %s", reminder.id, user_id, e)
+            count += 1
+        if time.monotonic() - slice_started > SCHEDULE_SLICE:
+            # let pending updates run between slices
+            await asyncio.sleep(0)
+            slice_started = time.monotonic()
 
-            if frequency == "everyday":
-                scheduler.add_job(
-                    send_reminder,
-                    CronTrigger(hour=t.hour, minute=t.minute),
-                    args=[chat_id, reminder_id, message],
-                    id=f"{chat_id}_{reminder_id}_everyday"
-                )
-                print(f"Scheduled everyday reminder {reminder_id} for chat {chat_id} at {t.strftime('%H:%M')}")
-
-            elif frequency == "weekdays":
-                weekdays = reminder.get("weekdays", [])
-                for day_name in weekdays:
-                    if day_name in weekday_map:
-                        scheduler.add_job(
-                            send_reminder,
-                            CronTrigger(day_of_week=weekday_map[day_name], hour=t.hour, minute=t.minute),
-                            args=[chat_id, reminder_id, message],
-                            id=f"{chat_id}_{reminder_id}_weekdays_{day_name}"
-                        )
-                        print(f"Scheduled weekdays reminder {reminder_id} for chat {chat_id} on {day_name} at {t.strftime('%H:%M')}")
-                    else:
-                        print(f"Invalid weekday name for reminder {reminder_id} for chat {chat_id}: {day_name}")
-
-            elif frequency == "weekly":
-                day_name = reminder.get("weekly_day")
-                if day_name in weekday_map:
-                    scheduler.add_job(
-                        send_reminder,
-                        CronTrigger(day_of_week=weekday_map[day_name], hour=t.hour, minute=t.minute),
-                        args=[chat_id, reminder_id, message],
-                        id=f"{chat_id}_{reminder_id}_weekly"
-                    )
-                    print(f"Scheduled weekly reminder {reminder_id} for chat {chat_id} on {day_name} at {t.strftime('%H:%M')}")
-
-            elif frequency == "monthly":
-                day = reminder.get("monthly_day")
-                if isinstance(day, int):
-                    schedule_monthly_jalali(chat_id, reminder_id, message, day, t)
-                    print(f"Scheduled monthly reminder {reminder_id} for chat {chat_id} on day {day} at {t.strftime('%H:%M')}")
-
-            elif frequency == "once":
-                jalali_str = reminder.get("once_date")
-                try:
-                    jalali_date = JalaliDate.strptime(jalali_str, "%Y/%m/%d")
-                    g_date = jalali_date.to_gregorian()
-                    dt = datetime.datetime.combine(g_date, t)
-                    if dt > datetime.datetime.now():
-                        scheduler.add_job(
-                            send_reminder,
-                            DateTrigger(run_date=dt),
-                            args=[chat_id, reminder_id, message],
-                            id=f"{chat_id}_{reminder_id}_once"
-                        )
-                        print(f"Scheduled one-time reminder {reminder_id} for chat {chat_id} on {jalali_str} at {t.strftime('%H:%M')}")
-                except:
-                    print(f"Invalid date format for reminder {reminder_id} for chat {chat_id}: {jalali_str}")
-                    continue
-
-            elif frequency == "multi_date":
-                dates = reminder.get("multi_dates", [])
-                for i, d in enumerate(dates):
-                    try:
-                        jalali_date = JalaliDate.strptime(d, "%Y/%m/%d")
-                        g_date = jalali_date.to_gregorian()
-                        dt = datetime.datetime.combine(g_date, t)
-                        if dt > datetime.datetime.now():
-                            scheduler.add_job(
-                                send_reminder,
-                                DateTrigger(run_date=dt),
-                                args=[chat_id, reminder_id, message],
-                                id=f"{chat_id}_{reminder_id}_multi_{i}"
-                            )
-                            print(f"Scheduled multi-date reminder {reminder_id} for chat {chat_id} on {d} at {t.strftime('%H:%M')}")
-                    except:
-                        print(f"Invalid date format for reminder {reminder_id} for chat {chat_id}: {d}")
-                        continue
\ No newline at end of file
+    for user_id, reminder_id in existing:
+        if user_id not in _startup_touched:
+            unschedule_reminder(user_id, reminder_id)
+    _startup_touched = None
+    fully_scheduled = True
+    logger.info("Scheduled %d reminders of %d users in %.2fs", count, len(data), time.monotonic() - started)
+    return count
@@ -0,0 +1,61 @@
+import datetime
+from apscheduler.triggers.base import BaseTrigger
+from persiantools.jdatetime import JalaliDate
+
+def _start_of_search(previous_fire_time, now):
+    # the next fire time must be strictly after the previous one, or not before now on the first run
+    if previous_fire_time is not None:
+        return previous_fire_time + datetime.timedelta(seconds=1)
+    return now
+
+class JalaliMonthlyTrigger(BaseTrigger):
+    __slots__ = ("day", "hour", "minute", "timezone")
+
+    def __init__(self, day, hour, minute, timezone):
+        self.day = day
+        self.hour = hour
+        self.minute = minute
+        self.timezone = timezone
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        start = _start_of_search(previous_fire_time, now).astimezone(self.timezone)
+        today = JalaliDate(start.date())
+        year, month = today.year, today.month
+        # months too short for the day are skipped, so look a little over a year ahead
+        for i in range(13):
+            m = month + i
+            y = year + (m - 1) // 12
+            m = (m - 1) % 12 + 1
+            if self.day > JalaliDate.days_in_month(m, y):
+                continue
+            g_date = JalaliDate(y, m, self.day).to_gregorian()
+            run_dt = datetime.datetime.combine(g_date, datetime.time(self.hour, self.minute), tzinfo=self.timezone)
+            if run_dt >= start:
+                return run_dt
+        return None
+
+    def __str__(self):
+        return f"jalali_monthly[day={self.day}, time={self.hour:02d}:{self.minute:02d}]"
+
+class JalaliMultiDateTrigger(BaseTrigger):
+    __slots__ = ("dates", "hour", "minute", "timezone")
+
+    def __init__(self, dates, hour, minute, timezone):
+        # dates are Gregorian dates, already converted from the Jalali input
+        self.dates = sorted(set(dates))
+        self.hour = hour
+        self.minute = minute
+        self.timezone = timezone
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        start = _start_of_search(previous_fire_time, now).astimezone(self.timezone)
+        for g_date in self.dates:
+            if g_date < start.date():
+                continue
+            run_dt = datetime.datetime.combine(g_date, datetime.time(self.hour, self.minute), tzinfo=self.timezone)
+            if run_dt >= start:
+                return run_dt
+        return None
+
+    def __str__(self):
+        return f"jalali_dates[{len(self.dates)} dates, time={self.hour:02d}:{self.minute:02d}]"
@@ -0,0 +1,331 @@
+import csv
+import datetime
+import io
+from zoneinfo import ZoneInfo
+from persiantools.jdatetime import JalaliDate
+import scheduler
+from .constants import FREQUENCY_TYPES, IMPORT_MAX_REMINDERS
+from .models import Reminder, WEEKDAY_MAP, parse_time, format_time, weekdays_to_mask, mask_to_weekdays, format_jalali_date
+
+# Telegram rejects longer messages, so such a reminder could never be sent
+_MAX_MESSAGE_LENGTH = 4096
+
+CSV_COLUMNS = ("message", "time", "frequency", "days", "dates", "chat_id")
+
+# iCalendar BYDAY codes by datetime.weekday() number
+_ICS_DAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+_DAY_NAMES = {number: name for name, number in WEEKDAY_MAP.items()}
+
+def parse_date(text):
+    # "YYYY/MM/DD" or "YYYY-MM-DD" -> Gregorian date ordinal; years before 1700 are read as Jalali
+    try:
+        year, month, day = (int(part) for part in text.strip().replace("-", "/").split("/"))
+        if year < 1700:
+            return JalaliDate(year, month, day).to_gregorian().toordinal()
+        return datetime.date(year, month, day).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+def _split(text):
+    # lists inside one CSV cell are separated by ";" so they need no quoting
+    return [item.strip() for item in (text or "").split(";") if item.strip()]
+
+def _check(reminder):
+    # the same rules the conversation enforces step by step; returns an error or None
+    if not reminder.message:
+        return "متن پیام خالی است"
+    if len(reminder.message) > _MAX_MESSAGE_LENGTH:
+        return f"متن پیام بیشتر از {_MAX_MESSAGE_LENGTH} نویسه است"
+    if reminder.minute is None:
+        return "ساعت نامعتبر است (مثلاً 14:30)"
+    if reminder.frequency not in FREQUENCY_TYPES:
+        return f"الگوی تکرار باید یکی از {', '.join(FREQUENCY_TYPES)} باشد"
+    if reminder.frequency == "weekly" and bin(reminder.weekdays).count("1") != 1:
+        return "برای تکرار هفتگی دقیقاً یک روز هفته لازم است"
+    if reminder.frequency == "weekdays" and not reminder.weekdays:
+        return "برای تکرار چند روز هفته حداقل یک روز لازم است"
+    if reminder.frequency == "monthly" and not (isinstance(reminder.monthly_day, int) and 1 <= reminder.monthly_day <= 31):
+        return "روز ماه باید عددی بین 1 تا 31 باشد"
+    if reminder.frequency == "once" and len(reminder.dates) != 1:
+        return "برای یک تاریخ مشخص دقیقاً یک تاریخ لازم است"
+    if reminder.frequency == "multi_date" and not reminder.dates:
+        return "برای چند تاریخ مشخص حداقل یک تاریخ لازم است"
+    return None
+
+def _from_row(row):
+    frequency = (row.get("frequency") or "").strip()
+    reminder = Reminder(None, message=(row.get("message") or "").strip(), frequency=frequency, minute=parse_time((row.get("time") or "").strip()))
+    days = _split(row.get("days"))
+    if frequency in ("weekly", "weekdays"):
+        unknown = [day for day in days if day not in WEEKDAY_MAP]
+        if unknown:
+            return None, f"روز هفته نامعتبر: {', '.join(unknown)}"
+        reminder.weekdays = weekdays_to_mask(days)
+    elif frequency == "monthly":
+        reminder.monthly_day = int(days[0]) if len(days) == 1 and days[0].isdigit() else None
+    elif frequency in ("once", "multi_date"):
+        dates = _split(row.get("dates"))
+        ordinals = [parse_date(d) for d in dates]
+        bad = [d for d, o in zip(dates, ordinals) if o is None]
+        if bad:
+            return None, f"تاریخ نامعتبر: {', '.join(bad)} (مثلاً 1404/04/10 یا 2025-07-01)"
+        reminder.dates = tuple(sorted(set(ordinals)))
+    chat_id = (row.get("chat_id") or "").strip()
+    if chat_id:
+        try:
+            reminder.chat_id = int(chat_id)
+        except ValueError:
+            return None, f"شناسه مقصد نامعتبر: {chat_id}"
+    return reminder, _check(reminder)
+
+def parse_csv(lines):
+    # lines: any iterable of text lines, read one row at a time; returns (reminders, errors) and
+    # the reminders are only meant to be stored when there are no errors
+    reader = csv.DictReader(lines)
+    missing = [column for column in ("message", "time", "frequency") if column not in (reader.fieldnames or ())]
+    if missing:
+        return [], [f"سطر اول باید نام ستون‌ها باشد؛ ستون‌های ناموجود: {', '.join(missing)}"]
+    reminders, errors = [], []
+    for row in reader:
+        if not any((value or "").strip() for value in row.values() if isinstance(value, str)):
+            continue
+        if len(reminders) + len(errors) >= IMPORT_MAX_REMINDERS:
+            errors.append(f"فایل بیش از {IMPORT_MAX_REMINDERS} یادآور دارد")
+            break
+        reminder, error = _from_row(row)
+        if error:
+            errors.append(f"سطر {reader.line_num}: {error}")
+        else:
+            reminders.append(reminder)
+    return reminders, errors
+
+def _unfold(lines):
+    # iCalendar continues a long line on the next one, which starts with a space or tab
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+def _unescape(text):
+    out = []
+    chars = iter(text)
+    for c in chars:
+        if c == "\\":
+            c = next(chars, "")
+            out.append("\n" if c in ("n", "N") else c)
+        else:
+            out.append(c)
+    return "".join(out)
+
+def _parse_datetime(value, params):
+    # -> local (date ordinal, minute), or None for all-day dates and values that do not parse
+    try:
+        if "T" not in value:
+            return None
+        moment = datetime.datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S")
+    except ValueError:
+        return None
+    local = scheduler.scheduler.timezone
+    if value.endswith("Z"):
+        moment = moment.replace(tzinfo=datetime.timezone.utc).astimezone(local)
+    elif "TZID" in params:
+        try:
+            moment = moment.replace(tzinfo=ZoneInfo(params["TZID"])).astimezone(local)
+        except (KeyError, ValueError):
+            return None
+    return moment.toordinal(), moment.hour * 60 + moment.minute
+
+def _unknown_zone(params):
+    # the TZID of a date-time that ZoneInfo cannot resolve, or None
+    tzid = params.get("TZID")
+    if tzid is None:
+        return None
+    try:
+        ZoneInfo(tzid)
+    except (KeyError, ValueError):
+        return tzid
+    return None
+
+def _from_event(event):
+    summary = event.get("SUMMARY")
+    start = event.get("DTSTART")
+    reminder = Reminder(None, message=_unescape(summary[1]).strip() if summary else "")
+    if start and _unknown_zone(start[0]):
+        return None, f"منطقه زمانی ناشناخته در DTSTART: {start[0]['TZID']}"
+    parsed = _parse_datetime(start[1], start[0]) if start else None
+    if parsed is None:
+        return None, "DTSTART باید تاریخ و ساعت داشته باشد (رویدادهای تمام‌روز پشتیبانی نمی‌شوند)"
+    start_ordinal, reminder.minute = parsed
+    rrule = event.get("RRULE")
+    if rrule is None:
+        dates = {start_ordinal}
+        for params, value in event.get("RDATE", ()):
+            if _unknown_zone(params):
+                return None, f"منطقه زمانی ناشناخته در RDATE: {params['TZID']}"
+            for item in value.split(","):
+                item_parsed = _parse_datetime(item, params) if "T" in item else (parse_date(f"{item[:4]}-{item[4:6]}-{item[6:8]}"), None)
+                if item_parsed is None or item_parsed[0] is None:
+                    return None, f"RDATE نامعتبر: {item}"
+                dates.add(item_parsed[0])
+        reminder.dates = tuple(sorted(dates))
+        reminder.frequency = "once" if len(dates) == 1 else "multi_date"
+        return reminder, _check(reminder)
+
+    rule = dict(part.split("=", 1) for part in rrule[1].split(";") if "=" in part)
+    if rule.get("INTERVAL", "1") != "1" or "COUNT" in rule or "UNTIL" in rule:
+        return None, "RRULE با INTERVAL، COUNT یا UNTIL پشتیبانی نمی‌شود"
+    freq = rule.get("FREQ")
+    if freq == "DAILY":
+        reminder.frequency = "everyday"
+    elif freq == "WEEKLY":
+        codes = rule["BYDAY"].split(",") if "BYDAY" in rule else [_ICS_DAYS[datetime.date.fromordinal(start_ordinal).weekday()]]
+        if any(code not in _ICS_DAYS for code in codes):
+            return None, f"BYDAY نامعتبر: {rule['BYDAY']}"
+        reminder.weekdays = weekdays_to_mask(_DAY_NAMES[_ICS_DAYS.index(code)] for code in codes)
+        reminder.frequency = "weekly" if len(codes) == 1 else "weekdays"
+    elif freq == "MONTHLY" and "X-JALALI-MONTHDAY" in event:
+        # monthly reminders follow the Jalali month, which other calendars cannot express; see export_ics
+        day = event["X-JALALI-MONTHDAY"][1]
+        reminder.monthly_day = int(day) if day.isdigit() else None
+        reminder.frequency = "monthly"
+    elif freq == "MONTHLY":
+        return None, "تکرار ماهانه میلادی پشتیبانی نمی‌شود؛ یادآورهای ماهانه بر اساس ماه شمسی هستند"
+    else:
+        return None, f"RRULE با FREQ={freq} پشتیبانی نمی‌شود"
+    return reminder, _check(reminder)
+
+def parse_ics(lines):
+    # the VEVENTs of an iCalendar file, read one line at a time; returns (reminders, errors) like parse_csv
+    reminders, errors = [], []
+    event = None
+    number = 0
+    # depth of components inside the current event, such as VALARM, whose properties are not the event's
+    nested = 0
+    for line in _unfold(lines):
+        name, _, value = line.partition(":")
+        name, *params = name.split(";")
+        name = name.upper()
+        if name == "BEGIN" and value.upper() == "VEVENT":
+            event = {}
+            nested = 0
+            number += 1
+        elif event is not None and name in ("BEGIN", "END") and (nested or name == "BEGIN"):
+            nested += 1 if name == "BEGIN" else -1
+        elif nested:
+            continue
+        elif name == "END" and value.upper() == "VEVENT" and event is not None:
+            if len(reminders) + len(errors) >= IMPORT_MAX_REMINDERS:
+                errors.append(f"فایل بیش از {IMPORT_MAX_REMINDERS} یادآور دارد")
+                break
+            reminder, error = _from_event(event)
+            if error:
+                errors.append(f"رویداد {number}: {error}")
+            else:
+                reminders.append(reminder)
+            event = None
+        elif event is not None:
+            params = dict(p.split("=", 1) for p in params if "=" in p)
+            if name == "RDATE":
+                event.setdefault("RDATE", []).append((params, value))
+            else:
+                event[name] = (params, value)
+    if number == 0:
+        errors.append("هیچ رویداد VEVENT در فایل پیدا نشد")
+    return reminders, errors
+
+def export_csv(reminders):
+    # yields the file a line at a time; parse_csv reads it back unchanged
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for reminder in reminders:
+        if reminder.frequency in ("weekly", "weekdays"):
+            days = ";".join(mask_to_weekdays(reminder.weekdays))
+        elif reminder.frequency == "monthly":
+            days = reminder.monthly_day or ""
+        else:
+            days = ""
+        writer.writerow((
+            reminder.message or "",
+            format_time(reminder.minute) if reminder.minute is not None else "",
+            reminder.frequency or "",
+            days,
+            ";".join(format_jalali_date(o) for o in reminder.dates),
+            reminder.chat_id or "",
+        ))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # the header row is still in the buffer when there are no reminders
+    yield buffer.getvalue()
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def _fold(line):
+    # lines are limited to 75 octets; continuations start with a space, and UTF-8 characters are not split
+    out, size = [], 0
+    for c in line:
+        length = len(c.encode("utf-8"))
+        if size + length > 75:
+            out.append("\r\n ")
+            size = 1
+        out.append(c)
+        size += length
+    out.append("\r\n")
+    return "".join(out)
+
+def _first_date(reminder, today):
+    # the first day from today on which the reminder fires, used as DTSTART of recurring events
+    for ordinal in range(today, today + 366):
+        date = datetime.date.fromordinal(ordinal)
+        if reminder.frequency == "everyday":
+            return ordinal
+        if reminder.frequency in ("weekly", "weekdays") and reminder.weekdays >> date.weekday() & 1:
+            return ordinal
+        if reminder.frequency == "monthly" and JalaliDate(date).day == reminder.monthly_day:
+            return ordinal
+    return today
+
+def export_ics(user_id, reminders, today=None):
+    # yields the file an event at a time; reminders without a complete schedule have nothing to export
+    tz = scheduler.scheduler.timezone
+    today = today or datetime.datetime.now(tz).toordinal()
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//reminder-bot//reminders//FA\r\nCALSCALE:GREGORIAN\r\n"
+    for reminder in reminders:
+        if _check(reminder) is not None:
+            continue
+        hour, minute = divmod(reminder.minute, 60)
+        if reminder.frequency in ("once", "multi_date"):
+            first, rest = reminder.dates[0], reminder.dates[1:]
+        else:
+            first, rest = _first_date(reminder, today), ()
+        lines = [
+            "BEGIN:VEVENT",
+            f"UID:reminder-{user_id}-{reminder.id}@reminder-bot",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;TZID={tz}:{datetime.date.fromordinal(first):%Y%m%d}T{hour:02d}{minute:02d}00",
+            f"SUMMARY:{_escape(reminder.message)}",
+        ]
+        if rest:
+            lines.append(f"RDATE;TZID={tz}:" + ",".join(f"{datetime.date.fromordinal(o):%Y%m%d}T{hour:02d}{minute:02d}00" for o in rest))
+        if reminder.frequency == "everyday":
+            lines.append("RRULE:FREQ=DAILY")
+        elif reminder.frequency in ("weekly", "weekdays"):
+            lines.append("RRULE:FREQ=WEEKLY;BYDAY=" + ",".join(_ICS_DAYS[day] for day in range(7) if reminder.weekdays >> day & 1))
+        elif reminder.frequency == "monthly":
+            # other calendars repeat on the Gregorian day of DTSTART, which drifts from the Jalali one;
+            # the exact day is kept for importing the file back
+            lines.append(f"RRULE:FREQ=MONTHLY;BYMONTHDAY={datetime.date.fromordinal(first).day}")
+            lines.append(f"X-JALALI-MONTHDAY:{reminder.monthly_day}")
+        lines.append("END:VEVENT")
+        yield "".join(_fold(line) for line in lines)
+    yield "END:VCALENDAR\r\n"
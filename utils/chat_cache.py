@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from .constants import CHAT_TITLE_TTL, ADMIN_CHECK_TTL, ADMIN_CHECK_CONCURRENCY
+from .data import load_chat_data
+
+logger = logging.getLogger(__name__)
+
+# chat_id -> (title, expires_at)
+_titles = {}
+# chat_id -> future of a get_chat call already in flight
+_inflight = {}
+# the one load of the stored titles; concurrent first callers all wait for it
+_seeding = None
+# chat_id -> {user_id: (is_admin, expires_at)}
+_admin_status = {}
+_admin_semaphore = asyncio.Semaphore(ADMIN_CHECK_CONCURRENCY)
+
+async def _seed():
+    expires_at = time.monotonic() + CHAT_TITLE_TTL
+    for user_chats in (await load_chat_data()).values():
+        for chat_id, info in user_chats.items():
+            # titles set while the stored ones were loading are newer
+            if info.get("title"):
+                _titles.setdefault(int(chat_id), (info["title"], expires_at))
+
+def set_chat_title(chat_id, title):
+    _titles[int(chat_id)] = (title or "بدون نام", time.monotonic() + CHAT_TITLE_TTL)
+
+def invalidate_chat(chat_id):
+    _titles.pop(int(chat_id), None)
+    _admin_status.pop(int(chat_id), None)
+
+def invalidate_admin(chat_id, user_id=None):
+    if user_id is None:
+        _admin_status.pop(int(chat_id), None)
+    else:
+        _admin_status.get(int(chat_id), {}).pop(user_id, None)
+
+async def _fetch_title(bot, chat_id):
+    try:
+        chat = await bot.get_chat(chat_id)
+    except Exception as e:
+        logger.error("Error getting chat title for chat_id %s: %s", chat_id, e)
+        return None
+    set_chat_title(chat_id, chat.title)
+    return _titles[chat_id][0]
+
+async def get_chat_titles(bot, chat_ids):
+    # returns chat_id -> title, or None for chats the bot can no longer see
+    global _seeding
+    if _seeding is None:
+        _seeding = asyncio.ensure_future(_seed())
+    await _seeding
+    now = time.monotonic()
+    titles = {}
+    pending = {}
+    for chat_id in set(int(c) for c in chat_ids):
+        cached = _titles.get(chat_id)
+        if cached and cached[1] > now:
+            titles[chat_id] = cached[0]
+            continue
+        future = _inflight.get(chat_id)
+        if future is None:
+            future = asyncio.ensure_future(_fetch_title(bot, chat_id))
+            _inflight[chat_id] = future
+            future.add_done_callback(lambda _, chat_id=chat_id: _inflight.pop(chat_id, None))
+        pending[chat_id] = future
+    if pending:
+        results = await asyncio.gather(*pending.values())
+        titles.update(zip(pending.keys(), results))
+    return titles
+
+async def get_chat_title(bot, chat_id):
+    return (await get_chat_titles(bot, [chat_id]))[int(chat_id)]
+
+async def is_chat_admin(bot, user_id, chat_id):
+    # True when both the user and the bot are admins of the chat; API errors propagate and are not cached
+    chat_id = int(chat_id)
+    cached = _admin_status.get(chat_id, {}).get(user_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    async with _admin_semaphore:
+        admins = await bot.get_chat_administrators(chat_id)
+    admin_ids = {admin.user.id for admin in admins}
+    is_admin = user_id in admin_ids and bot.id in admin_ids
+    _admin_status.setdefault(chat_id, {})[user_id] = (is_admin, time.monotonic() + ADMIN_CHECK_TTL)
+    return is_admin
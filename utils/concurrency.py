@@ -0,0 +1,23 @@
+import asyncio
+import functools
+
+# user_id -> [lock, number of updates holding or waiting for it]
+_user_locks = {}
+
+def per_user(handler):
+    # runs updates of different users concurrently while keeping each user's updates in order
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        user = update.effective_user
+        if user is None:
+            return await handler(update, context)
+        entry = _user_locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await handler(update, context)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _user_locks[user.id]
+    return wrapper
@@ -5,9 +5,104 @@ load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 BOT_USERNAME = os.getenv("BOT_USERNAME")
 SUPPORT_USERNAME = os.getenv("SUPPORT_USERNAME")
+# point this at a local fake Bot API server for benchmarks, e.g. http://127.0.0.1:8081/bot
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+
+# "polling" long-polls getUpdates, "webhook" serves updates on WEBHOOK_LISTEN:WEBHOOK_PORT
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+# public URL the reverse proxy forwards to WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
 
 DATA_FILE = "reminders.json"
 CHAT_DATA_FILE = "chat_data.json"
+DB_FILE = os.getenv("DB_FILE", "reminders.db")
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", "reminders.log")
+# "json" keeps everything in DATA_FILE (fine for small installs), "sqlite" uses DB_FILE,
+# "journal" appends changes to JOURNAL_FILE and periodically compacts them into DATA_FILE
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", "1000"))
+# dirty user records are written back after this many seconds, or sooner once this many are pending
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "1.0"))
+FLUSH_MAX_DIRTY = int(os.getenv("FLUSH_MAX_DIRTY", "100"))
+# user records kept in memory; the least recently used ones are dropped once they have been written back
+CACHE_MAX_USERS = int(os.getenv("CACHE_MAX_USERS", "10000"))
+
+# how many updates may be processed at once; updates from the same user are still handled in order
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# "apscheduler" gives every reminder its own job, "tick" runs one job per minute over a time-bucket index
+DISPATCH_ENGINE = os.getenv("DISPATCH_ENGINE", "apscheduler")
+# number of dispatch worker processes; 0 keeps scheduling and sending in the bot process
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "0"))
+# next fire times saved at shutdown; on boot the ones within WARM_START_WINDOW seconds are scheduled first,
+# then the full schedule is rebuilt in the background, yielding to updates every SCHEDULE_SLICE seconds.
+# Dispatch workers always keep jobs in memory and save their shard's times to NEXT_FIRE_FILE.<index>; the tick
+# engine saves none, so it does not catch up on runs missed during downtime
+NEXT_FIRE_FILE = os.getenv("NEXT_FIRE_FILE", "next_fire.jsonl")
+WARM_START_WINDOW = float(os.getenv("WARM_START_WINDOW", "10800"))
+SCHEDULE_SLICE = float(os.getenv("SCHEDULE_SLICE", "0.02"))
+# "memory" rebuilds reminder jobs from storage on every start and catches up on runs missed since the last
+# clean shutdown from NEXT_FIRE_FILE; "sqlite" keeps them in JOB_STORE_FILE across restarts, so runs missed
+# after a crash are caught up too, at the cost of a synchronous SQLite commit whenever a job is added,
+# changed or fires
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+JOB_STORE_FILE = os.getenv("JOB_STORE_FILE", "jobs.sqlite")
+# runs missed while the bot was down, per frequency: "late" delivers every missed run, "coalesce" only the
+# last one and "drop" none; runs missed by more than MISFIRE_GRACE_TIME seconds are always dropped
+MISFIRE_POLICY = dict(item.split("=") for item in os.getenv(
+    "MISFIRE_POLICY", "everyday=coalesce,weekly=coalesce,weekdays=coalesce,monthly=coalesce,once=late,multi_date=late"
+).split(","))
+MISFIRE_GRACE_TIME = float(os.getenv("MISFIRE_GRACE_TIME", "86400"))
+
+# Telegram delivery limits: messages per second overall, per private chat, and per minute per group/channel
+GLOBAL_SEND_RATE = float(os.getenv("GLOBAL_SEND_RATE", "30"))
+PRIVATE_CHAT_SEND_RATE = float(os.getenv("PRIVATE_CHAT_SEND_RATE", "1"))
+GROUP_SEND_RATE_PER_MINUTE = float(os.getenv("GROUP_SEND_RATE_PER_MINUTE", "20"))
+# send_message calls that may be in flight at once
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "32"))
+# seconds a Bot API call may wait for a free pooled connection before failing with TimedOut
+BOT_API_POOL_TIMEOUT = float(os.getenv("BOT_API_POOL_TIMEOUT", "10"))
+# missed reminders delivered after downtime share the global budget at no more than this many per second
+CATCH_UP_SEND_RATE = float(os.getenv("CATCH_UP_SEND_RATE", "5"))
+
+# pending deliveries are journaled to OUTBOX_FILE; ones that keep failing end up in DEAD_LETTER_FILE
+OUTBOX_FILE = os.getenv("OUTBOX_FILE", "outbox.log")
+DEAD_LETTER_FILE = os.getenv("DEAD_LETTER_FILE", "dead_letters.jsonl")
+MAX_SEND_ATTEMPTS = int(os.getenv("MAX_SEND_ATTEMPTS", "5"))
+# RetryAfter answers pause sending instead of counting as attempts; a reminder throttled this often is given up
+MAX_THROTTLED_SENDS = int(os.getenv("MAX_THROTTLED_SENDS", "50"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "300"))
+
+# hot path log events (reminders scheduled, queued, sent, ...) are sampled to LOG_SAMPLE_RATE per second
+# per event type; 0 writes all of them
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "20"))
+# Prometheus metrics are served on http://METRICS_HOST:METRICS_PORT/metrics; 0 turns the endpoint off
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# comma separated Telegram user ids allowed to run /profile, which profiles the bot for up to PROFILE_MAX_SECONDS
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# seconds a cached chat title is trusted before get_chat is called again
+CHAT_TITLE_TTL = float(os.getenv("CHAT_TITLE_TTL", "3600"))
+# seconds a (user, chat) admin check is trusted, and how many admin checks may run at once
+ADMIN_CHECK_TTL = float(os.getenv("ADMIN_CHECK_TTL", "600"))
+ADMIN_CHECK_CONCURRENCY = int(os.getenv("ADMIN_CHECK_CONCURRENCY", "20"))
+
+# /listreminders shows this many reminders per page, each message cut to this many characters
+REMINDERS_PER_PAGE = int(os.getenv("REMINDERS_PER_PAGE", "5"))
+LIST_MESSAGE_PREVIEW_LENGTH = 300
+# /importReminders takes CSV or iCalendar files up to IMPORT_MAX_BYTES with at most IMPORT_MAX_REMINDERS reminders
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(1024 * 1024)))
+IMPORT_MAX_REMINDERS = int(os.getenv("IMPORT_MAX_REMINDERS", "1000"))
 
 # State constants
 WAITING_FOR_MESSAGE = "waiting_for_message"
@@ -1,68 +1,260 @@
-import json
-import os
-import datetime
 import asyncio
+import logging
+import os
+import time
+import orjson
 import scheduler
-from .constants import DATA_FILE, CHAT_DATA_FILE
+from .constants import CACHE_MAX_USERS, CHAT_DATA_FILE, FLUSH_INTERVAL, FLUSH_MAX_DIRTY
+from .metrics import Counter, Histogram
+from .models import UserRecord
+from .storage import get_storage, opened_storage, write_json_atomic
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# data is "users" (the storage backend) or "chats" (CHAT_DATA_FILE); a user data write is one flushed batch
+storage_seconds = Histogram(
+    "reminder_bot_storage_seconds", "Time spent reading and writing stored data", ["data", "op"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+storage_bytes = Counter("reminder_bot_storage_bytes", "Bytes of stored data read and written", ["data", "op"])
+# a scrape must not open the storage on the event loop, so it reads 0 until the first load has opened it
+storage_bytes.labels("users", "read").set_function(lambda: opened_storage().bytes_read if opened_storage() else 0)
+storage_bytes.labels("users", "write").set_function(lambda: opened_storage().bytes_written if opened_storage() else 0)
 
-def load_user_data(user_id):
-    if os.path.exists(DATA_FILE):
+# write-back cache of UserRecord objects, keyed by str(user_id) and kept in least recently used order;
+# cached records are never mutated
+_cache = {}
+_dirty = set()
+# str(user_id) -> number of flushed batches holding the user that have not reached the storage yet
+_writing = {}
+_flush_handle = None
+cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "flushes": 0, "flushed_users": 0, "failed_flushes": 0}
+
+# every write goes through one writer task, so writes reach the disk in the order they were made
+_write_queue = None
+_writer_task = None
+
+async def _writer():
+    while True:
+        data, func, args, on_done = await _write_queue.get()
+        started = time.perf_counter()
+        ok = False
         try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            user_data = data.get(str(user_id), {})
-            reminders = user_data.get("reminders", [])
-            for reminder in reminders:
-                if "time" in reminder:
-                    try:
-                        reminder["time"] = datetime.datetime.strptime(reminder["time"], "%H:%M").time()
-                    except:
-                        reminder["time"] = None
-            return user_data
-        except json.JSONDecodeError:
-            print("Failed to decode reminders.json")
-            return {}
-    return {}
+            await asyncio.to_thread(func, *args)
+            ok = True
+        except Exception as e:
+            logger.error("Error in storage writer running %s: %s", func.__name__, e)
+        finally:
+            storage_seconds.labels(data, "write").observe(time.perf_counter() - started)
+            if on_done is not None:
+                on_done(ok)
+            _write_queue.task_done()
+
+def _submit_write(data, func, *args, on_done=None):
+    # on_done(ok) is called on the event loop once the write has finished or failed
+    global _write_queue, _writer_task
+    if _writer_task is None:
+        _write_queue = asyncio.Queue()
+        _writer_task = asyncio.create_task(_writer())
+    _write_queue.put_nowait((data, func, args, on_done))
+
+async def close_user_data():
+    global _writer_task
+    flush_user_data()
+    if _writer_task is not None:
+        await _write_queue.join()
+        _writer_task.cancel()
+        _writer_task = None
+
+async def _get_record(user_id):
+    key = str(user_id)
+    record = _cache.get(key)
+    if record is None:
+        cache_stats["misses"] += 1
+        started = time.perf_counter()
+        with span("storage", "load_user"):
+            # the first miss opens the storage, in the worker thread
+            record = await asyncio.to_thread(lambda: get_storage().get_user(user_id))
+        storage_seconds.labels("users", "read").observe(time.perf_counter() - started)
+        # a save may have landed while the read was in flight
+        record = _cache.setdefault(key, record)
+        _evict()
+    else:
+        cache_stats["hits"] += 1
+        _cache[key] = _cache.pop(key)
+    return record
+
+def _evict():
+    # drops the least recently used records beyond CACHE_MAX_USERS; records not yet written back are kept,
+    # since reading them from the storage would bring back older data
+    excess = len(_cache) - CACHE_MAX_USERS
+    if excess <= 0:
+        return
+    victims = []
+    for key in _cache:
+        if len(victims) >= excess:
+            break
+        if key not in _dirty and key not in _writing:
+            victims.append(key)
+    for key in victims:
+        del _cache[key]
+    cache_stats["evictions"] += len(victims)
+
+def flush_user_data():
+    global _flush_handle
+    if _flush_handle is not None:
+        _flush_handle.cancel()
+        _flush_handle = None
+    if not _dirty:
+        return
+    batch = {key: _cache[key] for key in _dirty}
+    _dirty.clear()
+    for key in batch:
+        _writing[key] = _writing.get(key, 0) + 1
+    _submit_write("users", _put_users, batch, on_done=lambda ok: _flushed(batch, ok))
+    cache_stats["flushes"] += 1
+    cache_stats["flushed_users"] += len(batch)
+
+def _put_users(batch):
+    get_storage().put_users(batch)
 
-def load_chat_data():
+def _flushed(batch, ok):
+    global _flush_handle
+    for key in batch:
+        _writing[key] -= 1
+        if not _writing[key]:
+            del _writing[key]
+    if ok:
+        return
+    # the users were taken off _dirty when the batch was queued; they go back so a later flush writes their
+    # latest records, after FLUSH_INTERVAL rather than at once, so a failing disk is not retried in a tight loop
+    cache_stats["failed_flushes"] += 1
+    _dirty.update(batch)
+    if _flush_handle is None:
+        _flush_handle = asyncio.get_running_loop().call_later(FLUSH_INTERVAL, flush_user_data)
+
+def _schedule_flush():
+    global _flush_handle
+    if len(_dirty) >= FLUSH_MAX_DIRTY:
+        flush_user_data()
+        return
+    if _flush_handle is None:
+        _flush_handle = asyncio.get_running_loop().call_later(FLUSH_INTERVAL, flush_user_data)
+
+async def load_user_data(user_id):
+    record = await _get_record(user_id)
+    # handlers edit reminders in place, so they get copies and the cached record stays untouched
+    return {"reminders": [r.copy() for r in record.reminders]}
+
+async def load_reminder(user_id, reminder_id):
+    # one reminder by id, without copying the user's others; None when there is no such reminder
+    reminder = (await _get_record(user_id)).get(reminder_id)
+    return reminder.copy() if reminder is not None else None
+
+def _read_chat_data():
     if os.path.exists(CHAT_DATA_FILE):
         try:
-            with open(CHAT_DATA_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            print("Failed to decode chat_data.json")
+            with open(CHAT_DATA_FILE, "rb") as f:
+                raw = f.read()
+            storage_bytes.labels("chats", "read").inc(len(raw))
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            logger.error("Failed to decode %s", CHAT_DATA_FILE)
             return {}
     return {}
 
-def save_chat_data(chat_data):
-    with open(CHAT_DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(chat_data, f, ensure_ascii=False, indent=2)
+# chat data is loaded once and then owned by this module; it only changes through update_user_chats, which
+# applies to the latest data, so updates of different users running concurrently never overwrite each other
+_chat_data = None
+_chat_loading = None
 
-def save_user_data(user_id, user_data):
-    all_data = {}
-    if os.path.exists(DATA_FILE):
+async def _load_chat_data():
+    global _chat_data
+    started = time.perf_counter()
+    with span("storage", "load_chat"):
+        chat_data = await asyncio.to_thread(_read_chat_data)
+    storage_seconds.labels("chats", "read").observe(time.perf_counter() - started)
+    _chat_data = chat_data
+
+async def load_chat_data():
+    # str(user_id) -> {str(chat_id): {"title": ...}}; shared, so callers must not modify it
+    global _chat_loading
+    if _chat_data is None:
+        if _chat_loading is None:
+            _chat_loading = asyncio.ensure_future(_load_chat_data())
         try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                all_data = json.load(f)
-        except json.JSONDecodeError:
-            all_data = {}
+            await _chat_loading
+        except Exception:
+            # the next caller tries again
+            _chat_loading = None
+            raise
+    return _chat_data
+
+def _write_chat_data(chat_data):
+    storage_bytes.labels("chats", "write").inc(write_json_atomic(CHAT_DATA_FILE, chat_data, indent=True))
+
+async def update_user_chats(user_id, changes):
+    # applies str(chat_id) -> info to the user's registered chats, None removing the chat; chats not in
+    # changes are kept as they are now, whatever the caller saw before its own awaits
+    chat_data = await load_chat_data()
+    user_chats = dict(chat_data.get(str(user_id), {}))
+    for chat_id, info in changes.items():
+        if info is None:
+            user_chats.pop(chat_id, None)
+        else:
+            user_chats[chat_id] = info
+    # the per-user dicts are replaced, never changed, so the writer thread can be given a shallow copy
+    chat_data[str(user_id)] = user_chats
+    _submit_write("chats", _write_chat_data, dict(chat_data))
 
-    reminders = user_data.get("reminders", [])
-    serializable_reminders = []
+def _store(user_id, record, reminders, next_id):
+    # unchanged reminders may be shared with the previous record, since cached reminders are never mutated
+    _cache.pop(str(user_id), None)
+    _cache[str(user_id)] = UserRecord(reminders, next_id)
+    _dirty.add(str(user_id))
+    _schedule_flush()
+
+    with span("scheduler", "reschedule_user"):
+        scheduler.reschedule_user(user_id, record.reminders, reminders)
+
+# records carry no version to check saves against: every change below is applied to the latest cached record
+# rather than written back from a copy a handler loaded earlier, so a handler can never overwrite a newer one
+
+async def add_reminder(user_id, reminder):
+    # stores a new reminder under the user's next id, which is also set on the reminder passed in
+    record = await _get_record(user_id)
+    reminder.id = record.next_id
+    _store(user_id, record, record.reminders + [reminder.copy()], record.next_id + 1)
+    return reminder.id
+
+async def add_reminders(user_id, reminders):
+    # stores many new reminders as one change: one write of the user's record and one scheduling pass over
+    # the new reminders only; each reminder gets its id like in add_reminder
+    record = await _get_record(user_id)
+    next_id = record.next_id
     for reminder in reminders:
-        serializable_reminder = {}
-        for key, value in reminder.items():
-            if key == "time" and isinstance(value, datetime.time):
-                serializable_reminder[key] = value.strftime("%H:%M")
-            elif isinstance(value, set):
-                serializable_reminder[key] = list(value)
-            else:
-                serializable_reminder[key] = value
-        serializable_reminders.append(serializable_reminder)
-
-    all_data[str(user_id)] = {"reminders": serializable_reminders}
-
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
-
-    asyncio.create_task(scheduler.schedule_all_reminders())
\ No newline at end of file
+        reminder.id = next_id
+        next_id += 1
+    _store(user_id, record, record.reminders + [r.copy() for r in reminders], next_id)
+    return len(reminders)
+
+async def put_reminder(user_id, reminder):
+    # replaces the stored reminder with the same id; False when it has been deleted
+    record = await _get_record(user_id)
+    position = record.index.get(reminder.id)
+    if position is None:
+        return False
+    reminders = list(record.reminders)
+    reminders[position] = reminder.copy()
+    _store(user_id, record, reminders, record.next_id)
+    return True
+
+async def remove_reminder(user_id, reminder_id):
+    # returns the position (from 1) the reminder was listed at, or None when there is no such reminder
+    record = await _get_record(user_id)
+    position = record.index.get(reminder_id)
+    if position is None:
+        return None
+    _store(user_id, record, record.reminders[:position] + record.reminders[position + 1:], record.next_id)
+    return position + 1
@@ -1,33 +1,69 @@
+import functools
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 from .constants import DAYS_OF_WEEK
+from .models import weekdays_to_mask, mask_to_weekdays
+
+# markups that never change are built once; PTB objects are frozen after construction, so sharing them is safe
+_MAIN_KEYBOARD = ReplyKeyboardMarkup(
+    [
+        ["یادآور جدید"],
+        ["نمایش آخرین یادآور"],
+        ["نمایش همه یادآورها"],
+        ["پشتیبانی", "راهنما"],
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=False
+)
+
+_CANCEL_KEYBOARD = ReplyKeyboardMarkup(
+    [["لغو ایجاد یادآور جدید"]],
+    resize_keyboard=True,
+    one_time_keyboard=False
+)
+
+_EDIT_CHOICE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("ویرایش پیام", callback_data="edit:message")],
+    [InlineKeyboardButton("ویرایش زمان", callback_data="edit:time")],
+    [InlineKeyboardButton("ویرایش الگوی تکرار", callback_data="edit:frequency")],
+    [InlineKeyboardButton("ویرایش مقصد", callback_data="edit:destination")],
+    [InlineKeyboardButton("تایید و ذخیره", callback_data="edit:confirm")]
+])
+
+_FREQUENCY_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("روزانه", callback_data="freq:everyday")],
+    [InlineKeyboardButton("هفتگی - یک روز", callback_data="freq:weekly")],
+    [InlineKeyboardButton("هفتگی - چند روز", callback_data="freq:weekdays")],
+    [InlineKeyboardButton("ماهانه", callback_data="freq:monthly")],
+    [InlineKeyboardButton("یک تاریخ مشخص", callback_data="freq:once")],
+    [InlineKeyboardButton("چند تاریخ مشخص", callback_data="freq:multi_date")],
+])
+
+_WEEKLY_DAY_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(day, callback_data=f"weekly_day:{day}")] for day in DAYS_OF_WEEK]
+)
+
+# days 1-31, seven to a row
+_MONTH_DAY_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(str(i), callback_data=f"month_day:{i}") for i in range(start, min(start + 7, 32))] for start in range(1, 32, 7)]
+)
 
 def get_main_keyboard():
-    return ReplyKeyboardMarkup(
-        [
-            ["یادآور جدید"],
-            ["نمایش آخرین یادآور"],
-            ["نمایش همه یادآورها"],
-            ["پشتیبانی", "راهنما"],
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=False
-    )
+    return _MAIN_KEYBOARD
 
 def get_cancel_keyboard():
-    return ReplyKeyboardMarkup(
-        [["لغو ایجاد یادآور جدید"]],
-        resize_keyboard=True,
-        one_time_keyboard=False
-    )
+    return _CANCEL_KEYBOARD
 
 def get_edit_choice_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("ویرایش پیام", callback_data="edit:message")],
-        [InlineKeyboardButton("ویرایش زمان", callback_data="edit:time")],
-        [InlineKeyboardButton("ویرایش الگوی تکرار", callback_data="edit:frequency")],
-        [InlineKeyboardButton("ویرایش مقصد", callback_data="edit:destination")],
-        [InlineKeyboardButton("تایید و ذخیره", callback_data="edit:confirm")]
-    ])
+    return _EDIT_CHOICE_KEYBOARD
+
+def get_frequency_keyboard():
+    return _FREQUENCY_KEYBOARD
+
+def get_weekly_day_keyboard():
+    return _WEEKLY_DAY_KEYBOARD
+
+def get_month_day_keyboard():
+    return _MONTH_DAY_KEYBOARD
 
 def get_destination_keyboard(admin_chats, include_private=True):
     keyboard = []
@@ -39,14 +75,36 @@ def get_destination_keyboard(admin_chats, include_private=True):
     keyboard.append([InlineKeyboardButton("به‌روزرسانی لیست", callback_data="dest:reload")])
     return InlineKeyboardMarkup(keyboard)
 
-def build_weekdays_keyboard(selected_days):
+@functools.lru_cache(maxsize=128)
+def _weekdays_keyboard(mask):
+    # one markup per set of ticked days; 7 days make 128 sets, so the cache ends up holding all of them
+    selected = set(mask_to_weekdays(mask))
     keyboard = []
     for day in DAYS_OF_WEEK:
-        label = f"✅ {day}" if day in selected_days else day
+        label = f"✅ {day}" if day in selected else day
         keyboard.append([InlineKeyboardButton(label, callback_data=f"toggle_weekday:{day}")])
     keyboard.append([InlineKeyboardButton("✅ تایید", callback_data="confirm_weekdays")])
     return InlineKeyboardMarkup(keyboard)
 
+def build_weekdays_keyboard(selected_days):
+    return _weekdays_keyboard(weekdays_to_mask(selected_days))
+
+@functools.lru_cache(maxsize=1024)
+def get_reminder_buttons(number, reminder_id):
+    # the delete/edit row of one reminder in /listReminders, labelled with its place in the list
+    return (
+        InlineKeyboardButton(f"حذف {number}", callback_data=f"delete:{reminder_id}"),
+        InlineKeyboardButton(f"ویرایش {number}", callback_data=f"edit:{reminder_id}")
+    )
+
+@functools.lru_cache(maxsize=1024)
+def get_reminder_keyboard(reminder_id):
+    # the delete/edit keyboard under /showReminder
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("حذف", callback_data=f"delete:{reminder_id}"),
+        InlineKeyboardButton("ویرایش", callback_data=f"edit:{reminder_id}")
+    ]])
+
 def get_try_again_keyboard(chat_id):
     keyboard = [[InlineKeyboardButton("تلاش مجدد", callback_data=f"register_chat:{chat_id}")]]
-    return InlineKeyboardMarkup(keyboard)
\ No newline at end of file
+    return InlineKeyboardMarkup(keyboard)
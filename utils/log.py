@@ -0,0 +1,78 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+from .constants import LOG_LEVEL, LOG_SAMPLE_RATE
+
+def _quote(value):
+    text = str(value)
+    if text and not any(c in text for c in ' ="\n'):
+        return text
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+class KeyValueFormatter(logging.Formatter):
+    # appends the fields of log_event records as key=value pairs, leaving out the ones that are None
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += "".join(f" {key}={_quote(value)}" for key, value in fields.items() if value is not None)
+        return line
+
+class SamplingFilter(logging.Filter):
+    # lets through at most `rate` records per second of each event type; the number dropped is
+    # reported on the first record of that type let through afterwards
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        # event -> [window start, records let through, records dropped]
+        self.windows = {}
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        if event is None or self.rate <= 0:
+            return True
+        now = time.monotonic()
+        window = self.windows.get(event)
+        if window is None or now - window[0] >= 1:
+            dropped = window[2] if window is not None else 0
+            window = self.windows[event] = [now, 0, 0]
+            if dropped:
+                record.fields = dict(record.fields, dropped=dropped)
+        if window[1] >= self.rate:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # records never leave the process, so they are queued as they are and formatted by the listener thread
+        return record
+
+def setup_logging(prefix=""):
+    # the calling thread only filters and enqueues; formatting and writing happen on the listener thread
+    handler = logging.StreamHandler()
+    handler.setFormatter(KeyValueFormatter(f"%(asctime)s {prefix}%(levelname)s %(name)s: %(message)s"))
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    # APScheduler logs every job added and run at INFO, which is one line per reminder, and httpx every
+    # request, with the bot token in its URL
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    # a structured record for hot paths: sampled per event type, fields formatted only if it is written
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"event": event, "fields": fields})
@@ -0,0 +1,154 @@
+import datetime
+from persiantools.jdatetime import JalaliDate
+from .constants import DAYS_OF_WEEK
+
+# datetime.weekday() number of each Persian day name
+WEEKDAY_MAP = {
+    "دوشنبه": 0,
+    "سه‌شنبه": 1,
+    "چهارشنبه": 2,
+    "پنج‌شنبه": 3,
+    "جمعه": 4,
+    "شنبه": 5,
+    "یک‌شنبه": 6
+}
+
+def parse_time(text):
+    # "HH:MM" -> minutes since midnight, or None when it is not a valid time
+    try:
+        t = datetime.datetime.strptime(text, "%H:%M").time()
+    except (TypeError, ValueError):
+        return None
+    return t.hour * 60 + t.minute
+
+def format_time(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+def parse_jalali_date(text):
+    # "YYYY/MM/DD" in the Jalali calendar -> Gregorian date ordinal, or None when it is not a valid date
+    try:
+        return JalaliDate.strptime(text.strip(), "%Y/%m/%d").to_gregorian().toordinal()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def format_jalali_date(ordinal):
+    return JalaliDate(datetime.date.fromordinal(ordinal)).strftime("%Y/%m/%d")
+
+def weekdays_to_mask(names):
+    mask = 0
+    for name in names:
+        if name in WEEKDAY_MAP:
+            mask |= 1 << WEEKDAY_MAP[name]
+    return mask
+
+def mask_to_weekdays(mask):
+    # day names in the order of the Persian week, starting on Saturday
+    return [name for name in DAYS_OF_WEEK if mask >> WEEKDAY_MAP[name] & 1]
+
+def mask_to_numbers(mask):
+    return [day for day in range(7) if mask >> day & 1]
+
+class Reminder:
+    # minute:      time of day as minutes since midnight
+    # weekdays:    bitmask of datetime.weekday() numbers, for weekly and weekdays reminders
+    # monthly_day: day of the Jalali month, for monthly reminders
+    # dates:       Gregorian date ordinals, for once and multi_date reminders
+    __slots__ = ("id", "chat_id", "message", "frequency", "minute", "weekdays", "monthly_day", "dates")
+
+    def __init__(self, id, chat_id=None, message=None, frequency=None, minute=None, weekdays=0, monthly_day=None, dates=()):
+        self.id = id
+        self.chat_id = chat_id
+        self.message = message
+        self.frequency = frequency
+        self.minute = minute
+        self.weekdays = weekdays
+        self.monthly_day = monthly_day
+        self.dates = dates
+
+    def __eq__(self, other):
+        if not isinstance(other, Reminder):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"Reminder({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+    def copy(self):
+        return Reminder(self.id, self.chat_id, self.message, self.frequency, self.minute, self.weekdays, self.monthly_day, self.dates)
+
+    def clear_schedule(self):
+        self.weekdays = 0
+        self.monthly_day = None
+        self.dates = ()
+
+    def to_dict(self):
+        d = {"id": self.id}
+        if self.chat_id is not None:
+            d["chat_id"] = self.chat_id
+        if self.message is not None:
+            d["message"] = self.message
+        if self.frequency is not None:
+            d["frequency"] = self.frequency
+        if self.minute is not None:
+            d["minute"] = self.minute
+        if self.weekdays:
+            d["weekdays"] = self.weekdays
+        if self.monthly_day is not None:
+            d["monthly_day"] = self.monthly_day
+        if self.dates:
+            d["dates"] = list(self.dates)
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        if "time" in d or isinstance(d.get("weekdays"), list) or "once_date" in d or "multi_dates" in d or "weekly_day" in d:
+            return cls._from_legacy_dict(d)
+        return cls(d["id"], d.get("chat_id"), d.get("message"), d.get("frequency"), d.get("minute"),
+                   d.get("weekdays", 0), d.get("monthly_day"), tuple(d.get("dates", ())))
+
+    @classmethod
+    def _from_legacy_dict(cls, d):
+        # records written before the typed model kept "HH:MM" times, day names and Jalali date strings
+        frequency = d.get("frequency")
+        if frequency == "weekly":
+            weekdays = weekdays_to_mask([d.get("weekly_day")])
+        else:
+            weekdays = weekdays_to_mask(d.get("weekdays") or [])
+        if frequency == "once":
+            jalali_strs = [d.get("once_date")]
+        elif frequency == "multi_date":
+            jalali_strs = d.get("multi_dates") or []
+        else:
+            jalali_strs = []
+        dates = tuple(o for o in (parse_jalali_date(s) for s in jalali_strs) if o is not None)
+        monthly_day = d.get("monthly_day")
+        return cls(d["id"], d.get("chat_id"), d.get("message"), frequency, parse_time(d.get("time")),
+                   weekdays, monthly_day if isinstance(monthly_day, int) else None, dates)
+
+class UserRecord:
+    # next_id: id for the user's next new reminder; ids are never reused, so a deleted reminder's jobs and
+    #          callback buttons can never end up pointing at another reminder
+    __slots__ = ("reminders", "next_id", "_index")
+
+    def __init__(self, reminders=None, next_id=1):
+        self.reminders = reminders if reminders is not None else []
+        self.next_id = max(next_id, max((r.id for r in self.reminders), default=0) + 1)
+        self._index = None
+
+    @property
+    def index(self):
+        # reminder id -> position in reminders; built on first use, cached records are never mutated
+        if self._index is None:
+            self._index = {r.id: position for position, r in enumerate(self.reminders)}
+        return self._index
+
+    def get(self, reminder_id):
+        position = self.index.get(reminder_id)
+        return self.reminders[position] if position is not None else None
+
+    def to_dict(self):
+        return {"reminders": [r.to_dict() for r in self.reminders], "next_id": self.next_id}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls([Reminder.from_dict(r) for r in d.get("reminders", [])], d.get("next_id", 1))
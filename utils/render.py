@@ -0,0 +1,45 @@
+import functools
+from .constants import FREQUENCY_TRANSLATIONS
+from .models import format_time, format_jalali_date, mask_to_weekdays
+
+NOT_SET = "⛔ تنظیم نشده"
+
+@functools.lru_cache(maxsize=128)
+def _weekday_names(mask):
+    return ", ".join(mask_to_weekdays(mask))
+
+# converting to the Jalali calendar dominates rendering dated reminders, and few distinct dates are in use
+_jalali_date = functools.lru_cache(maxsize=4096)(format_jalali_date)
+
+# frequency -> the line describing its days or dates; everyday reminders have none
+_DETAILS = {
+    "weekdays": lambda r: f"📅 روزها: {_weekday_names(r.weekdays)}\n",
+    "weekly": lambda r: f"📅 روز هفته: {_weekday_names(r.weekdays) or '⛔'}\n",
+    "monthly": lambda r: f"📅 روز ماه: {r.monthly_day or '⛔'}\n",
+    "once": lambda r: f"📅 تاریخ: {_jalali_date(r.dates[0]) if r.dates else '⛔'}\n",
+    "multi_date": lambda r: f"📅 تاریخ‌ها: {', '.join(_jalali_date(o) for o in r.dates)}\n",
+}
+
+_CARD = (
+    "{header}"
+    "📝 پیام: {message}\n"
+    "⏰ زمان: {time}\n"
+    "🔁 الگوی تکرار: {frequency}\n"
+    "{details}"
+    "📢 مقصد: {destination}"
+).format
+
+def render_card(reminder, header, destination, preview_length=None):
+    # the text shown for one reminder by /showReminder and /listReminders; header ends with its own line break(s)
+    message = reminder.message or NOT_SET
+    if preview_length is not None and len(message) > preview_length:
+        message = message[:preview_length] + "…"
+    details = _DETAILS.get(reminder.frequency)
+    return _CARD(
+        header=header,
+        message=message,
+        time=format_time(reminder.minute) if reminder.minute is not None else NOT_SET,
+        frequency=FREQUENCY_TRANSLATIONS.get(reminder.frequency, NOT_SET),
+        details=details(reminder) if details else "",
+        destination=destination
+    )
@@ -0,0 +1,37 @@
+from .data import add_reminder, put_reminder
+
+class Session:
+    # state:             one of the WAITING_FOR_* constants, or None while no typed input is expected
+    # reminder:          working copy of the reminder being created or edited; it is written to the user's
+    #                    data by commit(), so an unfinished reminder never reaches storage. A new reminder's
+    #                    id is None until then
+    # editing:           True when an existing reminder is edited, False when a new one is created
+    # selected_weekdays: day names ticked so far on the weekdays keyboard
+    __slots__ = ("state", "reminder", "editing", "selected_weekdays")
+
+    def __init__(self, reminder, editing, state=None):
+        self.state = state
+        self.reminder = reminder
+        self.editing = editing
+        self.selected_weekdays = set()
+
+# user_id -> Session of the conversation in progress; kept in memory only, like PTB's user_data was
+_sessions = {}
+
+def start_session(user_id, reminder, editing, state=None):
+    session = _sessions[user_id] = Session(reminder, editing, state)
+    return session
+
+def get_session(user_id):
+    return _sessions.get(user_id)
+
+def end_session(user_id):
+    _sessions.pop(user_id, None)
+
+async def commit(user_id, session):
+    # stores the session's reminder; returns False when the reminder being edited was deleted meanwhile.
+    # a new reminder gets its permanent id here
+    if session.editing:
+        return await put_reminder(user_id, session.reminder)
+    await add_reminder(user_id, session.reminder)
+    return True
@@ -0,0 +1,301 @@
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import orjson
+from .constants import DATA_FILE, DB_FILE, JOURNAL_FILE, JOURNAL_COMPACT_EVERY, STORAGE_BACKEND
+from .models import Reminder, UserRecord
+
+logger = logging.getLogger(__name__)
+
+def write_json_atomic(path, data, indent=False):
+    # returns the number of bytes written
+    payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(payload)
+
+# every backend counts the bytes it reads and writes in bytes_read and bytes_written
+
+class JsonStorage:
+    def __init__(self, path=DATA_FILE):
+        self.path = path
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def _read_all(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "rb") as f:
+                    raw = f.read()
+                self.bytes_read += len(raw)
+                return orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                logger.error("Failed to decode %s", self.path)
+        return {}
+
+    def get_user(self, user_id):
+        return UserRecord.from_dict(self._read_all().get(str(user_id), {}))
+
+    def put_user(self, user_id, record):
+        self.put_users({str(user_id): record})
+
+    def put_users(self, records):
+        all_data = self._read_all()
+        all_data.update((str(user_id), record.to_dict()) for user_id, record in records.items())
+        self.bytes_written += write_json_atomic(self.path, all_data, indent=True)
+
+    def iter_users(self):
+        return {user_id: UserRecord.from_dict(d) for user_id, d in self._read_all().items()}.items()
+
+    def close(self):
+        pass
+
+class SQLiteStorage:
+    def __init__(self, path=DB_FILE, json_path=DATA_FILE):
+        self.path = path
+        self.bytes_read = 0
+        self.bytes_written = 0
+        # reads run in a thread pool and writes in the writer thread, so the shared connection is guarded
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS reminders ("
+            "user_id INTEGER NOT NULL, "
+            "reminder_id INTEGER NOT NULL, "
+            "chat_id INTEGER, "
+            "position INTEGER NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "PRIMARY KEY (user_id, reminder_id))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_chat ON reminders (chat_id)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, next_id INTEGER NOT NULL DEFAULT 1)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+        if not self._json_imported():
+            # a database that already holds users was filled by an earlier import or by the bot itself;
+            # either way reminders.json is stale and must not bring deleted reminders back
+            if json_path and os.path.exists(json_path) and self._is_empty():
+                migrate_json_to_sqlite(json_path, self)
+            else:
+                with self.conn:
+                    self._mark_json_imported()
+
+    def _is_empty(self):
+        return (
+            self.conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+            and self.conn.execute("SELECT 1 FROM reminders LIMIT 1").fetchone() is None
+        )
+
+    def _json_imported(self):
+        return self.conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone() is not None
+
+    def _mark_json_imported(self):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', '1')")
+
+    def get_user(self, user_id):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT payload FROM reminders WHERE user_id = ? ORDER BY position",
+                (int(user_id),)
+            ).fetchall()
+            user = self.conn.execute("SELECT next_id FROM users WHERE user_id = ?", (int(user_id),)).fetchone() or (1,)
+            self.bytes_read += sum(len(payload) for (payload,) in rows)
+        return UserRecord([Reminder.from_dict(orjson.loads(payload)) for (payload,) in rows], *user)
+
+    def put_user(self, user_id, record):
+        self.put_users({user_id: record})
+
+    def put_users(self, records):
+        with self.lock, self.conn:
+            for user_id, record in records.items():
+                self._write_user(int(user_id), record)
+
+    def _write_user(self, user_id, record):
+        self.conn.execute("INSERT OR REPLACE INTO users (user_id, next_id) VALUES (?, ?)", (user_id, record.next_id))
+        self.conn.execute("DELETE FROM reminders WHERE user_id = ?", (user_id,))
+        rows = [
+            (user_id, r.id, r.chat_id or user_id, position, orjson.dumps(r.to_dict()))
+            for position, r in enumerate(record.reminders)
+        ]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO reminders (user_id, reminder_id, chat_id, position, payload) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        self.bytes_written += sum(len(row[4]) for row in rows)
+
+    def iter_users(self):
+        users = {}
+        reminders = {}
+        with self.lock:
+            for user_id, next_id in self.conn.execute("SELECT user_id, next_id FROM users"):
+                users[str(user_id)] = next_id
+            for user_id, payload in self.conn.execute("SELECT user_id, payload FROM reminders ORDER BY user_id, position"):
+                self.bytes_read += len(payload)
+                reminders.setdefault(str(user_id), []).append(Reminder.from_dict(orjson.loads(payload)))
+        # records are built once their reminders are all read, so next_id accounts for every id
+        return {user_id: UserRecord(reminders.get(user_id, []), users.get(user_id, 1)) for user_id in dict.fromkeys([*users, *reminders])}.items()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class JournalStorage:
+    def __init__(self, path=JOURNAL_FILE, snapshot_path=DATA_FILE, compact_every=JOURNAL_COMPACT_EVERY):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.compacting_path = f"{path}.compacting"
+        self.compact_every = compact_every
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.lock = threading.Lock()
+        self.compactor = None
+        snapshot = JsonStorage(snapshot_path)
+        self.data = {user_id: UserRecord.from_dict(d) for user_id, d in snapshot._read_all().items()}
+        self.bytes_read = snapshot.bytes_read
+        # a leftover .compacting log means we crashed before its snapshot was renamed into place
+        self.pending = self._replay(self.compacting_path) + self._replay(path)
+        if os.path.exists(self.compacting_path):
+            self._write_snapshot(self.data)
+            os.remove(self.compacting_path)
+            if os.path.exists(path):
+                os.remove(path)
+            self.pending = 0
+        self.log = open(path, "ab")
+
+    def _replay(self, path):
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("missing newline")
+                    entry = orjson.loads(line)
+                except ValueError:
+                    # torn write at the tail of the log; cut it off so new entries stay readable
+                    logger.warning("Truncating partial journal entry in %s at byte %d", path, offset)
+                    f.close()
+                    os.truncate(path, offset)
+                    break
+                if entry["op"] == "put":
+                    self.data[str(entry["u"])] = UserRecord.from_dict(entry["p"])
+                offset += len(line)
+                count += 1
+        self.bytes_read += offset
+        return count
+
+    def get_user(self, user_id):
+        return self.data.get(str(user_id)) or UserRecord()
+
+    def put_user(self, user_id, record):
+        self.put_users({user_id: record})
+
+    def put_users(self, records):
+        with self.lock:
+            for user_id, record in records.items():
+                line = orjson.dumps({"u": str(user_id), "op": "put", "p": record.to_dict()}, option=orjson.OPT_APPEND_NEWLINE)
+                self.log.write(line)
+                self.bytes_written += len(line)
+                self.data[str(user_id)] = record
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.pending += len(records)
+        if self.pending >= self.compact_every:
+            self.compact_in_background()
+
+    def iter_users(self):
+        with self.lock:
+            return dict(self.data).items()
+
+    def compact_in_background(self):
+        if self.compactor is not None and self.compactor.is_alive():
+            return
+        self.compactor = threading.Thread(target=self.compact, daemon=True)
+        self.compactor.start()
+
+    def compact(self):
+        # runs in the compactor thread, where an exception would otherwise go unnoticed
+        try:
+            with self.lock:
+                self.log.close()
+                try:
+                    if os.path.exists(self.compacting_path):
+                        # an earlier compaction failed before its snapshot was written, so that file still holds
+                        # entries no snapshot has; the live log is added to it instead of replacing it
+                        with open(self.path, "rb") as src, open(self.compacting_path, "ab") as dst:
+                            shutil.copyfileobj(src, dst)
+                            dst.flush()
+                            os.fsync(dst.fileno())
+                        os.remove(self.path)
+                    else:
+                        os.replace(self.path, self.compacting_path)
+                finally:
+                    self.log = open(self.path, "ab")
+                # records are replaced on write, never mutated, so a shallow copy is a consistent snapshot
+                snapshot = dict(self.data)
+                self.pending = 0
+            self._write_snapshot(snapshot)
+            os.remove(self.compacting_path)
+            logger.info("Compacted %s into %s (%d users)", self.path, self.snapshot_path, len(snapshot))
+        except Exception:
+            logger.exception("Error compacting %s", self.path)
+
+    def _write_snapshot(self, data):
+        self.bytes_written += write_json_atomic(self.snapshot_path, {user_id: record.to_dict() for user_id, record in data.items()})
+
+    def close(self):
+        if self.compactor is not None:
+            self.compactor.join()
+        with self.lock:
+            self.log.close()
+
+def migrate_json_to_sqlite(json_path=DATA_FILE, target=None):
+    if target is None:
+        target = SQLiteStorage(json_path=None)
+    data = dict(JsonStorage(json_path).iter_users())
+    with target.conn:
+        for user_id, record in data.items():
+            target._write_user(int(user_id), record)
+        target._mark_json_imported()
+    logger.info("Migrated %d users from %s to %s", len(data), json_path, target.path)
+    return target
+
+_storage = None
+# the storage is opened on first use in a worker thread, since opening a backend replays its journal or
+# migrates reminders.json; several threads may get there at once and it must happen once
+_storage_lock = threading.Lock()
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if STORAGE_BACKEND == "sqlite":
+                    _storage = SQLiteStorage()
+                elif STORAGE_BACKEND == "journal":
+                    _storage = JournalStorage()
+                else:
+                    _storage = JsonStorage()
+    return _storage
+
+def opened_storage():
+    # the storage if it has been opened, without opening it; for callers on the event loop
+    return _storage
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        logging.basicConfig(level=logging.INFO)
+        migrate_json_to_sqlite(*sys.argv[2:3])
+    else:
+        print("Usage: python -m utils.storage migrate [reminders.json]")
@@ -0,0 +1,116 @@
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import time
+from telegram.request import HTTPXRequest
+from .log import log_event
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# kind is "storage", "scheduler" or "bot_api"
+span_seconds = Histogram("reminder_bot_span_seconds", "Time spent in storage, scheduler and Bot API calls while handling updates", ["kind", "name"])
+
+class Trace:
+    __slots__ = ("started", "handler", "spans", "error")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.handler = None
+        # (kind, name, seconds)
+        self.spans = []
+        self.error = None
+
+# the trace of the update being handled; every handler group runs in the update's task, so it is visible to all of them
+_current = contextvars.ContextVar("trace", default=None)
+
+async def start_trace(update, context):
+    _current.set(Trace())
+
+async def end_trace(update, context):
+    trace = _current.get()
+    if trace is None:
+        return
+    _current.set(None)
+    total = time.perf_counter() - trace.started
+    totals = {"storage": 0.0, "scheduler": 0.0, "bot_api": 0.0}
+    for kind, _, seconds in trace.spans:
+        totals[kind] += seconds
+    log_event(
+        logger, "update.trace",
+        handler=trace.handler,
+        total_ms=round(total * 1000, 1),
+        storage_ms=round(totals["storage"] * 1000, 1),
+        scheduler_ms=round(totals["scheduler"] * 1000, 1),
+        bot_api_ms=round(totals["bot_api"] * 1000, 1),
+        # everything else: parsing, building keyboards, waiting for the user's lock
+        other_ms=round((total - sum(totals.values())) * 1000, 1),
+        spans=",".join(f"{name}:{seconds * 1000:.1f}" for _, name, seconds in trace.spans),
+        error=trace.error
+    )
+
+async def record_error(update, context):
+    trace = _current.get()
+    if trace is not None:
+        trace.error = type(context.error).__name__
+    logger.error("Error while handling an update", exc_info=context.error)
+
+def traced(label):
+    # names the trace after the handler that took the update
+    def decorator(callback):
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            trace = _current.get()
+            if trace is not None:
+                trace.handler = label
+            return await callback(update, context)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def span(kind, name):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        trace.spans.append((kind, name, seconds))
+        span_seconds.labels(kind, name).observe(seconds)
+
+class TracingRequest(HTTPXRequest):
+    async def do_request(self, url, *args, **kwargs):
+        # the last path segment is the Bot API method; the token earlier in the URL is never recorded
+        with span("bot_api", url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, *args, **kwargs)
+
+_profiling = False
+
+async def profile(seconds, limit=40):
+    # profiles the event loop thread, so every handler and reminder send in that time; None if one is already running
+    global _profiling
+    if _profiling:
+        return None
+    _profiling = True
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+        _profiling = False
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    out.write(f"Profile of {seconds:g}s, functions by own time\n")
+    stats.sort_stats("tottime").print_stats(limit)
+    out.write("Functions by cumulative time\n")
+    stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
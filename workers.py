@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from utils.constants import DISPATCH_ENGINE, GLOBAL_SEND_RATE, OUTBOX_FILE, DEAD_LETTER_FILE, NEXT_FIRE_FILE
+from utils.log import setup_logging
+from utils.models import UserRecord
+
+logger = logging.getLogger(__name__)
+
+def shard_for(chat_id, count):
+    return int(chat_id) % count
+
+def split_by_shard(user_id, reminders, count):
+    shards = {}
+    for reminder in reminders:
+        shards.setdefault(shard_for(reminder.chat_id or user_id, count), []).append(reminder)
+    return shards
+
+class WorkerPool:
+    def __init__(self, count):
+        self.count = count
+        # spawn gives each worker a clean interpreter with its own event loop and Bot client
+        context = multiprocessing.get_context("spawn")
+        self.queues = [context.Queue() for _ in range(count)]
+        # changes forwarded before start are sent after the data they apply to; None once started
+        self.backlog = []
+        self.processes = [
+            context.Process(target=worker_main, args=(index, count, self.queues[index]), name=f"dispatch-worker-{index}", daemon=True)
+            for index in range(count)
+        ]
+
+    def start(self, all_data):
+        for process in self.processes:
+            process.start()
+        shards = [{} for _ in range(self.count)]
+        for user_id, info in all_data.items():
+            for shard, reminders in split_by_shard(user_id, info.reminders, self.count).items():
+                shards[shard][user_id] = UserRecord(reminders)
+        for queue, shard_data in zip(self.queues, shards):
+            queue.put(("load", shard_data))
+        # the loaded data may or may not include these changes already; applying one again changes nothing
+        backlog, self.backlog = self.backlog, None
+        for change in backlog:
+            self.forward(*change)
+        logger.info("Started %s dispatch workers", self.count)
+
+    def forward(self, user_id, old_reminders, new_reminders):
+        if self.backlog is not None:
+            self.backlog.append((user_id, old_reminders, new_reminders))
+            return
+        old_shards = split_by_shard(user_id, old_reminders, self.count)
+        new_shards = split_by_shard(user_id, new_reminders, self.count)
+        for shard in old_shards.keys() | new_shards.keys():
+            old, new = old_shards.get(shard, []), new_shards.get(shard, [])
+            if old != new:
+                self.queues[shard].put(("reschedule", user_id, old, new))
+
+    def stop(self):
+        if self.backlog is not None:
+            # stopped before the workers were started
+            return
+        for queue in self.queues:
+            queue.put(("stop",))
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                logger.warning("%s did not stop in time, terminating", process.name)
+                process.terminate()
+
+def worker_main(index, count, queue):
+    setup_logging(prefix=f"[worker {index}] ")
+    asyncio.run(_worker_loop(index, count, queue))
+
+async def _worker_loop(index, count, queue):
+    import scheduler
+    from delivery import DeliveryQueue, TokenBucket
+
+    delivery_queue = DeliveryQueue(scheduler.bot, outbox_path=f"{OUTBOX_FILE}.{index}", dead_letter_path=f"{DEAD_LETTER_FILE}.{index}")
+    # all workers share one bot token, so they split Telegram's global send budget
+    delivery_queue.global_bucket = TokenBucket(GLOBAL_SEND_RATE / count, GLOBAL_SEND_RATE / count)
+    scheduler.delivery_queue = delivery_queue
+    scheduler.use_dispatch_engine(DISPATCH_ENGINE)
+    # each worker saves the next fire times of its own shard; after a restart with a different DISPATCH_WORKERS,
+    # reminders that moved to another shard are not caught up
+    snapshot_path = f"{NEXT_FIRE_FILE}.{index}"
+
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await loop.run_in_executor(None, queue.get)
+        if message[0] == "load":
+            missed, _ = await asyncio.to_thread(scheduler.read_next_fire_snapshot, time.time(), snapshot_path)
+            await scheduler.schedule_all_reminders(message[1])
+            delivery_queue.start()
+            if missed:
+                scheduler.catch_up_from_snapshot(missed, message[1], snapshot_path)
+            scheduler.scheduler.start()
+            logger.info("Worker %s/%s scheduled reminders of %s users", index, count, len(message[1]))
+        elif message[0] == "reschedule":
+            scheduler.reschedule_user(*message[1:])
+        elif message[0] == "stop":
+            break
+
+    scheduler.write_next_fire_snapshot(snapshot_path)
+    scheduler.scheduler.shutdown(wait=False)
+    await delivery_queue.stop()
+    logger.info("Worker %s stopped, delivery stats: %s", index, delivery_queue.stats)